@@ -0,0 +1,5 @@
+"""
+bench - Benchmark and load-test suite for the API and repository layer
+
+Run ``python -m bench.run --help`` from the repository root.
+"""
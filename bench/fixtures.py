@@ -0,0 +1,45 @@
+"""
+bench/fixtures.py - Deterministic product and parameter data for benchmarks
+"""
+import datetime
+import random
+from typing import Any
+
+ENVIRONMENTS = ("production", "staging", "development")
+
+
+def make_fixture(products: int = 200, parameters: int = 50, seed: int = 0) -> dict[str, list[dict[str, Any]]]:
+    """
+    Build a ``{table: [rows]}`` fixture for LocalDatabaseManager.seed().
+
+    :param products: Number of products.
+    :type products: int
+    :param parameters: Number of "*" parameters; each environment overrides a fifth of them.
+    :type parameters: int
+    :param seed: Random seed, so every run sees the same data.
+    :type seed: int
+    :return: The fixture.
+    :rtype: dict[str, list[dict[str, Any]]]
+    """
+    rng = random.Random(seed)
+    epoch = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    product_rows = []
+    for index in range(1, products + 1):
+        created_at = epoch + datetime.timedelta(hours=index)
+        updated_at = created_at + datetime.timedelta(days=rng.randint(1, 90)) if rng.random() < 0.7 else None
+        product_rows.append({
+            "id": index,
+            "title": f"Product {index}",
+            "description": " ".join(rng.choice(("motion", "discovery", "divorce", "custody", "petition", "drafting", "review", "support")) for _ in range(rng.randint(40, 160))),
+            "order_link": f"https://www.cognitoforms.com/kparalegal/product{index}",
+            "image_path": f"/images/product-{index % 12}.jpg",
+            "icon": "fa-solid fa-scale-balanced",
+            "slug": f"product-{index}",
+            "created_at": created_at.isoformat(),
+            "updated_at": updated_at.isoformat() if updated_at else None,
+        })
+    parameter_rows = [{"environment": "*", "key": f"param_{index}", "value": f"value {index}"} for index in range(parameters)]
+    for environment in ENVIRONMENTS:
+        for index in rng.sample(range(parameters), max(1, parameters // 5)):
+            parameter_rows.append({"environment": environment, "key": f"param_{index}", "value": f"{environment} value {index}"})
+    return {"products": product_rows, "parameters": parameter_rows}
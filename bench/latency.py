@@ -0,0 +1,70 @@
+"""
+bench/latency.py - AsyncDatabaseManager wrapper that simulates database round-trip time
+"""
+import asyncio
+import random
+from typing import Any, Optional, Type
+
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from db.managerproxy import AsyncManagerProxy
+from db.supabasemanager import T
+
+
+class LatencyDatabaseManager(AsyncManagerProxy):
+    """
+    Sleeps latency ± jitter seconds before every read and write, standing in for the
+    network hop to Supabase when benchmarking against the local backend.
+
+    :param inner: The manager to delay.
+    :type inner: AsyncDatabaseManager
+    :param latency: Mean delay in seconds.
+    :type latency: float
+    :param jitter: Maximum deviation from latency in seconds (uniformly distributed).
+    :type jitter: float
+    :param seed: Seed for the jitter, so runs are repeatable.
+    :type seed: int
+    """
+    def __init__(self, inner: AsyncDatabaseManager, latency: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        super().__init__(inner)
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    async def _delay(self) -> None:
+        self.calls += 1
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def select_one(self, table: str, result_type: Type[T], condition: dict[str, Any]) -> Optional[T]:
+        await self._delay()
+        return await super().select_one(table, result_type, condition)
+
+    async def select_many(self, table: str, result_type: Type[T], condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None, columns: Optional[list[str]] = None, count: Optional[str] = None) -> tuple[list[T], int]:
+        await self._delay()
+        return await super().select_many(table, result_type, condition, sort_by, sort_direction, start, end, columns, count)
+
+    async def insert(self, table: str, data: dict[str, Any], result_type: Type[T]) -> T:
+        await self._delay()
+        return await super().insert(table, data, result_type)
+
+    async def update(self, table: str, record_id: Any, data: dict[str, Any], result_type: Type[T]) -> T:
+        await self._delay()
+        return await super().update(table, record_id, data, result_type)
+
+    async def delete(self, table: str, record_id: Any) -> bool:
+        await self._delay()
+        return await super().delete(table, record_id)
+
+    async def exists(self, table: str, field: str, value: Any) -> bool:
+        await self._delay()
+        return await super().exists(table, field, value)
+
+    async def count(self, table: str, condition: dict[str, Any], method: str = "exact") -> int:
+        await self._delay()
+        return await super().count(table, condition, method)
+
+    async def exists_many(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> set[Any]:
+        await self._delay()
+        return await super().exists_many(table, field, values, chunk_size)
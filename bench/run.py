@@ -0,0 +1,342 @@
+"""
+bench/run.py - Drive the API and repositories at a given concurrency and report latency, RPS and allocations
+
+The app runs in-process (httpx ASGITransport) on the local database backend, seeded
+with bench.fixtures data. Injected latency stands in for the round trip to Supabase.
+Client and server share one event loop, so absolute numbers include client overhead;
+compare runs made with the same settings on the same machine.
+
+Examples:
+
+    python -m bench.run --concurrency 32 --requests 2000 --latency-ms 20
+    python -m bench.run --save-baseline            # record bench/baselines.json
+    python -m bench.run --scenarios product_slug,sitemap --no-cache
+
+Each scenario runs --runs times and the median of each metric is reported, which keeps
+one noisy run from passing for a regression. Exits with status 1 when a scenario's p95
+latency or RPS regresses beyond --tolerance of the stored baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+
+from bench.fixtures import ENVIRONMENTS, make_fixture
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+
+@dataclass
+class ScenarioResult:
+    requests: int
+    errors: int
+    rps: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+    peak_kib_per_request: float  # Largest transient allocation while serving one request
+    retained_kib_per_request: float  # Memory still held after the request, averaged
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """Select the local backend before main (and util.settings) is imported."""
+    os.environ["DB_BACKEND"] = "local"
+    os.environ["DB_LOCAL_PATH"] = ""
+    os.environ["DB_LOCAL_SEED_PATH"] = ""
+    os.environ["CACHE_ENABLED"] = "false" if args.no_cache else "true"
+    os.environ["DB_SINGLE_FLIGHT"] = "false" if args.no_single_flight else "true"
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+
+def build_app(args: argparse.Namespace) -> tuple[Any, Any]:
+    """
+    Import main, seed its local database and insert the latency layer under the cache
+    and single-flight wrappers.
+
+    :return: The main module and the LatencyDatabaseManager.
+    """
+    import main
+    from bench.latency import LatencyDatabaseManager
+    from db.localmanager import AsyncLocalDatabaseManager
+    from db.managerproxy import AsyncManagerProxy
+
+    parent, manager = None, main.DB_MANAGER
+    while isinstance(manager, AsyncManagerProxy):
+        parent, manager = manager, manager.inner
+    if not isinstance(manager, AsyncLocalDatabaseManager):
+        raise RuntimeError("Benchmarks require the local database backend")
+    manager.local.seed(make_fixture(args.products, args.parameters, args.seed))
+
+    latency = LatencyDatabaseManager(manager, args.latency_ms / 1000, args.jitter_ms / 1000, args.seed)
+    if parent is None:
+        main.DB_MANAGER = latency
+        main.PRODUCTS.manager = latency
+        main.PARAMETERS.manager = latency
+    else:
+        parent.inner = latency
+    return main, latency
+
+
+def make_scenarios(main: Any, client: httpx.AsyncClient, args: argparse.Namespace) -> dict[str, Callable[[random.Random], Awaitable[bool]]]:
+    """
+    Scenario name to a callable that issues one request and returns whether it succeeded.
+    """
+    slugs = [f"product-{index}" for index in range(1, args.products + 1)]
+
+    async def get(path: str) -> bool:
+        response = await client.get(path)
+        return response.status_code < 400
+
+    async def post(path: str, body: Any) -> bool:
+        response = await client.post(path, json=body)
+        return response.status_code < 400
+
+    async def repo_select_page(rng: random.Random) -> bool:
+        await main.PRODUCTS.select_page(limit=50, order=rng.choice(("id", "updated_at")))
+        return True
+
+    async def repo_get_by_slug(rng: random.Random) -> bool:
+        return await main.PRODUCTS.get_by_slug(rng.choice(slugs)) is not None
+
+    async def repo_parameter(rng: random.Random) -> bool:
+        await main.PARAMETERS.get(rng.choice(ENVIRONMENTS), f"param_{rng.randrange(args.parameters)}")
+        return True
+
+    return {
+        "products": lambda rng: get(f"/api/products?limit=50&order={rng.choice(('id', 'updated_at'))}"),
+        "product_slug": lambda rng: get(f"/api/products/{rng.choice(slugs)}"),
+        "parameters": lambda rng: get(f"/api/parameters/{rng.choice(ENVIRONMENTS)}"),
+        "sitemap": lambda rng: get("/sitemap.xml"),
+        "bootstrap": lambda rng: get(f"/api/bootstrap/{rng.choice(ENVIRONMENTS)}"),
+        "batch": lambda rng: post("/api/batch", {"reads": {
+            "product": {"op": "product", "slug": rng.choice(slugs)},
+            "parameters": {"op": "parameters", "environment": rng.choice(ENVIRONMENTS)},
+        }}),
+        "repo_select_page": repo_select_page,
+        "repo_get_by_slug": repo_get_by_slug,
+        "repo_parameter": repo_parameter,
+    }
+
+
+async def measure_allocations(call: Callable[[random.Random], Awaitable[bool]], samples: int, rng: random.Random) -> tuple[float, float]:
+    """
+    Serve samples requests one at a time under tracemalloc.
+
+    :return: Mean peak and mean retained KiB per request.
+    """
+    if samples <= 0:
+        return 0.0, 0.0
+    tracemalloc.start()
+    try:
+        start_current, _ = tracemalloc.get_traced_memory()
+        peaks = []
+        for _ in range(samples):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await call(rng)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+        end_current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return sum(peaks) / samples / 1024, max(0, end_current - start_current) / samples / 1024
+
+
+async def run_scenario(call: Callable[[random.Random], Awaitable[bool]], args: argparse.Namespace, allocations: bool = True) -> ScenarioResult:
+    """
+    Warm up, then issue args.requests requests from args.concurrency concurrent workers
+    and, if allocations, measure args.alloc_samples more under tracemalloc.
+    """
+    rng = random.Random(args.seed)
+    for _ in range(args.warmup):
+        await call(rng)
+
+    latencies: list[float] = []
+    errors = 0
+    remaining = iter(range(args.requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                ok = await call(rng)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            errors += 0 if ok else 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    peak, retained = await measure_allocations(call, args.alloc_samples if allocations else 0, rng)
+    latencies.sort()
+    return ScenarioResult(
+        requests=len(latencies),
+        errors=errors,
+        rps=round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        p50_ms=round(percentile(latencies, 0.50) * 1000, 3),
+        p95_ms=round(percentile(latencies, 0.95) * 1000, 3),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 3),
+        max_ms=round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        peak_kib_per_request=round(peak, 1),
+        retained_kib_per_request=round(retained, 2),
+    )
+
+
+def median_result(runs: list[ScenarioResult]) -> ScenarioResult:
+    """
+    Combine runs of one scenario: the median of each timing, the worst error count, and the
+    allocations of the last run (the only one measured).
+    """
+    def median(name: str, digits: int) -> float:
+        return round(statistics.median(getattr(run, name) for run in runs), digits)
+
+    return ScenarioResult(
+        requests=sum(run.requests for run in runs),
+        errors=max(run.errors for run in runs),
+        rps=median("rps", 1),
+        p50_ms=median("p50_ms", 3),
+        p95_ms=median("p95_ms", 3),
+        p99_ms=median("p99_ms", 3),
+        max_ms=median("max_ms", 3),
+        peak_kib_per_request=runs[-1].peak_kib_per_request,
+        retained_kib_per_request=runs[-1].retained_kib_per_request,
+    )
+
+
+def run_config(args: argparse.Namespace) -> dict[str, Any]:
+    """Settings that must match for two runs to be comparable."""
+    return {
+        "concurrency": args.concurrency,
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "products": args.products,
+        "parameters": args.parameters,
+        "cache": not args.no_cache,
+        "single_flight": not args.no_single_flight,
+    }
+
+
+def compare(results: dict[str, ScenarioResult], baseline: dict[str, Any], tolerance: float, min_delta_ms: float, concurrency: int) -> list[str]:
+    """
+    List regressions: p95 slower, or RPS lower, than the baseline by more than tolerance.
+
+    Differences smaller than min_delta_ms (for RPS: in the mean latency concurrency/rps it
+    implies) are treated as noise, so sub-millisecond scenarios do not flap.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result.p95_ms > base["p95_ms"] * (1 + tolerance) and result.p95_ms - base["p95_ms"] > min_delta_ms:
+            regressions.append(f"{name}: p95 {result.p95_ms:.2f} ms vs baseline {base['p95_ms']:.2f} ms")
+        implied_delta_ms = (concurrency / result.rps - concurrency / base["rps"]) * 1000 if result.rps and base["rps"] else 0.0
+        if result.rps < base["rps"] * (1 - tolerance) and implied_delta_ms > min_delta_ms:
+            regressions.append(f"{name}: {result.rps:.0f} req/s vs baseline {base['rps']:.0f} req/s")
+        if result.errors > base.get("errors", 0):
+            regressions.append(f"{name}: {result.errors} errors vs baseline {base.get('errors', 0)}")
+    return regressions
+
+
+def print_table(results: dict[str, ScenarioResult]) -> None:
+    print(f"{'scenario':<18} {'req':>6} {'err':>4} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'peak KiB':>9} {'kept KiB':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:<18} {result.requests:>6} {result.errors:>4} {result.rps:>9.1f} {result.p50_ms:>8.2f} "
+            f"{result.p95_ms:>8.2f} {result.p99_ms:>8.2f} {result.peak_kib_per_request:>9.1f} {result.retained_kib_per_request:>9.2f}"
+        )
+
+
+async def run(args: argparse.Namespace) -> int:
+    main, latency = build_app(args)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        scenarios = make_scenarios(main, client, args)
+        selected = [name.strip() for name in args.scenarios.split(",")] if args.scenarios else list(scenarios)
+        unknown = [name for name in selected if name not in scenarios]
+        if unknown:
+            print(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(scenarios)})", file=sys.stderr)
+            return 2
+        results = {}
+        for name in selected:
+            runs = [await run_scenario(scenarios[name], args, allocations=index == args.runs - 1) for index in range(args.runs)]
+            results[name] = median_result(runs)
+    await main.DB_MANAGER.aclose()
+
+    print_table(results)
+    print(f"database calls: {latency.calls}")
+    document = {"config": run_config(args), "scenarios": {name: asdict(result) for name, result in results.items()}}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump(document, output, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as output:
+            json.dump(document, output, indent=2)
+            output.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get("config") != document["config"]:
+        print("Baseline was recorded with different settings; not comparing.")
+        return 0
+    regressions = compare(results, baseline["scenarios"], args.tolerance, args.min_delta_ms, args.concurrency)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the API and repositories against the local backend.")
+    parser.add_argument("--scenarios", default="", help="Comma-separated scenarios to run (default: all)")
+    parser.add_argument("--requests", type=int, default=1000, help="Measured requests per scenario run")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per scenario; the median of each metric is reported")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--warmup", type=int, default=50, help="Unmeasured requests before each scenario")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Simulated database round trip")
+    parser.add_argument("--jitter-ms", type=float, default=5.0, help="Uniform jitter around --latency-ms")
+    parser.add_argument("--products", type=int, default=200, help="Products in the fixture")
+    parser.add_argument("--parameters", type=int, default=50, help="'*' parameters in the fixture")
+    parser.add_argument("--alloc-samples", type=int, default=50, help="Requests measured with tracemalloc (0 disables)")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the read cache")
+    parser.add_argument("--no-single-flight", action="store_true", help="Disable request coalescing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Record this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed fractional regression in p95 and RPS")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore latency regressions smaller than this")
+    parser.add_argument("--json", default="", help="Also write results to this JSON file")
+    args = parser.parse_args(argv)
+    if args.runs < 1:
+        parser.error("--runs must be at least 1")
+    return args
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    configure_environment(arguments)
+    sys.exit(asyncio.run(run(arguments)))
@@ -0,0 +1,305 @@
+"""
+db/asyncsupabasemanager.py - Async DatabaseManager backed by a pooled PostgREST client
+"""
+from abc import ABC, abstractmethod
+from typing import Any, Optional, Type
+
+import httpx
+from postgrest import AsyncPostgrestClient
+from postgrest.base_request_builder import APIResponse
+from postgrest.types import CountMethod
+from postgrest.exceptions import APIError
+from tenacity import AsyncRetrying, retry
+
+from db.bulk import CHUNK_RETRY, BulkResult, chunked
+from db.resilience import QUERY_RETRY
+from db.conditions import filter_value
+from db.supabasemanager import T, apply_condition, apply_order, present_values, raise_if_duplicate_key, require_condition, write_chunks_async
+from db.rows import parse_rows
+from util.metrics import instrument_query
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+
+class AsyncDatabaseManager(ABC):
+    """Async counterpart of :class:`db.supabasemanager.DatabaseManager`."""
+
+    @abstractmethod
+    async def select_one(self, table:str, result_type: Type[T], condition: dict[str, Any]) -> Optional[T]:
+        pass
+
+    @abstractmethod
+    async def select_many(self, table:str, result_type: Type[T], condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None, columns: Optional[list[str]] = None, count: Optional[str] = None) -> tuple[list[T], int]:
+        pass
+
+    @abstractmethod
+    async def insert(self, table:str, data: dict[str, Any], result_type: Type[T]) -> T:
+        pass
+
+    @abstractmethod
+    async def update(self, table:str, record_id: Any, data: dict[str, Any], result_type: Type[T]) -> T:
+        pass
+
+    @abstractmethod
+    async def delete(self, table:str, record_id: Any) -> bool:
+        pass
+
+    @abstractmethod
+    async def exists(self, table:str, field: str, value: Any) -> bool:
+        pass
+
+    @abstractmethod
+    async def count(self, table:str, condition: dict[str, Any], method: str = "exact") -> int:
+        pass
+
+    @abstractmethod
+    async def exists_many(self, table:str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> set[Any]:
+        pass
+
+    @abstractmethod
+    async def insert_many(self, table:str, rows: list[dict[str, Any]], result_type: Type[T], chunk_size: Optional[int] = None) -> BulkResult[T]:
+        pass
+
+    @abstractmethod
+    async def upsert_many(self, table:str, rows: list[dict[str, Any]], result_type: Type[T], on_conflict: Optional[list[str]] = None, chunk_size: Optional[int] = None) -> BulkResult[T]:
+        pass
+
+    @abstractmethod
+    async def update_many(self, table:str, condition: dict[str, Any], data: dict[str, Any], result_type: Type[T]) -> list[T]:
+        pass
+
+    @abstractmethod
+    async def delete_where(self, table:str, condition: dict[str, Any]) -> int:
+        pass
+
+    @abstractmethod
+    async def delete_in(self, table:str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> int:
+        pass
+
+    async def ping(self, table: str) -> None:
+        """
+        Raise if the backend cannot answer a trivial query on table (readiness probe).
+        """
+        return None
+
+    async def aclose(self) -> None:
+        """Release any pooled resources held by the manager."""
+        return None
+
+
+def create_http_client(key: str) -> httpx.AsyncClient:
+    """
+    Build the pooled HTTP client shared by every query a manager issues.
+
+    :param key: Supabase service role key used for the apikey/Authorization headers.
+    :type key: str
+    :return: A keep-alive AsyncClient sized from the db_pool_* settings.
+    :rtype: httpx.AsyncClient
+    """
+    limits = httpx.Limits(
+        max_connections=settings.db_pool_max_connections,
+        max_keepalive_connections=settings.db_pool_max_keepalive_connections,
+        keepalive_expiry=settings.db_pool_keepalive_expiry,
+    )
+    return httpx.AsyncClient(
+        headers={"apiKey": key, "Authorization": f"Bearer {key}"},
+        limits=limits,
+        timeout=httpx.Timeout(settings.db_timeout),
+        http2=settings.db_http2,
+        follow_redirects=True,
+    )
+
+
+class AsyncSupabaseManager(AsyncDatabaseManager):
+    def __init__(self):
+        self.url = settings.supabase_url
+        self.key = settings.supabase_service_role_key
+        # Nothing is built or checked until the first query, so importing main never fails or blocks.
+        self._client: Optional[AsyncPostgrestClient] = None
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> AsyncPostgrestClient:
+        """The PostgREST client, created with its connection pool on first use."""
+        if self._client is None:
+            if not self.url or not self.key:
+                raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in .env")
+            self._http_client = create_http_client(self.key)
+            self._client = AsyncPostgrestClient(
+                f"{self.url.rstrip('/')}/rest/v1",
+                headers={"apiKey": self.key, "Authorization": f"Bearer {self.key}"},
+                http_client=self._http_client,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the pooled HTTP client, if one was opened."""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            LOGGER.info("Closed Supabase connection pool.")
+
+    async def ping(self, table: str) -> None:
+        await self.client.table(table).select("id").limit(1).execute()
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("select_one")
+    async def select_one(
+        self,
+        table:str,
+        result_type: Type[T],
+        condition: dict[str, Any],
+        ) -> Optional[T]:
+
+        query = self.client.table(table).select("*")
+        query = apply_condition(query, condition)
+
+        try:
+            result: APIResponse = await query.single().execute()
+        except APIError as e:
+            if e.code == 'PGRST116':  # No match found
+                return None
+            LOGGER.error("Error executing select_one query on table %s with condition %s: %s", table, condition, str(e))
+            raise
+
+        if isinstance(result.data, dict):
+            return parse_rows(table, "select_one", result_type, [result.data])[0]
+        raise ValueError(f"No record found matching the condition: %s", result.data)
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("select_many")
+    async def select_many(
+        self,
+        table:str,
+        result_type: Type[T],
+        condition: dict[str, Any],
+        sort_by: Optional[str] = None,
+        sort_direction: str = "asc",
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        columns: Optional[list[str]] = None,
+        count: Optional[str] = None
+        ) -> tuple[list[T], int]:
+        """
+        Select multiple records from the specified table based on conditions.
+
+        See :meth:`db.supabasemanager.SupabaseManager.select_many` for the parameters.
+
+        :return: A tuple containing a list of parsed BaseModel instances and the total count of matching records.
+        :rtype: tuple[list[BaseModel], int]
+        """
+        query = self.client.table(table).select(*(columns or ["*"]), count=CountMethod(count) if count else None)
+
+        query = apply_condition(query, condition)
+        query = apply_order(query, sort_by, sort_direction)
+        if start is not None and end is not None:
+            query = query.range(start, end)
+
+        result = await query.execute()
+        return parse_rows(table, "select_many", result_type, result.data), result.count  # type: ignore
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("insert")
+    async def insert(self, table: str, data: Any, result_type: Type[T]) -> T:
+        """
+        Insert a record and return it parsed into result_type.
+
+        :raises KeyError: On a duplicate key violation.
+        """
+        if isinstance(data, str):
+            LOGGER.error("CRITICAL: String passed to insert instead of dict. Raising error.")
+            raise ValueError("The 'data' argument must be a dictionary, not a JSON string.")
+
+        try:
+            result = await self.client.table(table).insert(data).execute()
+            if not result.data:
+                LOGGER.error("Result of insert is empty: %s", result)
+                raise ValueError(f"Insert operation failed for table {table} with data: {data}")
+            return result_type(**result.data[0])  # type: ignore
+        except APIError as e:
+            raise_if_duplicate_key(e)
+            raise
+        except Exception as e:
+            LOGGER.error("Error inserting into %s: %s", table, e)
+            LOGGER.exception(e)
+            raise
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("update")
+    async def update(self, table:str, record_id: Any, data: dict[str, Any], result_type: Type[T]) -> T:
+        result = await self.client.table(table).update(data).eq("id", record_id).execute()
+        return result_type(**result.data[0])  # type: ignore
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("delete")
+    async def delete(self, table:str, record_id: Any) -> bool:
+        _ = await self.client.table(table).delete().eq("id", record_id).execute()
+        return True
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("exists")
+    async def exists(self, table:str, field: str, value: Any) -> bool:
+        result = await apply_condition(self.client.table(table).select(field), {field: value}).limit(1).execute()
+        return bool(result.data)
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("count")
+    async def count(self, table: str, condition: dict[str, Any], method: str = "exact") -> int:
+        query = self.client.table(table).select("*", count=CountMethod(method), head=True)
+        result = await apply_condition(query, condition).execute()
+        return result.count or 0
+
+    @instrument_query("exists_many")
+    async def exists_many(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> set[Any]:
+        found: list[Any] = []
+        for _, chunk in chunked(list(dict.fromkeys(values)), chunk_size or settings.db_exists_chunk_size):
+            remaining = chunk
+            while remaining:
+                async for attempt in AsyncRetrying(**QUERY_RETRY):
+                    with attempt:
+                        result = await self.client.table(table).select(field).in_(field, filter_value(remaining)).limit(settings.db_max_rows).execute()
+                page = [row[field] for row in result.data]
+                found.extend(page)
+                if len(page) < settings.db_max_rows:
+                    break
+                present = present_values(remaining, page)
+                remaining = [value for value in remaining if value not in present]
+        return present_values(values, found)
+
+    @staticmethod
+    async def _rows(request: Any) -> list[dict[str, Any]]:
+        return (await request.execute()).data
+
+    @instrument_query("insert_many")
+    async def insert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return await write_chunks_async(table, rows, result_type, lambda chunk: self._rows(self.client.table(table).insert(chunk)), chunk_size)
+
+    @instrument_query("upsert_many")
+    async def upsert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], on_conflict: Optional[list[str]] = None, chunk_size: Optional[int] = None) -> BulkResult[T]:
+        conflict = ",".join(on_conflict or [])
+        return await write_chunks_async(table, rows, result_type, lambda chunk: self._rows(self.client.table(table).upsert(chunk, on_conflict=conflict)), chunk_size)
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("update_many")
+    async def update_many(self, table: str, condition: dict[str, Any], data: dict[str, Any], result_type: Type[T]) -> list[T]:
+        require_condition("update_many", condition)
+        result = await apply_condition(self.client.table(table).update(data), condition).execute()
+        return parse_rows(table, "update_many", result_type, result.data)
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("delete_where")
+    async def delete_where(self, table: str, condition: dict[str, Any]) -> int:
+        require_condition("delete_where", condition)
+        result = await apply_condition(self.client.table(table).delete(), condition).execute()
+        return len(result.data)
+
+    @instrument_query("delete_in")
+    async def delete_in(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> int:
+        deleted = 0
+        for _, chunk in chunked(values, chunk_size or settings.db_bulk_chunk_size):
+            async for attempt in AsyncRetrying(**CHUNK_RETRY):
+                with attempt:
+                    result = await self.client.table(table).delete().in_(field, chunk).execute()
+            deleted += len(result.data)
+        return deleted
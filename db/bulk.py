@@ -0,0 +1,65 @@
+"""
+db/bulk.py - Result types and helpers for the bulk write APIs of DatabaseManager
+"""
+from dataclasses import dataclass, field
+from typing import Any, Generic, Iterator, TypeVar
+
+import httpx
+from postgrest.exceptions import APIError
+from tenacity import retry_if_exception, stop_after_attempt, wait_exponential
+
+T = TypeVar("T")
+
+# Postgres error classes that will fail the same way on every attempt:
+# 22 data exception, 23 integrity constraint violation, 42 syntax error or access rule violation
+PERMANENT_SQLSTATE_CLASSES = ("22", "23", "42")
+
+
+@dataclass
+class RowError:
+    index: int  # Position of the row in the caller's list
+    row: Any
+    message: str
+
+
+@dataclass
+class BulkResult(Generic[T]):
+    """Per-row outcome of a bulk write."""
+    succeeded: list[T] = field(default_factory=list)
+    errors: list[RowError] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def chunked(rows: list[Any], size: int) -> Iterator[tuple[int, list[Any]]]:
+    """
+    Yield (offset, chunk) pairs covering rows in chunks of at most size items.
+    """
+    size = max(1, size)
+    for offset in range(0, len(rows), size):
+        yield offset, rows[offset:offset + size]
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """
+    True for failures worth retrying: network errors and API errors that are not
+    data/constraint/syntax errors.
+    """
+    if isinstance(e, httpx.TransportError):
+        return True
+    if isinstance(e, APIError):
+        code = e.code or ""
+        # PGRST0xx are connection problems; PGRST1xx-3xx are malformed requests
+        return not (code.startswith(PERMANENT_SQLSTATE_CLASSES) or code.startswith(("PGRST1", "PGRST2", "PGRST3")))
+    return False
+
+
+# tenacity arguments for retrying one chunk of a bulk write
+CHUNK_RETRY = dict(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=2, max=10),
+    retry=retry_if_exception(is_transient_error),
+    reraise=True,
+)
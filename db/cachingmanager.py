@@ -0,0 +1,376 @@
+"""
+db/cachingmanager.py - In-process TTL + stale-while-revalidate cache for repository reads
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional, Type
+
+import anyio
+
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from db.bulk import BulkResult
+from db.changefeed import TableChange
+from db.managerproxy import AsyncManagerProxy, query_key
+from db.resilience import CircuitOpenError, deadline, is_unavailable_error
+from db.sharedcache import KeyValueStore
+from db.supabasemanager import T
+from util.metrics import CACHE_REQUESTS
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+InvalidationListener = Callable[[Optional[str]], None]
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    fresh_until: float
+    stale_until: float
+    keep_until: float  # Kept as last-known-good data until then
+
+
+class QueryCache:
+    """
+    Bounded LRU of query results with a per-table TTL and a stale window.
+
+    An entry is fresh until its TTL runs out and may then be served stale (while it is
+    refreshed in the background) until ``stale_ttl`` more seconds have passed. After that
+    it is only returned by last_good, for ``last_good_ttl`` more seconds, when the
+    database cannot be reached.
+    """
+    def __init__(
+        self,
+        max_entries: int = settings.cache_max_entries,
+        default_ttl: float = settings.cache_default_ttl,
+        table_ttls: Optional[dict[str, float]] = None,
+        stale_ttl: float = settings.cache_stale_ttl,
+        last_good_ttl: float = settings.cache_last_good_ttl,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.table_ttls = dict(settings.cache_table_ttls if table_ttls is None else table_ttls)
+        self.stale_ttl = stale_ttl
+        self.last_good_ttl = last_good_ttl
+        self.clock = clock
+        self._entries: OrderedDict[tuple, CacheEntry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl_for(self, table: str) -> float:
+        return self.table_ttls.get(table, self.default_ttl)
+
+    def get(self, key: tuple) -> Optional[CacheEntry]:
+        """
+        Return the entry for key, or None if it is missing or past its stale window.
+        """
+        entry = self.last_good(key)
+        if entry is None or self.clock() >= entry.stale_until:
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def last_good(self, key: tuple) -> Optional[CacheEntry]:
+        """
+        Return the entry for key however old, or None if it is missing or past last_good_ttl.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and self.clock() >= entry.keep_until:
+            del self._entries[key]
+            return None
+        return entry
+
+    def set(self, key: tuple, value: Any, age: float = 0.0) -> None:
+        """
+        Store value for key; age is how many seconds old the value already is.
+        """
+        ttl = self.ttl_for(key[1])
+        if ttl <= 0:
+            return
+        now = self.clock() - age
+        stale_until = now + ttl + self.stale_ttl
+        self._entries[key] = CacheEntry(value, now + ttl, stale_until, stale_until + self.last_good_ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, table: Optional[str] = None) -> None:
+        """
+        Drop every entry for table, or the whole cache when table is None.
+        """
+        if table is None:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if key[1] == table]:
+            del self._entries[key]
+
+
+class CachingDatabaseManager(AsyncManagerProxy):
+    """
+    Serves select_one/select_many/count from a QueryCache and invalidates on writes.
+
+    Expired entries are returned immediately while a single background task reloads
+    them. Results are shared between callers and must be treated as read-only.
+
+    With a shared KeyValueStore, a local miss is looked up in the store (filled by any
+    worker) before going to the database, and invalidations are published to, and
+    picked up from, the other workers through the store's table generations. Store calls
+    run in a worker thread when the store blocks (SQLite), and shared results smaller than
+    ``cache_shared_local_min_bytes`` are read from the store rather than copied locally.
+
+    When a miss cannot be loaded because the database is unavailable (circuit open,
+    deadline passed, network or 5xx errors), the last-known-good result is served instead.
+    """
+    caches_reads = True
+
+    def __init__(self, inner: AsyncDatabaseManager, cache: Optional[QueryCache] = None, shared: Optional[KeyValueStore] = None):
+        super().__init__(inner)
+        self.cache = cache if cache is not None else QueryCache()
+        self.shared = shared
+        self._generations: dict[str, int] = {}
+        self._shared_generations: Optional[dict[str, int]] = None
+        self._next_shared_poll = 0.0
+        self._refreshing: dict[tuple, asyncio.Task] = {}
+        self._listeners: list[InvalidationListener] = []
+        self._changed_at: dict[str, float] = {}
+
+    def add_invalidation_listener(self, listener: InvalidationListener) -> None:
+        """
+        Register a callback invoked with the table name (None for all) after each invalidation.
+        """
+        self._listeners.append(listener)
+
+    async def invalidate(self, table: Optional[str] = None) -> None:
+        """
+        Explicitly invalidate cached reads for table, or for every table when None.
+        """
+        self._invalidate_local(table)
+        if self.shared is None:
+            return
+        shared = self.shared
+        names = [table] if table is not None else list(self._generations)
+
+        def publish() -> dict[str, int]:
+            for name in names:
+                shared.bump_generation(name)
+            return shared.generations()
+
+        try:
+            self._shared_generations = await self._shared_call(publish)
+        except Exception as e:
+            LOGGER.warning("Could not publish invalidation of %s to the shared cache: %s", table, e)
+
+    async def _shared_call(self, function: Callable[..., Any], *args: Any) -> Any:
+        """Call a shared store function, in a worker thread if the store blocks."""
+        if self.shared is not None and self.shared.blocking:
+            return await anyio.to_thread.run_sync(function, *args)
+        return function(*args)
+
+    def _invalidate_local(self, table: Optional[str]) -> None:
+        if table is None:
+            for name in self._generations:
+                self._generations[name] += 1
+        else:
+            self._generations[table] = self._generations.get(table, 0) + 1
+        self.cache.invalidate(table)
+        for listener in self._listeners:
+            try:
+                listener(table)
+            except Exception as e:
+                LOGGER.error("Cache invalidation listener failed for table %s: %s", table, e)
+
+    def apply_change(self, change: TableChange) -> None:
+        """
+        Change tracker listener: drop this worker's cached reads for the changed table.
+
+        Every worker runs its own tracker, so neither the invalidation listeners nor the other
+        workers are notified; shared entries loaded before the change are ignored from now on.
+        """
+        self._generations[change.table] = self._generations.get(change.table, 0) + 1
+        self._changed_at[change.table] = time.time()
+        self.cache.invalidate(change.table)
+
+    async def _poll_shared_generations(self) -> None:
+        """
+        Drop local entries for tables another worker has invalidated since the last poll.
+        """
+        if self.shared is None or self.cache.clock() < self._next_shared_poll:
+            return
+        self._next_shared_poll = self.cache.clock() + settings.cache_shared_poll_interval
+        try:
+            current = await self._shared_call(self.shared.generations)
+        except Exception as e:
+            LOGGER.warning("Could not read shared cache generations: %s", e)
+            return
+        previous, self._shared_generations = self._shared_generations, current
+        if previous is None:
+            return
+        for table, generation in current.items():
+            if previous.get(table, 0) != generation:
+                LOGGER.debug("Table %s was invalidated by another worker.", table)
+                self._invalidate_local(table)
+
+    def _shared_key(self, key: tuple) -> str:
+        table, model = key[1], key[2]
+        generation = (self._shared_generations or {}).get(table, 0)
+        model_id = f"{model.__module__}.{model.__qualname__}({','.join(getattr(model, 'model_fields', ()))})"
+        digest = hashlib.sha1(repr((key[0], model_id, key[3:])).encode()).hexdigest()
+        return f"{table}:{generation}:{digest}"
+
+    @staticmethod
+    def _keep_local(shared_size: Optional[int]) -> bool:
+        """
+        Whether to also keep a result in this worker's LRU: yes unless it is in the shared
+        store and small enough that reading it from there on each use is cheap.
+        """
+        return shared_size is None or shared_size >= settings.cache_shared_local_min_bytes
+
+    async def _get_shared(self, key: tuple, loader: Callable[[], Awaitable[Any]]) -> Optional[tuple[Any]]:
+        if self.shared is None:
+            return None
+        try:
+            found = await self._shared_call(self.shared.get_object, self._shared_key(key))
+        except Exception as e:
+            LOGGER.warning("Shared cache read failed for %s: %s", key[:2], e)
+            return None
+        if found is None:
+            return None
+        (stored_at, value), size = found
+        if stored_at < self._changed_at.get(key[1], 0.0):
+            return None
+        age = max(0.0, time.time() - stored_at)
+        if self._keep_local(size):
+            self.cache.set(key, value, age=age)
+        if age >= self.cache.ttl_for(key[1]):
+            self._refresh_in_background(key, loader)
+        return (value,)
+
+    async def _set_shared(self, key: tuple, value: Any, loaded_at: float) -> Optional[int]:
+        """
+        Publish a loaded result to the shared store.
+
+        :return: Its size in the store, or None if it was not shared.
+        :rtype: Optional[int]
+        """
+        if self.shared is None:
+            return None
+        try:
+            ttl = self.cache.ttl_for(key[1]) + self.cache.stale_ttl
+            return await self._shared_call(self.shared.set_object, self._shared_key(key), (loaded_at, value), ttl)
+        except Exception as e:
+            # e.g. projection models created at runtime cannot be pickled; they stay local
+            LOGGER.debug("Not sharing %s: %s", key[:2], e)
+            return None
+
+    async def _load(self, key: tuple, loader: Callable[[], Awaitable[Any]]) -> Any:
+        table = key[1]
+        generation = self._generations.setdefault(table, 0)
+        loaded_at = time.time()
+        value = await loader()
+        # A write that landed while we were loading makes this result suspect; don't cache it.
+        if self._generations.get(table, 0) == generation:
+            size = await self._set_shared(key, value, loaded_at)
+            if self._generations.get(table, 0) == generation and self._keep_local(size):
+                self.cache.set(key, value)
+        return value
+
+    def _refresh_in_background(self, key: tuple, loader: Callable[[], Awaitable[Any]]) -> None:
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                # The task copied the request's context; give it a deadline of its own
+                with deadline(settings.request_deadline):
+                    await self._load(key, loader)
+            except Exception as e:
+                LOGGER.warning("Background refresh of %s failed; serving stale data: %s", key[:2], e)
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    async def _cached(self, key: tuple, loader: Callable[[], Awaitable[Any]]) -> Any:
+        await self._poll_shared_generations()
+        entry = self.cache.get(key)
+        if entry is None:
+            shared = await self._get_shared(key, loader)
+            if shared is not None:
+                CACHE_REQUESTS.inc(table=key[1], result="shared")
+                return shared[0]
+            CACHE_REQUESTS.inc(table=key[1], result="miss")
+            try:
+                return await self._load(key, loader)
+            except Exception as e:
+                last_good = self.cache.last_good(key) if is_unavailable_error(e) else None
+                if last_good is None:
+                    raise
+                CACHE_REQUESTS.inc(table=key[1], result="last_good")
+                LOGGER.warning("Serving last-known-good %s on %s: %s", key[0], key[1], e)
+                return last_good.value
+        if self.cache.clock() >= entry.fresh_until:
+            CACHE_REQUESTS.inc(table=key[1], result="stale")
+            self._refresh_in_background(key, loader)
+        else:
+            CACHE_REQUESTS.inc(table=key[1], result="hit")
+        return entry.value
+
+    async def _write(self, table: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            result = await call()
+        except CircuitOpenError:
+            # Rejected before reaching the database: nothing changed, keep the last-known-good reads
+            raise
+        except BaseException:
+            await self.invalidate(table)
+            raise
+        await self.invalidate(table)
+        return result
+
+    async def select_one(self, table: str, result_type: Type[T], condition: dict[str, Any]) -> Optional[T]:
+        key = query_key("select_one", table, result_type, condition)
+        return await self._cached(key, lambda: self.inner.select_one(table, result_type, condition))
+
+    async def select_many(self, table: str, result_type: Type[T], condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None, columns: Optional[list[str]] = None, count: Optional[str] = None) -> tuple[list[T], int]:
+        key = query_key("select_many", table, result_type, condition, sort_by, sort_direction, start, end, columns, count)
+        return await self._cached(key, lambda: self.inner.select_many(table, result_type, condition, sort_by, sort_direction, start, end, columns, count))
+
+    async def count(self, table: str, condition: dict[str, Any], method: str = "exact") -> int:
+        key = query_key("count", table, int, condition, count=method)
+        return await self._cached(key, lambda: self.inner.count(table, condition, method))
+
+    async def insert(self, table: str, data: dict[str, Any], result_type: Type[T]) -> T:
+        return await self._write(table, lambda: self.inner.insert(table, data, result_type))
+
+    async def update(self, table: str, record_id: Any, data: dict[str, Any], result_type: Type[T]) -> T:
+        return await self._write(table, lambda: self.inner.update(table, record_id, data, result_type))
+
+    async def delete(self, table: str, record_id: Any) -> bool:
+        return await self._write(table, lambda: self.inner.delete(table, record_id))
+
+    async def insert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return await self._write(table, lambda: self.inner.insert_many(table, rows, result_type, chunk_size))
+
+    async def upsert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], on_conflict: Optional[list[str]] = None, chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return await self._write(table, lambda: self.inner.upsert_many(table, rows, result_type, on_conflict, chunk_size))
+
+    async def update_many(self, table: str, condition: dict[str, Any], data: dict[str, Any], result_type: Type[T]) -> list[T]:
+        return await self._write(table, lambda: self.inner.update_many(table, condition, data, result_type))
+
+    async def delete_where(self, table: str, condition: dict[str, Any]) -> int:
+        return await self._write(table, lambda: self.inner.delete_where(table, condition))
+
+    async def delete_in(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> int:
+        return await self._write(table, lambda: self.inner.delete_in(table, field, values, chunk_size))
+
+    async def aclose(self) -> None:
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        self._refreshing.clear()
+        await super().aclose()
@@ -0,0 +1,304 @@
+"""
+db/changefeed.py - Detect row changes in watched tables and push them to the caches that hold those rows
+
+A ChangeSource reports which tables changed since its last poll. The ChangeTracker polls
+it every ``changefeed_interval`` seconds in each worker and hands every TableChange to its
+listeners (the query cache, the product slug index, the parameter snapshot, the sitemap),
+so they refresh within seconds instead of waiting for their TTLs.
+
+Two sources are provided:
+
+* HighWaterChangeSource asks the database for rows whose created_at/updated_at is past
+  the newest value already seen, less a short overlap for transactions that commit after
+  a later one (an indexed, usually small, query per table) and, every
+  ``changefeed_count_interval`` seconds, counts the table to notice deletes, which leave
+  no timestamp behind.
+* LocalChangeFeedSource reads the change log of the local backend's LocalStore, the
+  stand-in for a database change feed (e.g. logical replication).
+"""
+import asyncio
+import datetime
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+import anyio
+from pydantic import BaseModel
+
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from db.conditions import any_of, gt, gte
+from db.localmanager import AsyncLocalDatabaseManager, LocalStore
+from db.managerproxy import innermost
+from db.resilience import deadline
+from util.metrics import CHANGEFEED_CHANGES, CHANGEFEED_ERRORS
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MARKER_COLUMNS = ["id", "created_at", "updated_at"]
+CHANGEFEED_MODES = ("auto", "poll", "feed", "off")
+
+
+@dataclass(frozen=True)
+class TableChange:
+    table: str
+    ids: frozenset = frozenset()  # Rows inserted or updated
+    complete: bool = True  # False when rows may also have been deleted (or changes were missed): reload the table
+
+
+ChangeListener = Callable[[TableChange], None]
+
+
+class ChangeMarker(BaseModel):
+    """The columns a high-water poll fetches for each changed row."""
+    id: Any = None
+    created_at: Optional[datetime.datetime] = None
+    updated_at: Optional[datetime.datetime] = None
+
+
+@dataclass
+class HighWaterMarks:
+    created: datetime.datetime
+    updated: datetime.datetime
+    total: int  # Exact count at the last reconciliation plus the rows created since
+    next_count: float = 0.0  # When (clock()) to count the table again
+    seen: dict[Any, tuple] = field(default_factory=dict)  # id -> (created_at, updated_at) of rows inside the overlap window
+
+
+class ChangeSource(ABC):
+    """Reports the changes to its tables since the previous poll; the first poll only sets the starting point."""
+
+    @abstractmethod
+    async def poll(self) -> list[TableChange]:
+        pass
+
+
+class HighWaterChangeSource(ChangeSource):
+    """
+    Change source for any backend: incremental ``gte`` queries on created_at/updated_at plus
+    an exact row count per table every count_interval seconds; counting is a sequential
+    scan in Postgres, so it is not repeated on every poll of every worker.
+
+    A row count lower than the previous count plus the rows created since means rows were
+    deleted, and more than max_rows changed rows means a bulk change; both are reported as
+    incomplete so listeners reload the table. Deletes are therefore noticed within
+    count_interval rather than one poll.
+
+    Timestamps are taken when a transaction starts but become visible when it commits, so
+    a row can appear behind a mark already passed. Each poll re-reads ``overlap`` seconds
+    behind the marks and skips rows whose id and timestamps it has already reported.
+
+    :param manager: Manager to query; it should not be the caching manager.
+    :type manager: AsyncDatabaseManager
+    :param tables: Tables to watch; each needs id, created_at and updated_at columns.
+    :type tables: list[str]
+    """
+    def __init__(
+        self,
+        manager: AsyncDatabaseManager,
+        tables: list[str],
+        max_rows: int = settings.changefeed_max_rows,
+        count_interval: float = settings.changefeed_count_interval,
+        overlap: float = settings.changefeed_overlap,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.manager = manager
+        self.tables = list(tables)
+        self.max_rows = max_rows
+        self.count_interval = count_interval
+        self.overlap = datetime.timedelta(seconds=overlap)
+        self.clock = clock
+        self.marks: dict[str, HighWaterMarks] = {}
+
+    async def _current_marks(self, table: str) -> HighWaterMarks:
+        (created, total), (updated, _) = await asyncio.gather(
+            self.manager.select_many(table, ChangeMarker, {}, "created_at", "desc", 0, 0, MARKER_COLUMNS, "exact"),
+            # NULLs would sort first in a descending order; no NULL is greater than EPOCH
+            self.manager.select_many(table, ChangeMarker, {"updated_at": gt(EPOCH)}, "updated_at", "desc", 0, 0, MARKER_COLUMNS),
+        )
+        marks = HighWaterMarks(
+            created=(created[0].created_at or EPOCH) if created else EPOCH,
+            updated=(updated[0].updated_at or EPOCH) if updated else EPOCH,
+            total=total or 0,
+            next_count=self.clock() + self.count_interval,
+        )
+        # Rows already in the overlap window are part of the starting point, not changes
+        rows, _ = await self._window_rows(table, marks)
+        marks.seen = self._in_window(marks, {row.id: (row.created_at, row.updated_at) for row in rows})
+        return marks
+
+    def _window_rows(self, table: str, marks: HighWaterMarks) -> Awaitable[tuple[list[ChangeMarker], int]]:
+        condition = {"or": any_of({"created_at": gte(marks.created - self.overlap)}, {"updated_at": gte(marks.updated - self.overlap)})}
+        return self.manager.select_many(table, ChangeMarker, condition, "id", "asc", 0, self.max_rows, MARKER_COLUMNS)
+
+    def _in_window(self, marks: HighWaterMarks, seen: dict[Any, tuple]) -> dict[Any, tuple]:
+        """The entries of seen that the next window query would return again."""
+        created_since, updated_since = marks.created - self.overlap, marks.updated - self.overlap
+        return {
+            row_id: (created_at, updated_at) for row_id, (created_at, updated_at) in seen.items()
+            if (created_at is not None and created_at >= created_since) or (updated_at is not None and updated_at >= updated_since)
+        }
+
+    async def _poll_table(self, table: str) -> Optional[TableChange]:
+        marks = self.marks.get(table)
+        if marks is None:
+            self.marks[table] = await self._current_marks(table)
+            return None
+        total: Optional[int] = None
+        next_count = marks.next_count
+        if self.clock() >= next_count:
+            (rows, _), total = await asyncio.gather(self._window_rows(table, marks), self.manager.count(table, {}))
+            next_count = self.clock() + self.count_interval
+        else:
+            rows, _ = await self._window_rows(table, marks)
+        if len(rows) > self.max_rows:
+            self.marks[table] = await self._current_marks(table)
+            return TableChange(table, complete=False)
+        changed = [row for row in rows if marks.seen.get(row.id) != (row.created_at, row.updated_at)]
+        created_since = marks.created - self.overlap
+        created = [row for row in changed if row.id not in marks.seen and row.created_at is not None and row.created_at >= created_since]
+        expected = marks.total + len(created)
+        complete = total is None or total == expected
+        new_marks = HighWaterMarks(
+            created=max([marks.created] + [row.created_at for row in rows if row.created_at is not None]),
+            updated=max([marks.updated] + [row.updated_at for row in rows if row.updated_at is not None]),
+            total=expected if total is None else total,
+            next_count=next_count,
+        )
+        new_marks.seen = self._in_window(new_marks, {**marks.seen, **{row.id: (row.created_at, row.updated_at) for row in changed}})
+        self.marks[table] = new_marks
+        if not changed and complete:
+            return None
+        return TableChange(table, frozenset(row.id for row in changed), complete)
+
+    async def poll(self) -> list[TableChange]:
+        changes = await asyncio.gather(*(self._poll_table(table) for table in self.tables))
+        return [change for change in changes if change is not None]
+
+
+class LocalChangeFeedSource(ChangeSource):
+    """
+    Change source reading a LocalStore change log. If more entries were written since the
+    last poll than the log retains (or than max_rows), every table is reported as incomplete.
+    A blocking (SQLite) store is read in a worker thread.
+    """
+    def __init__(self, store: LocalStore, tables: list[str], max_rows: int = settings.changefeed_max_rows):
+        self.store = store
+        self.tables = list(tables)
+        self.max_rows = max_rows
+        self.seq: Optional[int] = None
+
+    async def poll(self) -> list[TableChange]:
+        if self.store.blocking:
+            return await anyio.to_thread.run_sync(self._poll)
+        return self._poll()
+
+    def _poll(self) -> list[TableChange]:
+        oldest, latest = self.store.change_range()
+        if self.seq is None or oldest > self.seq + 1:
+            missed = self.seq is not None
+            self.seq = latest
+            return [TableChange(table, complete=False) for table in self.tables] if missed else []
+        entries = self.store.changes_since(self.seq, self.max_rows + 1)
+        if len(entries) > self.max_rows:
+            self.seq = latest
+            return [TableChange(table, complete=False) for table in self.tables]
+        ids: dict[str, set] = {}
+        deleted: set[str] = set()
+        for seq, table, record_id, operation in entries:
+            self.seq = seq
+            if table not in self.tables:
+                continue
+            ids.setdefault(table, set())
+            if operation == "delete":
+                deleted.add(table)
+            else:
+                ids[table].add(record_id)
+        return [TableChange(table, frozenset(changed), table not in deleted) for table, changed in ids.items()]
+
+
+class ChangeTracker:
+    """
+    Polls a ChangeSource in the background and pushes each change to the listeners.
+    """
+    def __init__(self, source: ChangeSource, interval: float = settings.changefeed_interval):
+        self.source = source
+        self.interval = interval
+        self._listeners: list[ChangeListener] = []
+
+    def add_listener(self, listener: ChangeListener) -> None:
+        """
+        Register a callback invoked with every TableChange.
+        """
+        self._listeners.append(listener)
+
+    async def poll_once(self) -> list[TableChange]:
+        """
+        Poll the source once and notify the listeners.
+
+        :return: The changes found.
+        :rtype: list[TableChange]
+        """
+        changes = await self.source.poll()
+        for change in changes:
+            CHANGEFEED_CHANGES.inc(table=change.table, kind="rows" if change.complete else "reload")
+            LOGGER.debug("Change on %s: %d rows%s", change.table, len(change.ids), "" if change.complete else ", reload")
+            for listener in self._listeners:
+                try:
+                    listener(change)
+                except Exception as e:
+                    LOGGER.error("Change listener failed for table %s: %s", change.table, e)
+        return changes
+
+    async def run(self) -> None:
+        """
+        Poll forever, every interval seconds; failed polls are logged and retried next time.
+        """
+        while True:
+            try:
+                with deadline(settings.request_deadline):
+                    await self.poll_once()
+            except Exception as e:
+                CHANGEFEED_ERRORS.inc()
+                LOGGER.warning("Change feed poll failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> "asyncio.Task[None]":
+        """
+        Start run() as a background task, to be cancelled on shutdown.
+        """
+        return asyncio.create_task(self.run())
+
+
+def create_change_source(manager: AsyncDatabaseManager, tables: list[str], mode: Optional[str] = None) -> Optional[ChangeSource]:
+    """
+    Create the ChangeSource for the changefeed_mode setting.
+
+    "auto" reads the change log with the local backend and polls high-water marks otherwise.
+
+    :param manager: Manager for high-water queries (not the caching manager).
+    :type manager: AsyncDatabaseManager
+    :param tables: Tables to watch.
+    :type tables: list[str]
+    :param mode: "auto", "poll", "feed" or "off"; defaults to the changefeed_mode setting.
+    :type mode: Optional[str]
+    :return: The source, or None when change tracking is off.
+    :rtype: Optional[ChangeSource]
+    :raises ValueError: For an unknown mode, or "feed" without the local backend.
+    """
+    mode = (mode or settings.changefeed_mode).strip().lower()
+    if mode not in CHANGEFEED_MODES:
+        raise ValueError(f"Unknown changefeed_mode '{mode}'; expected one of {', '.join(CHANGEFEED_MODES)}")
+    backend = innermost(manager)
+    if mode == "auto":
+        mode = "feed" if isinstance(backend, AsyncLocalDatabaseManager) else "poll"
+    if mode == "off":
+        return None
+    if mode == "feed":
+        if not isinstance(backend, AsyncLocalDatabaseManager):
+            raise ValueError("changefeed_mode 'feed' requires db_backend 'local'")
+        return LocalChangeFeedSource(backend.local.store, tables)
+    return HighWaterChangeSource(manager, tables)
@@ -0,0 +1,189 @@
+"""
+db/circuitbreaker.py - Per-table circuit breakers and request deadlines around an AsyncDatabaseManager
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional, Type
+
+from postgrest.exceptions import APIError
+
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from db.bulk import BulkResult, is_transient_error
+from db.managerproxy import AsyncManagerProxy
+from db.resilience import CircuitOpenError, DeadlineExceededError, deadline, time_remaining
+from db.supabasemanager import T
+from util.metrics import DB_BREAKER_OPEN, DB_BREAKER_REJECTED, DB_BREAKER_TRANSITIONS, DB_DEADLINE_EXCEEDED
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures and rejects calls for
+    ``reset_timeout`` seconds; then lets a single trial call through (half open),
+    closing again if it succeeds and reopening if it fails.
+    """
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        LOGGER.warning("Circuit breaker for %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        DB_BREAKER_TRANSITIONS.inc(table=self.name, state=state)
+        DB_BREAKER_OPEN.set(1.0 if state == OPEN else 0.0, table=self.name)
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go to the database now; a True in the half-open state
+        reserves the single trial call, which must be reported with record_success,
+        record_failure or release.
+        """
+        if self.state == OPEN and self.retry_after() <= 0:
+            self._transition(HALF_OPEN)
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._trial_in_flight = False
+        self.failures = 0
+        self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        self._trial_in_flight = False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+            self._transition(OPEN)
+
+    def release(self) -> None:
+        """Give back a trial call that ended without a verdict (e.g. it was cancelled)."""
+        self._trial_in_flight = False
+
+
+class CircuitBreakerDatabaseManager(AsyncManagerProxy):
+    """
+    Bounds every call by the current request deadline (db/resilience.py) and fails fast
+    with CircuitOpenError while the breaker of the call's table is open.
+
+    Only network errors, 5xx-class API errors and deadline overruns of reads count as
+    failures; a query the database rejects (constraint, syntax, not found) proves it is up,
+    and a write that outlives its caller's deadline says more about the caller than the
+    database. Bulk writes run under ``db_bulk_write_deadline`` instead of the request
+    deadline, so a long import is not cancelled between chunks.
+    """
+    def __init__(
+        self,
+        inner: AsyncDatabaseManager,
+        failure_threshold: int = settings.db_breaker_failure_threshold,
+        reset_timeout: float = settings.db_breaker_reset_timeout,
+    ):
+        super().__init__(inner)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers: dict[str, CircuitBreaker] = {}
+
+    def breaker(self, table: str) -> CircuitBreaker:
+        breaker = self.breakers.get(table)
+        if breaker is None:
+            breaker = self.breakers[table] = CircuitBreaker(table, self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    async def _guarded(self, table: str, call: Callable[[], Awaitable[Any]], write: bool = False) -> Any:
+        breaker = self.breaker(table)
+        if not breaker.allow():
+            DB_BREAKER_REJECTED.inc(table=table)
+            raise CircuitOpenError(table, breaker.retry_after())
+        remaining = time_remaining()
+        try:
+            if remaining is None:
+                result = await call()
+            elif remaining <= 0:
+                raise asyncio.TimeoutError()
+            else:
+                result = await asyncio.wait_for(call(), remaining)
+        except asyncio.TimeoutError:
+            DB_DEADLINE_EXCEEDED.inc(table=table)
+            if write:
+                breaker.release()
+            else:
+                breaker.record_failure()
+            raise DeadlineExceededError(f"Deadline exceeded waiting for table '{table}'")
+        except Exception as e:
+            if is_transient_error(e):
+                breaker.record_failure()
+            elif isinstance(e, APIError):
+                breaker.record_success()
+            else:
+                breaker.release()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record_success()
+        return result
+
+    async def _bulk_write(self, table: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        with deadline(settings.db_bulk_write_deadline):
+            return await self._guarded(table, call, write=True)
+
+    async def select_one(self, table: str, result_type: Type[T], condition: dict[str, Any]) -> Optional[T]:
+        return await self._guarded(table, lambda: self.inner.select_one(table, result_type, condition))
+
+    async def select_many(self, table: str, result_type: Type[T], condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None, columns: Optional[list[str]] = None, count: Optional[str] = None) -> tuple[list[T], int]:
+        return await self._guarded(table, lambda: self.inner.select_many(table, result_type, condition, sort_by, sort_direction, start, end, columns, count))
+
+    async def insert(self, table: str, data: dict[str, Any], result_type: Type[T]) -> T:
+        return await self._guarded(table, lambda: self.inner.insert(table, data, result_type), write=True)
+
+    async def update(self, table: str, record_id: Any, data: dict[str, Any], result_type: Type[T]) -> T:
+        return await self._guarded(table, lambda: self.inner.update(table, record_id, data, result_type), write=True)
+
+    async def delete(self, table: str, record_id: Any) -> bool:
+        return await self._guarded(table, lambda: self.inner.delete(table, record_id), write=True)
+
+    async def exists(self, table: str, field: str, value: Any) -> bool:
+        return await self._guarded(table, lambda: self.inner.exists(table, field, value))
+
+    async def count(self, table: str, condition: dict[str, Any], method: str = "exact") -> int:
+        return await self._guarded(table, lambda: self.inner.count(table, condition, method))
+
+    async def exists_many(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> set[Any]:
+        return await self._guarded(table, lambda: self.inner.exists_many(table, field, values, chunk_size))
+
+    async def insert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return await self._bulk_write(table, lambda: self.inner.insert_many(table, rows, result_type, chunk_size))
+
+    async def upsert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], on_conflict: Optional[list[str]] = None, chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return await self._bulk_write(table, lambda: self.inner.upsert_many(table, rows, result_type, on_conflict, chunk_size))
+
+    async def update_many(self, table: str, condition: dict[str, Any], data: dict[str, Any], result_type: Type[T]) -> list[T]:
+        return await self._guarded(table, lambda: self.inner.update_many(table, condition, data, result_type), write=True)
+
+    async def delete_where(self, table: str, condition: dict[str, Any]) -> int:
+        return await self._guarded(table, lambda: self.inner.delete_where(table, condition), write=True)
+
+    async def delete_in(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> int:
+        return await self._bulk_write(table, lambda: self.inner.delete_in(table, field, values, chunk_size))
+
+    async def ping(self, table: str) -> None:
+        await self._guarded(table, lambda: self.inner.ping(table))
@@ -0,0 +1,131 @@
+"""
+db/conditions.py - Comparison operators for DatabaseManager condition dicts
+
+A plain value in a condition dict means equality. Wrap a value with one of the
+helpers below to use another comparison, e.g. ``{"updated_at": gt(since)}`` or
+``{"slug": in_(["a", "b"]), "title": ilike("%divorce%")}``, and with :func:`not_` to
+negate one. An :class:`AnyOf` value (conventionally under the key ``"or"``, or any other
+key such as ``"or_dates"`` when a condition needs several groups) matches rows that
+satisfy any one of its alternative condition dicts.
+
+Comparisons follow SQL: a NULL column matches nothing but ``is_null()`` (and nothing
+but ``not_null()`` when negated), and LIKE patterns use ``%`` and ``_`` wildcards.
+"""
+import datetime
+from typing import Any, Iterable, NamedTuple
+
+OPERATORS = ("eq", "neq", "gt", "gte", "lt", "lte", "is", "in", "like", "ilike")
+NEGATION = "not."
+
+
+class Op(NamedTuple):
+    operator: str
+    value: Any
+
+
+class AnyOf(NamedTuple):
+    alternatives: tuple[dict[str, Any], ...]
+
+
+def eq(value: Any) -> Op:
+    return Op("eq", value)
+
+def neq(value: Any) -> Op:
+    return Op("neq", value)
+
+def gt(value: Any) -> Op:
+    return Op("gt", value)
+
+def gte(value: Any) -> Op:
+    return Op("gte", value)
+
+def lt(value: Any) -> Op:
+    return Op("lt", value)
+
+def lte(value: Any) -> Op:
+    return Op("lte", value)
+
+def is_null() -> Op:
+    return Op("is", None)
+
+def not_null() -> Op:
+    return not_(is_null())
+
+def in_(values: Iterable[Any]) -> Op:
+    return Op("in", tuple(values))
+
+def like(pattern: str) -> Op:
+    return Op("like", pattern)
+
+def ilike(pattern: str) -> Op:
+    """Case-insensitive LIKE, e.g. ``ilike("%custody%")``."""
+    return Op("ilike", pattern)
+
+def not_(value: Any) -> Op:
+    """Negate a comparison, e.g. ``not_(in_(ids))``; a plain value negates equality."""
+    op = as_op(value)
+    if op.operator.startswith(NEGATION):
+        return Op(op.operator[len(NEGATION):], op.value)
+    return Op(NEGATION + op.operator, op.value)
+
+def any_of(*alternatives: dict[str, Any]) -> AnyOf:
+    return AnyOf(tuple(alternatives))
+
+
+def as_op(value: Any) -> Op:
+    """
+    Normalize a condition value to an Op, treating plain values as equality.
+    """
+    if isinstance(value, Op):
+        if split_negation(value.operator)[1] not in OPERATORS:
+            raise ValueError(f"Unsupported condition operator: {value.operator}")
+        return value
+    return Op("eq", value)
+
+
+def split_negation(operator: str) -> tuple[bool, str]:
+    """
+    Split an operator such as "not.in" into (True, "in").
+    """
+    if operator.startswith(NEGATION):
+        return True, operator[len(NEGATION):]
+    return False, operator
+
+
+def filter_value(value: Any) -> Any:
+    """
+    Convert a condition value into the form PostgREST expects in a filter.
+    """
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [filter_value(item) for item in value]
+    return value
+
+
+def or_filter(alternatives: tuple[dict[str, Any], ...]) -> str:
+    """
+    Render AnyOf alternatives as a PostgREST logic tree, e.g. ``a.gt."1",and(a.eq."1",id.gt."5")``.
+    """
+    def quote(value: Any) -> str:
+        text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        return f'"{text}"'
+
+    def term(field: str, value: Any) -> str:
+        op = as_op(value)
+        negated, operator = split_negation(op.operator)
+        prefix = f"{field}.{NEGATION if negated else ''}{operator}"
+        if operator == "is":
+            return f"{prefix}.{'null' if op.value is None else str(op.value).lower()}"
+        if operator == "in":
+            return f"{prefix}.({','.join(quote(item) for item in filter_value(op.value))})"
+        return f"{prefix}.{quote(filter_value(op.value))}"
+
+    rendered = []
+    for alternative in alternatives:
+        terms = [
+            f"or({or_filter(value.alternatives)})" if isinstance(value, AnyOf) else term(field, value)
+            for field, value in alternative.items()
+        ]
+        rendered.append(terms[0] if len(terms) == 1 else f"and({','.join(terms)})")
+    return ",".join(rendered)
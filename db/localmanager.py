@@ -0,0 +1,539 @@
+"""
+db/localmanager.py - DatabaseManager backed by a local in-memory or SQLite store
+
+Implements the same condition, sort, range and error semantics as SupabaseManager
+without any network access, so the API and repositories can be profiled and
+exercised deterministically:
+
+* conditions use the db.conditions vocabulary; comparisons with NULL never match
+* ascending sorts put NULLs last and descending sorts put them first, like Postgres
+* start/end are an inclusive range, applied only when both are given
+* unique violations raise the same postgrest APIError (code 23505) that Supabase returns,
+  so callers see the same KeyError / BulkResult messages
+"""
+import datetime
+import functools
+import json
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Callable, Optional, Type
+
+import anyio
+from postgrest.exceptions import APIError
+from postgrest.types import CountMethod
+
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from db.bulk import BulkResult
+from db.conditions import AnyOf, as_op, filter_value, in_, split_negation
+from db.rows import rows_adapter
+from db.supabasemanager import DatabaseManager, T, present_values, raise_if_duplicate_key, require_condition, write_chunks
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+BOOLEAN_LITERALS = {"true": True, "t": True, "yes": True, "on": True, "1": True, "false": False, "f": False, "no": False, "off": False, "0": False}  # Spellings Postgres accepts
+CHANGE_LOG_SIZE = 10000  # Change log entries a store retains
+
+# A change log entry: (sequence number, table, row id, "upsert" or "delete")
+Change = tuple[int, str, Any, str]
+
+
+class LocalStore(ABC):
+    """
+    Row storage for LocalDatabaseManager: rows are JSON-compatible dicts keyed by table and id.
+
+    Every put and remove is also appended to a change log (the local stand-in for a
+    database change feed), of which the last CHANGE_LOG_SIZE entries are retained.
+    """
+    blocking = False  # True if calls do I/O and must run in a worker thread, not on the event loop
+
+    @abstractmethod
+    def rows(self, table: str) -> list[dict[str, Any]]:
+        """Every row of table in id order. Callers may modify the returned dicts."""
+        pass
+
+    @abstractmethod
+    def put(self, table: str, rows: list[dict[str, Any]]) -> None:
+        """Insert or replace rows (by id) in one transaction."""
+        pass
+
+    @abstractmethod
+    def remove(self, table: str, ids: list[Any]) -> None:
+        pass
+
+    @abstractmethod
+    def next_id(self, table: str) -> int:
+        pass
+
+    @abstractmethod
+    def changes_since(self, seq: int, limit: int) -> list[Change]:
+        """Up to limit change log entries after seq, oldest first."""
+        pass
+
+    @abstractmethod
+    def change_range(self) -> tuple[int, int]:
+        """(oldest retained, latest) sequence numbers; the oldest is latest + 1 while the log is empty."""
+        pass
+
+
+class MemoryLocalStore(LocalStore):
+    def __init__(self):
+        self._tables: dict[str, dict[Any, dict[str, Any]]] = {}
+        self._changes: deque[Change] = deque(maxlen=CHANGE_LOG_SIZE)
+        self._seq = 0
+
+    def _log(self, table: str, ids: list[Any], operation: str) -> None:
+        for record_id in ids:
+            self._seq += 1
+            self._changes.append((self._seq, table, record_id, operation))
+
+    def rows(self, table: str) -> list[dict[str, Any]]:
+        records = self._tables.get(table, {})
+        return [dict(records[key]) for key in sorted(records)]
+
+    def put(self, table: str, rows: list[dict[str, Any]]) -> None:
+        records = self._tables.setdefault(table, {})
+        for row in rows:
+            records[row["id"]] = dict(row)
+        self._log(table, [row["id"] for row in rows], "upsert")
+
+    def remove(self, table: str, ids: list[Any]) -> None:
+        records = self._tables.get(table, {})
+        for record_id in ids:
+            records.pop(record_id, None)
+        self._log(table, ids, "delete")
+
+    def next_id(self, table: str) -> int:
+        return max(self._tables.get(table, {}) or [0]) + 1
+
+    def changes_since(self, seq: int, limit: int) -> list[Change]:
+        return [change for change in self._changes if change[0] > seq][:limit]
+
+    def change_range(self) -> tuple[int, int]:
+        return (self._changes[0][0] if self._changes else self._seq + 1), self._seq
+
+
+class SQLiteLocalStore(LocalStore):
+    """
+    LocalStore in a SQLite file, one JSON document per row, so data survives restarts
+    and can be shared by every worker process on the host.
+    """
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pid: Optional[int] = None
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS records (tbl TEXT NOT NULL, id INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (tbl, id))")
+            connection.execute("CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, id INTEGER NOT NULL, op TEXT NOT NULL)")
+            connection.commit()
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def rows(self, table: str) -> list[dict[str, Any]]:
+        with self._lock:
+            result = self.connection.execute("SELECT data FROM records WHERE tbl = ? ORDER BY id", (table,)).fetchall()
+        return [json.loads(data) for (data,) in result]
+
+    def _log(self, table: str, ids: list[Any], operation: str) -> None:
+        """Append to the change log in the caller's transaction, trimming it to CHANGE_LOG_SIZE."""
+        self.connection.executemany("INSERT INTO changes (tbl, id, op) VALUES (?, ?, ?)", [(table, record_id, operation) for record_id in ids])
+        self.connection.execute("DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?", (CHANGE_LOG_SIZE,))
+
+    def put(self, table: str, rows: list[dict[str, Any]]) -> None:
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO records (tbl, id, data) VALUES (?, ?, ?)",
+                [(table, row["id"], json.dumps(row)) for row in rows],
+            )
+            self._log(table, [row["id"] for row in rows], "upsert")
+
+    def remove(self, table: str, ids: list[Any]) -> None:
+        with self._lock, self.connection:
+            self.connection.executemany("DELETE FROM records WHERE tbl = ? AND id = ?", [(table, record_id) for record_id in ids])
+            self._log(table, ids, "delete")
+
+    def next_id(self, table: str) -> int:
+        with self._lock:
+            (max_id,) = self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM records WHERE tbl = ?", (table,)).fetchone()
+        return max_id + 1
+
+    def changes_since(self, seq: int, limit: int) -> list[Change]:
+        with self._lock:
+            result = self.connection.execute("SELECT seq, tbl, id, op FROM changes WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)).fetchall()
+        return [tuple(row) for row in result]  # type: ignore
+
+    def change_range(self) -> tuple[int, int]:
+        with self._lock:
+            oldest, latest = self.connection.execute("SELECT MIN(seq), MAX(seq) FROM changes").fetchone()
+            if latest is None:
+                (latest,) = self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        return (oldest if oldest is not None else latest + 1), latest
+
+
+def _comparable(value: Any) -> Any:
+    """Parse ISO timestamps so they compare chronologically; naive datetimes are taken as UTC."""
+    if isinstance(value, str) and ISO_DATE.match(value):
+        try:
+            value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return value
+    if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def invalid_input_error(code: str, type_name: str, value: Any) -> APIError:
+    """The APIError Postgres/PostgREST returns for a filter literal that does not parse as the column type."""
+    return APIError({
+        "code": code,
+        "message": f'invalid input syntax for type {type_name}: "{value}"',
+        "details": None,
+        "hint": None,
+    })
+
+
+def _coerce(expected: Any, actual: Any) -> Any:
+    """
+    Cast a filter value to the type of the column value, as Postgres does with a filter literal.
+
+    :raises APIError: 22P02 when the value does not parse as a boolean or number column's type.
+    """
+    expected = filter_value(expected)
+    if isinstance(expected, str):
+        if isinstance(actual, bool):
+            if expected.lower() not in BOOLEAN_LITERALS:
+                raise invalid_input_error("22P02", "boolean", expected)
+            return BOOLEAN_LITERALS[expected.lower()]
+        try:
+            if isinstance(actual, int):
+                return int(expected)
+            if isinstance(actual, float):
+                return float(expected)
+        except ValueError:
+            raise invalid_input_error("22P02", "bigint" if isinstance(actual, int) else "double precision", expected) from None
+    return _comparable(expected)
+
+
+@functools.lru_cache(maxsize=256)
+def like_pattern(pattern: str, ignore_case: bool) -> re.Pattern:
+    """Compile a SQL LIKE pattern (``%`` any run, ``_`` one character, backslash escapes)."""
+    parts = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            parts.append(re.escape(char))
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+    return re.compile("".join(parts), re.DOTALL | (re.IGNORECASE if ignore_case else 0))
+
+
+COMPARISONS: dict[str, Callable[[Any, Any], bool]] = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+    "like": lambda a, b: like_pattern(str(b), False).fullmatch(str(a)) is not None,
+    "ilike": lambda a, b: like_pattern(str(b), True).fullmatch(str(a)) is not None,
+}
+
+
+def _compare(operator: str, actual: Any, expected: Any) -> bool:
+    if operator == "in":
+        return any(_comparable(actual) == _coerce(item, actual) for item in expected)
+    if operator in ("like", "ilike"):
+        return COMPARISONS[operator](actual, expected)
+    return COMPARISONS[operator](_comparable(actual), _coerce(expected, actual))
+
+
+def matches(row: dict[str, Any], condition: dict[str, Any]) -> bool:
+    """
+    True if row satisfies every entry of condition.
+
+    :param row: A stored row.
+    :type row: dict[str, Any]
+    :param condition: Field to value, :class:`db.conditions.Op` or :class:`db.conditions.AnyOf` mapping.
+    :type condition: dict[str, Any]
+    :return: Whether the row matches.
+    :rtype: bool
+    """
+    for field, value in condition.items():
+        if isinstance(value, AnyOf):
+            if not any(matches(row, alternative) for alternative in value.alternatives):
+                return False
+            continue
+        op = as_op(value)
+        negated, operator = split_negation(op.operator)
+        actual = row.get(field)
+        if operator == "is":
+            if (actual is op.value or actual == op.value) == negated:
+                return False
+            continue
+        if actual is None or op.value is None:
+            return False  # NULL compares as unknown, and so does its negation
+        if _compare(operator, actual, op.value) == negated:
+            return False
+    return True
+
+
+def sort_rows(rows: list[dict[str, Any]], sort_by: Optional[str], sort_direction: str) -> list[dict[str, Any]]:
+    """
+    Order rows by the comma-separated columns of sort_by; NULLs last ascending, first descending.
+    """
+    if not sort_by:
+        return rows
+    desc = sort_direction.lstrip().lower() == "desc"
+    for column in reversed([column.strip() for column in sort_by.split(",")]):
+        rows.sort(key=lambda row: (row.get(column) is None, _comparable(row.get(column)) if row.get(column) is not None else 0), reverse=desc)
+    return rows
+
+
+def duplicate_key_error(columns: tuple[str, ...], row: dict[str, Any]) -> APIError:
+    """The APIError Postgres/PostgREST returns for a unique violation on columns."""
+    values = ", ".join(str(row.get(column)) for column in columns)
+    return APIError({
+        "code": "23505",
+        "message": "duplicate key value violates unique constraint",
+        "details": f"Key ({', '.join(columns)})=({values}) already exists.",
+        "hint": None,
+    })
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class LocalDatabaseManager(DatabaseManager):
+    """
+    DatabaseManager over a LocalStore (in memory unless a store is given).
+
+    Rows get an ``id`` and ``created_at`` when inserted without them, and ``updated_at`` is
+    set on update, mirroring the column defaults and triggers of the Supabase tables.
+
+    :param store: Where rows are kept.
+    :type store: Optional[LocalStore]
+    :param unique_columns: Table to list of unique column groups, each a comma-separated
+                           string such as "environment,key". ``id`` is always unique.
+    :type unique_columns: Optional[dict[str, list[str]]]
+    """
+    def __init__(self, store: Optional[LocalStore] = None, unique_columns: Optional[dict[str, list[str]]] = None):
+        self.store = store if store is not None else MemoryLocalStore()
+        unique_columns = settings.db_local_unique_columns if unique_columns is None else unique_columns
+        self.unique_columns = {
+            table: [tuple(column.strip() for column in group.split(",")) for group in groups]
+            for table, groups in unique_columns.items()
+        }
+        self._lock = threading.RLock()
+
+    def seed(self, data: dict[str, list[dict[str, Any]]]) -> None:
+        """
+        Insert fixture rows, e.g. loaded from a JSON file of ``{table: [rows]}``.
+        """
+        for table, rows in data.items():
+            self._insert_rows(table, rows)
+
+    def _select(self, table: str, condition: dict[str, Any]) -> list[dict[str, Any]]:
+        return [row for row in self.store.rows(table) if matches(row, condition)]
+
+    def _check_unique(self, table: str, row: dict[str, Any], others: list[dict[str, Any]]) -> None:
+        """Raise the 23505 APIError if row collides with any of others (which must not include row itself)."""
+        for columns in [("id",)] + self.unique_columns.get(table, []):
+            key = tuple(row.get(column) for column in columns)
+            if any(value is None for value in key):
+                continue  # NULLs never collide
+            if any(tuple(other.get(column) for column in columns) == key for other in others):
+                raise duplicate_key_error(columns, row)
+
+    def _insert_rows(self, table: str, rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Insert rows all-or-nothing and return them as stored."""
+        with self._lock:
+            existing = self.store.rows(table)
+            next_id = self.store.next_id(table)
+            written: list[dict[str, Any]] = []
+            for data in rows:
+                row = {key: filter_value(value) for key, value in data.items()}
+                if row.get("id") is None:
+                    row["id"] = next_id
+                next_id = max(next_id, row["id"] + 1) if isinstance(row["id"], int) else next_id
+                row.setdefault("created_at", _now())
+                row.setdefault("updated_at", None)
+                self._check_unique(table, row, existing + written)
+                written.append(row)
+            self.store.put(table, written)
+            return written
+
+    def _update_rows(self, table: str, condition: dict[str, Any], data: dict[str, Any]) -> list[dict[str, Any]]:
+        with self._lock:
+            existing = self.store.rows(table)
+            changes = {key: filter_value(value) for key, value in data.items()}
+            updated = [{**row, "updated_at": _now(), **changes} for row in existing if matches(row, condition)]
+            updated_ids = {row["id"] for row in updated}
+            unchanged = [row for row in existing if row["id"] not in updated_ids]
+            for row in updated:
+                self._check_unique(table, row, unchanged + [other for other in updated if other is not row])
+            self.store.put(table, updated)
+            return updated
+
+    def _delete_rows(self, table: str, condition: dict[str, Any]) -> int:
+        with self._lock:
+            ids = [row["id"] for row in self._select(table, condition)]
+            self.store.remove(table, ids)
+            return len(ids)
+
+    def select_one(self, table: str, result_type: Type[T], condition: dict[str, Any]) -> Optional[T]:
+        rows = self._select(table, condition)
+        if len(rows) != 1:
+            return None  # PostgREST .single() reports no match and multiple matches alike (PGRST116)
+        return result_type(**rows[0])
+
+    def select_many(self, table: str, result_type: Type[T], condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None, columns: Optional[list[str]] = None, count: Optional[str] = None) -> tuple[list[T], int]:
+        rows = sort_rows(self._select(table, condition), sort_by, sort_direction)
+        total = len(rows) if count else None
+        if start is not None and end is not None:
+            rows = rows[start:end + 1]
+        if columns and columns != ["*"]:
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        return rows_adapter(result_type).validate_python(rows), total
+
+    def insert(self, table: str, data: Any, result_type: Type[T]) -> T:
+        if isinstance(data, str):
+            LOGGER.error("CRITICAL: String passed to insert instead of dict. Raising error.")
+            raise ValueError("The 'data' argument must be a dictionary, not a JSON string.")
+        try:
+            return result_type(**self._insert_rows(table, [data])[0])
+        except APIError as e:
+            raise_if_duplicate_key(e)
+            raise
+
+    def update(self, table: str, record_id: Any, data: dict[str, Any], result_type: Type[T]) -> T:
+        return result_type(**self._update_rows(table, {"id": record_id}, data)[0])
+
+    def delete(self, table: str, record_id: Any) -> bool:
+        self._delete_rows(table, {"id": record_id})
+        return True
+
+    def exists(self, table: str, field: str, value: Any) -> bool:
+        return any(matches(row, {field: value}) for row in self.store.rows(table))
+
+    def count(self, table: str, condition: dict[str, Any], method: str = "exact") -> int:
+        CountMethod(method)  # Same ValueError as SupabaseManager for an unknown method; every count is exact here
+        return sum(1 for row in self.store.rows(table) if matches(row, condition))
+
+    def exists_many(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> set[Any]:
+        condition = {field: in_(values)}
+        return present_values(values, [row[field] for row in self.store.rows(table) if matches(row, condition)])
+
+    def insert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return write_chunks(table, rows, result_type, lambda chunk: self._insert_rows(table, chunk), chunk_size)
+
+    def _upsert_rows(self, table: str, rows: list[dict[str, Any]], on_conflict: tuple[str, ...]) -> list[dict[str, Any]]:
+        with self._lock:
+            existing = self.store.rows(table)
+            inserts: list[dict[str, Any]] = []
+            updates: list[dict[str, Any]] = []
+            for data in rows:
+                data = {key: filter_value(value) for key, value in data.items()}
+                key = tuple(data.get(column) for column in on_conflict)
+                match = next((row for row in existing if tuple(row.get(column) for column in on_conflict) == key), None)
+                if match is None:
+                    inserts.append(data)
+                else:
+                    updates.append({**match, "updated_at": _now(), **data})
+            for row in updates:
+                self._check_unique(table, row, [other for other in existing if other["id"] != row["id"]])
+            written = self._insert_rows(table, inserts) if inserts else []
+            self.store.put(table, updates)
+            return updates + written
+
+    def upsert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], on_conflict: Optional[list[str]] = None, chunk_size: Optional[int] = None) -> BulkResult[T]:
+        conflict = tuple(on_conflict or ["id"])
+        return write_chunks(table, rows, result_type, lambda chunk: self._upsert_rows(table, chunk, conflict), chunk_size)
+
+    def update_many(self, table: str, condition: dict[str, Any], data: dict[str, Any], result_type: Type[T]) -> list[T]:
+        require_condition("update_many", condition)
+        return [result_type(**row) for row in self._update_rows(table, condition, data)]
+
+    def delete_where(self, table: str, condition: dict[str, Any]) -> int:
+        require_condition("delete_where", condition)
+        return self._delete_rows(table, condition)
+
+    def delete_in(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> int:
+        if not values:
+            return 0
+        return self._delete_rows(table, {field: in_(values)})
+
+
+class AsyncLocalDatabaseManager(AsyncDatabaseManager):
+    """
+    Async facade over a LocalDatabaseManager. Operations on an in-memory store run inline
+    on the event loop; those on a blocking store (SQLite) run in a worker thread.
+    """
+    def __init__(self, local: Optional[LocalDatabaseManager] = None):
+        self.local = local if local is not None else LocalDatabaseManager()
+
+    async def _call(self, method: Callable[..., T], *args: Any) -> T:
+        if self.local.store.blocking:
+            return await anyio.to_thread.run_sync(method, *args)
+        return method(*args)
+
+    async def select_one(self, table: str, result_type: Type[T], condition: dict[str, Any]) -> Optional[T]:
+        return await self._call(self.local.select_one, table, result_type, condition)
+
+    async def select_many(self, table: str, result_type: Type[T], condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None, columns: Optional[list[str]] = None, count: Optional[str] = None) -> tuple[list[T], int]:
+        return await self._call(self.local.select_many, table, result_type, condition, sort_by, sort_direction, start, end, columns, count)
+
+    async def insert(self, table: str, data: dict[str, Any], result_type: Type[T]) -> T:
+        return await self._call(self.local.insert, table, data, result_type)
+
+    async def update(self, table: str, record_id: Any, data: dict[str, Any], result_type: Type[T]) -> T:
+        return await self._call(self.local.update, table, record_id, data, result_type)
+
+    async def delete(self, table: str, record_id: Any) -> bool:
+        return await self._call(self.local.delete, table, record_id)
+
+    async def exists(self, table: str, field: str, value: Any) -> bool:
+        return await self._call(self.local.exists, table, field, value)
+
+    async def count(self, table: str, condition: dict[str, Any], method: str = "exact") -> int:
+        return await self._call(self.local.count, table, condition, method)
+
+    async def exists_many(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> set[Any]:
+        return await self._call(self.local.exists_many, table, field, values, chunk_size)
+
+    async def insert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return await self._call(self.local.insert_many, table, rows, result_type, chunk_size)
+
+    async def upsert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], on_conflict: Optional[list[str]] = None, chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return await self._call(self.local.upsert_many, table, rows, result_type, on_conflict, chunk_size)
+
+    async def update_many(self, table: str, condition: dict[str, Any], data: dict[str, Any], result_type: Type[T]) -> list[T]:
+        return await self._call(self.local.update_many, table, condition, data, result_type)
+
+    async def delete_where(self, table: str, condition: dict[str, Any]) -> int:
+        return await self._call(self.local.delete_where, table, condition)
+
+    async def delete_in(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> int:
+        return await self._call(self.local.delete_in, table, field, values, chunk_size)
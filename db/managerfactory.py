@@ -0,0 +1,75 @@
+"""
+managerfactory.py - Factory for the DatabaseManager selected by the db_backend setting
+"""
+import json
+from typing import Optional
+
+from db.asyncsupabasemanager import AsyncDatabaseManager, AsyncSupabaseManager
+from db.localmanager import AsyncLocalDatabaseManager, LocalDatabaseManager, MemoryLocalStore, SQLiteLocalStore
+from db.supabasemanager import DatabaseManager, SupabaseManager
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+BACKENDS = ("supabase", "local")
+
+
+class DatabaseManagerFactory:
+    """Factory class for creating database manager instances"""
+
+    @staticmethod
+    def _backend(backend: Optional[str]) -> str:
+        backend = (backend or settings.db_backend).strip().lower()
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown db_backend '{backend}'; expected one of {', '.join(BACKENDS)}")
+        return backend
+
+    @staticmethod
+    def create_local_manager() -> LocalDatabaseManager:
+        """
+        Create a LocalDatabaseManager from the db_local_* settings.
+
+        The store lives in the db_local_path SQLite file, or in memory when that is empty.
+        An empty store is seeded from db_local_seed_path when one is configured.
+
+        :return: The local manager.
+        :rtype: LocalDatabaseManager
+        """
+        store = SQLiteLocalStore(settings.db_local_path) if settings.db_local_path else MemoryLocalStore()
+        manager = LocalDatabaseManager(store)
+        if settings.db_local_seed_path:
+            with open(settings.db_local_seed_path, encoding="utf-8") as seed_file:
+                fixture = json.load(seed_file)
+            if all(not store.rows(table) for table in fixture):
+                manager.seed(fixture)
+                LOGGER.info("Seeded local database from %s.", settings.db_local_seed_path)
+        return manager
+
+    @staticmethod
+    def create_manager(backend: Optional[str] = None) -> DatabaseManager:
+        """
+        Create a synchronous database manager.
+
+        :param backend: "supabase" or "local"; defaults to the db_backend setting.
+        :type backend: Optional[str]
+        :return: A configured database manager.
+        :rtype: DatabaseManager
+        """
+        if DatabaseManagerFactory._backend(backend) == "local":
+            return DatabaseManagerFactory.create_local_manager()
+        return SupabaseManager()
+
+    @staticmethod
+    def create_async_manager(backend: Optional[str] = None) -> AsyncDatabaseManager:
+        """
+        Create an async database manager.
+
+        :param backend: "supabase" or "local"; defaults to the db_backend setting.
+        :type backend: Optional[str]
+        :return: A configured async database manager.
+        :rtype: AsyncDatabaseManager
+        """
+        if DatabaseManagerFactory._backend(backend) == "local":
+            return AsyncLocalDatabaseManager(DatabaseManagerFactory.create_local_manager())
+        return AsyncSupabaseManager()
@@ -0,0 +1,133 @@
+"""
+db/managerproxy.py - Base class for AsyncDatabaseManager wrappers (caching, coalescing, ...)
+"""
+from typing import Any, Hashable, Optional, Type
+
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from db.bulk import BulkResult
+from db.supabasemanager import T
+
+
+def freeze(value: Any) -> Hashable:
+    """
+    Convert a condition value into something hashable so it can be part of a query key.
+
+    :param value: A condition value (scalar, dict, list, set or tuple).
+    :type value: Any
+    :return: A hashable equivalent of value.
+    :rtype: Hashable
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    return value
+
+
+def query_key(
+    operation: str,
+    table: str,
+    result_type: Type[Any],
+    condition: dict[str, Any],
+    sort_by: Optional[str] = None,
+    sort_direction: str = "asc",
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    columns: Optional[list[str]] = None,
+    count: Optional[str] = None,
+) -> tuple:
+    """
+    Build the key that identifies a read query: table, model, condition, sort, range,
+    projected columns and count method.
+
+    The table is always the second element so entries can be invalidated per table.
+    """
+    return (
+        operation,
+        table,
+        result_type,
+        freeze(condition),
+        sort_by,
+        sort_direction.strip().lower(),
+        start,
+        end,
+        freeze(columns),
+        count,
+    )
+
+
+def uncached(manager: AsyncDatabaseManager) -> AsyncDatabaseManager:
+    """
+    The manager below the read-caching wrappers at the top of a stack, for reads that must
+    see the database now (incremental refreshes, one-off lookups) and should not fill the cache.
+    """
+    while isinstance(manager, AsyncManagerProxy) and manager.caches_reads:
+        manager = manager.inner
+    return manager
+
+
+def innermost(manager: AsyncDatabaseManager) -> AsyncDatabaseManager:
+    """
+    The backend manager at the bottom of a stack of AsyncManagerProxy wrappers.
+    """
+    while isinstance(manager, AsyncManagerProxy):
+        manager = manager.inner
+    return manager
+
+
+class AsyncManagerProxy(AsyncDatabaseManager):
+    """
+    AsyncDatabaseManager that forwards every call to an inner manager.
+
+    Subclasses override only the operations they decorate.
+    """
+    caches_reads = False  # True for wrappers that may answer reads from a cache
+    def __init__(self, inner: AsyncDatabaseManager):
+        self.inner = inner
+
+    async def select_one(self, table: str, result_type: Type[T], condition: dict[str, Any]) -> Optional[T]:
+        return await self.inner.select_one(table, result_type, condition)
+
+    async def select_many(self, table: str, result_type: Type[T], condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None, columns: Optional[list[str]] = None, count: Optional[str] = None) -> tuple[list[T], int]:
+        return await self.inner.select_many(table, result_type, condition, sort_by, sort_direction, start, end, columns, count)
+
+    async def insert(self, table: str, data: dict[str, Any], result_type: Type[T]) -> T:
+        return await self.inner.insert(table, data, result_type)
+
+    async def update(self, table: str, record_id: Any, data: dict[str, Any], result_type: Type[T]) -> T:
+        return await self.inner.update(table, record_id, data, result_type)
+
+    async def delete(self, table: str, record_id: Any) -> bool:
+        return await self.inner.delete(table, record_id)
+
+    async def exists(self, table: str, field: str, value: Any) -> bool:
+        return await self.inner.exists(table, field, value)
+
+    async def count(self, table: str, condition: dict[str, Any], method: str = "exact") -> int:
+        return await self.inner.count(table, condition, method)
+
+    async def exists_many(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> set[Any]:
+        return await self.inner.exists_many(table, field, values, chunk_size)
+
+    async def insert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return await self.inner.insert_many(table, rows, result_type, chunk_size)
+
+    async def upsert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], on_conflict: Optional[list[str]] = None, chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return await self.inner.upsert_many(table, rows, result_type, on_conflict, chunk_size)
+
+    async def update_many(self, table: str, condition: dict[str, Any], data: dict[str, Any], result_type: Type[T]) -> list[T]:
+        return await self.inner.update_many(table, condition, data, result_type)
+
+    async def delete_where(self, table: str, condition: dict[str, Any]) -> int:
+        return await self.inner.delete_where(table, condition)
+
+    async def delete_in(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> int:
+        return await self.inner.delete_in(table, field, values, chunk_size)
+
+    async def ping(self, table: str) -> None:
+        await self.inner.ping(table)
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
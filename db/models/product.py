@@ -2,17 +2,29 @@ import datetime
 from typing import Optional
 from pydantic import BaseModel, ConfigDict, Field
 
-class Product(BaseModel):
+class ProductCard(BaseModel):
+    """The fields of a product card, shared by every view of a product."""
     title: str = Field(description="Title header for the product card")
-    description: str = Field(description="Markdown narative description of the product")
-    order_link: str = Field(description="URL to COgnito Forms order form")
+    order_link: str = Field(description="URL to Cognito Forms order form")
     image_path: str = Field(description="Path/URL to the background image for the product card")
     icon: str = Field(description="Font Awesome code for product icon")
     slug: str = Field(description="URL Slug for this product")
 
 
+class Product(ProductCard):
+    description: str = Field(description="Markdown narative description of the product")
+
+
 class ProductInDB(Product):
     id: int
     created_at: datetime.datetime
     updated_at: Optional[datetime.datetime] = None
     model_config = ConfigDict(from_attributes=True)
+
+
+class ProductSummary(ProductCard):
+    """ProductInDB without the markdown description, for lists of products."""
+    id: int
+    created_at: datetime.datetime
+    updated_at: Optional[datetime.datetime] = None
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,37 @@
+"""
+db/models/projection.py - Partial models for queries that fetch only some columns
+"""
+from functools import lru_cache
+from typing import Any, Iterable, Type
+
+from pydantic import BaseModel, create_model
+
+
+@lru_cache(maxsize=256)
+def _projection_model(model: Type[BaseModel], fields: tuple[str, ...]) -> Type[BaseModel]:
+    definitions: dict[str, Any] = {
+        name: (model.model_fields[name].annotation, model.model_fields[name])
+        for name in fields
+    }
+    return create_model(f"{model.__name__}Projection", __config__=model.model_config, **definitions)  # type: ignore
+
+
+def projection_model(model: Type[BaseModel], fields: Iterable[str]) -> Type[BaseModel]:
+    """
+    Return a model class with only the given fields of model, in model's field order.
+
+    The same class is returned for the same field set, so it can be part of a cache key.
+
+    :param model: The full model, e.g. ProductInDB.
+    :type model: Type[BaseModel]
+    :param fields: Field names to keep.
+    :type fields: Iterable[str]
+    :return: A pydantic model with the selected fields.
+    :rtype: Type[BaseModel]
+    :raises ValueError: If a field is not defined on model.
+    """
+    wanted = set(fields)
+    unknown = wanted - set(model.model_fields)
+    if unknown:
+        raise ValueError(f"Unknown field(s) for {model.__name__}: {', '.join(sorted(unknown))}")
+    return _projection_model(model, tuple(name for name in model.model_fields if name in wanted))
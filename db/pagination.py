@@ -0,0 +1,73 @@
+"""
+db/pagination.py - Keyset (cursor) pagination helpers
+
+Pages are ordered by ``id`` or by ``(updated_at, id)``. A cursor is the opaque,
+URL-safe encoding of the sort key of the last row on the previous page.
+"""
+import base64
+import datetime
+import json
+from dataclasses import dataclass
+from typing import Any, Generic, Optional, TypeVar
+
+from db.conditions import any_of, gt, is_null
+
+KEYSET_ORDERS = {
+    "id": "id",
+    "updated_at": "updated_at,id",
+}
+
+T = TypeVar("T")
+
+
+@dataclass
+class Page(Generic[T]):
+    items: list[T]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+
+def encode_cursor(order: str, row: Any) -> str:
+    """
+    Encode the sort key of row (a model with id/updated_at) as a cursor for order.
+    """
+    key: dict[str, Any] = {"o": order, "id": row.id}
+    if order == "updated_at":
+        key["u"] = row.updated_at.isoformat() if row.updated_at else None
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(order: str, cursor: str) -> dict[str, Any]:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    :raises ValueError: If the cursor is malformed or was issued for a different order.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if key.get("o") != order or not isinstance(key.get("id"), int):
+            raise ValueError
+        if order == "updated_at" and key.get("u") is not None:
+            key["u"] = datetime.datetime.fromisoformat(key["u"])
+    except (ValueError, TypeError, json.JSONDecodeError):
+        raise ValueError("Invalid pagination cursor")
+    return key
+
+
+def keyset_condition(order: str, cursor: str) -> dict[str, Any]:
+    """
+    Condition selecting the rows that sort after cursor.
+
+    For ``updated_at`` order, rows with a NULL updated_at sort last (Postgres ascending order).
+    """
+    key = decode_cursor(order, cursor)
+    if order == "id":
+        return {"id": gt(key["id"])}
+    if key["u"] is None:
+        return {"updated_at": is_null(), "id": gt(key["id"])}
+    return {"or": any_of(
+        {"updated_at": gt(key["u"])},
+        {"updated_at": key["u"], "id": gt(key["id"])},
+        {"updated_at": is_null()},
+    )}
@@ -0,0 +1,123 @@
+"""
+db/query.py - Immutable query builder over the DatabaseManager select_many arguments
+
+A Query collects filters (the db.conditions vocabulary), OR groups, the projected columns,
+the order and a limit, and is run with ``find``/``find_one`` of a repository, so filtering
+and trimming happen in the database instead of in Python::
+
+    query = (
+        Query()
+        .where(environment=in_(["*", "production"]), value=not_null())
+        .where_any({"key": ilike("seo_%")}, {"key": "site_title"})
+        .select("key", "value")
+        .order_by("key")
+        .limit(50)
+    )
+    parameters, _ = await PARAMETERS.find(query)
+"""
+import dataclasses
+from dataclasses import dataclass, field
+from typing import Any, Optional, Type
+
+from pydantic import BaseModel
+
+from db.conditions import AnyOf, any_of
+from db.models.projection import projection_model
+
+COUNT_METHODS = ("exact", "planned", "estimated")
+
+
+@dataclass(frozen=True)
+class Query:
+    """
+    Every builder method returns a new Query, so a base query can be shared and refined.
+    """
+    condition: dict[str, Any] = field(default_factory=dict)
+    columns: Optional[tuple[str, ...]] = None
+    sort_by: Optional[str] = None
+    sort_direction: str = "asc"
+    offset: int = 0
+    max_rows: Optional[int] = None
+    count: Optional[str] = None
+
+    def where(self, condition: Optional[dict[str, Any]] = None, **fields: Any) -> "Query":
+        """
+        Add filters, all of which must hold: field=value for equality, or an Op such as
+        gt(...), in_(...), ilike(...), is_null(), not_(...). A later filter on the same field
+        replaces the earlier one.
+        """
+        return dataclasses.replace(self, condition={**self.condition, **(condition or {}), **fields})
+
+    def where_any(self, *alternatives: dict[str, Any]) -> "Query":
+        """
+        Add an OR group: rows must satisfy at least one of the alternative condition dicts.
+        """
+        groups = sum(1 for value in self.condition.values() if isinstance(value, AnyOf))
+        key = "or" if groups == 0 else f"or_{groups + 1}"
+        return dataclasses.replace(self, condition={**self.condition, key: any_of(*alternatives)})
+
+    def select(self, *columns: str) -> "Query":
+        """Return only these columns (the rows are projection models of the repository's model)."""
+        return dataclasses.replace(self, columns=tuple(columns) or None)
+
+    def order_by(self, sort_by: str, direction: str = "asc") -> "Query":
+        """Order by sort_by, which may name several comma-separated columns."""
+        if direction.strip().lower() not in ("asc", "desc"):
+            raise ValueError(f"Unsupported sort direction: {direction}")
+        return dataclasses.replace(self, sort_by=sort_by, sort_direction=direction)
+
+    def limit(self, rows: int, offset: int = 0) -> "Query":
+        """Return at most rows rows, skipping the first offset."""
+        if rows < 1 or offset < 0:
+            raise ValueError("limit must be positive and offset not negative")
+        return dataclasses.replace(self, max_rows=rows, offset=offset)
+
+    def with_count(self, method: str = "exact") -> "Query":
+        """Also return the number of matching rows (ignoring the limit)."""
+        if method not in COUNT_METHODS:
+            raise ValueError(f"Unsupported count method: {method}")
+        return dataclasses.replace(self, count=method)
+
+    @property
+    def start(self) -> Optional[int]:
+        return self.offset if self.max_rows is not None else None
+
+    @property
+    def end(self) -> Optional[int]:
+        return self.offset + self.max_rows - 1 if self.max_rows is not None else None
+
+    def fields(self) -> set[str]:
+        """Every column the filters refer to, including inside OR groups."""
+        def collect(condition: dict[str, Any]) -> set[str]:
+            names: set[str] = set()
+            for name, value in condition.items():
+                if isinstance(value, AnyOf):
+                    for alternative in value.alternatives:
+                        names |= collect(alternative)
+                else:
+                    names.add(name)
+            return names
+        return collect(self.condition)
+
+
+def query_result_type(query: Query, model: Type[BaseModel]) -> tuple[Type[BaseModel], Optional[list[str]]]:
+    """
+    Check query's columns against model and return the model to parse rows into (a
+    projection when columns are selected) with the column list for select_many.
+
+    :param query: The query to run.
+    :type query: Query
+    :param model: The repository's model.
+    :type model: Type[BaseModel]
+    :return: Result model and columns (None for every column).
+    :rtype: tuple[Type[BaseModel], Optional[list[str]]]
+    :raises ValueError: If a filter, sort or selected column is not a field of model.
+    """
+    referenced = query.fields() | {column.strip() for column in (query.sort_by or "").split(",") if column.strip()}
+    unknown = referenced - set(model.model_fields)
+    if unknown:
+        raise ValueError(f"Unknown field(s) for {model.__name__}: {', '.join(sorted(unknown))}")
+    if not query.columns:
+        return model, None
+    result_type = projection_model(model, query.columns)
+    return result_type, list(result_type.model_fields)
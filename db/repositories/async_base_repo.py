@@ -0,0 +1,127 @@
+import asyncio
+from typing import TypeVar, Generic, List, Type, Any, Optional
+from pydantic import BaseModel
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from db.bulk import BulkResult
+from db.models.projection import projection_model
+from db.pagination import KEYSET_ORDERS, Page, encode_cursor, keyset_condition
+from db.query import Query, query_result_type
+
+T = TypeVar("T", bound=BaseModel)
+
+class AsyncBaseRepository(Generic[T]):
+    def __init__(self, manager: AsyncDatabaseManager, table_name: str, model_class: Type[T]):
+        self.manager = manager
+        self.table_name = table_name
+        self.model_class = model_class
+
+    async def select_one(self, condition: dict[str, Any]) -> Optional[T]:
+        return await self.manager.select_one(self.table_name, self.model_class, condition)
+
+    async def select_many(self, condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None, columns: Optional[list[str]] = None, count: Optional[str] = None) -> tuple[List[T], int]:
+        return await self.manager.select_many(self.table_name, self.model_class, condition, sort_by, sort_direction, start, end, columns, count)
+
+    async def select_page(self, limit: Optional[int], cursor: Optional[str] = None, order: str = "id", fields: Optional[list[str]] = None, count: Optional[str] = None, condition: Optional[dict[str, Any]] = None, result_type: Optional[Type[BaseModel]] = None) -> Page[BaseModel]:
+        """
+        Fetch one keyset-paginated page.
+
+        :param limit: Maximum number of rows on the page; None returns every remaining row.
+        :type limit: Optional[int]
+        :param cursor: next_cursor of the previous page, or None for the first page.
+        :type cursor: Optional[str]
+        :param order: Keyset order, "id" or "updated_at" (ties broken by id).
+        :type order: str
+        :param fields: Fields to return instead of the whole model; sort key fields are always included.
+        :type fields: Optional[list[str]]
+        :param count: Count method ("exact", "planned" or "estimated") for the total number of rows.
+        :type count: Optional[str]
+        :param condition: Additional filter applied to every page.
+        :type condition: Optional[dict[str, Any]]
+        :param result_type: Model with a subset of the repository model's fields (e.g. a summary) to fetch instead of the whole model; fields narrows it further.
+        :type result_type: Optional[Type[BaseModel]]
+        :return: The rows, the cursor for the next page (None on the last page) and the total if requested.
+        :rtype: Page
+        :raises ValueError: On an unknown order or field, or a malformed cursor.
+        """
+        if order not in KEYSET_ORDERS:
+            raise ValueError(f"Unsupported order: {order}")
+        sort_by = KEYSET_ORDERS[order]
+        columns: Optional[list[str]] = list(result_type.model_fields) if result_type else None
+        result_type = result_type or self.model_class
+        if fields:
+            result_type = projection_model(result_type, [*fields, *sort_by.split(",")])
+            columns = list(result_type.model_fields)
+
+        base = dict(condition or {})
+        page_condition = {**base, **keyset_condition(order, cursor)} if cursor else base
+        # Fetch one extra row to learn whether another page follows
+        start, end = (0, limit) if limit is not None else (None, None)
+        page_query = self.manager.select_many(self.table_name, result_type, page_condition, sort_by, "asc", start, end, columns)
+        if count:
+            (rows, _), total = await asyncio.gather(
+                page_query,
+                self.manager.count(self.table_name, base, count),
+            )
+        else:
+            rows, _ = await page_query
+            total = None
+
+        if limit is None or len(rows) <= limit:
+            return Page(items=rows, total=total)
+        return Page(items=rows[:limit], next_cursor=encode_cursor(order, rows[limit - 1]), total=total)
+
+    async def find(self, query: Query) -> tuple[List[BaseModel], Optional[int]]:
+        """
+        Run a Query: filters, OR groups, order, limit and projection are applied by the database.
+
+        :param query: The query to run.
+        :type query: Query
+        :return: The matching rows (projection models when query selects columns) and the total if query.count is set.
+        :rtype: tuple[List[BaseModel], Optional[int]]
+        :raises ValueError: If the query refers to a field the model does not have.
+        """
+        result_type, columns = query_result_type(query, self.model_class)
+        return await self.manager.select_many(self.table_name, result_type, query.condition, query.sort_by, query.sort_direction, query.start, query.end, columns, query.count)
+
+    async def find_one(self, query: Query) -> Optional[BaseModel]:
+        """
+        Run a Query limited to one row (keeping its offset) and return that row, or None.
+        """
+        rows, _ = await self.find(query.limit(1, query.offset))
+        return rows[0] if rows else None
+
+    async def insert(self, data: dict[str, Any]) -> T:
+        return await self.manager.insert(self.table_name, data, self.model_class)
+
+    async def update(self, record_id: Any, data: dict[str, Any]) -> T:
+        return await self.manager.update(self.table_name, record_id, data, self.model_class)
+
+    async def delete(self, record_id: Any) -> bool:
+        return await self.manager.delete(self.table_name, record_id)
+
+    async def exists(self, field: str, value: Any) -> bool:
+        return await self.manager.exists(self.table_name, field, value)
+
+    async def count(self, condition: Optional[dict[str, Any]] = None, method: str = "exact") -> int:
+        return await self.manager.count(self.table_name, condition or {}, method)
+
+    async def exists_many(self, field: str, values: list[Any], chunk_size: Optional[int] = None) -> set[Any]:
+        """
+        Which of values already occur in field, e.g. to skip duplicates before an import.
+        """
+        return await self.manager.exists_many(self.table_name, field, values, chunk_size)
+
+    async def insert_many(self, rows: list[dict[str, Any]], chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return await self.manager.insert_many(self.table_name, rows, self.model_class, chunk_size)
+
+    async def upsert_many(self, rows: list[dict[str, Any]], on_conflict: Optional[list[str]] = None, chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return await self.manager.upsert_many(self.table_name, rows, self.model_class, on_conflict, chunk_size)
+
+    async def update_many(self, condition: dict[str, Any], data: dict[str, Any]) -> List[T]:
+        return await self.manager.update_many(self.table_name, condition, data, self.model_class)
+
+    async def delete_where(self, condition: dict[str, Any]) -> int:
+        return await self.manager.delete_where(self.table_name, condition)
+
+    async def delete_in(self, field: str, values: list[Any], chunk_size: Optional[int] = None) -> int:
+        return await self.manager.delete_in(self.table_name, field, values, chunk_size)
@@ -1,6 +1,8 @@
 from typing import TypeVar, Generic, List, Type, Any, Optional
 from pydantic import BaseModel
 from db.supabasemanager import DatabaseManager
+from db.bulk import BulkResult
+from db.query import Query, query_result_type
 
 T = TypeVar("T", bound=BaseModel)
 
@@ -13,8 +15,16 @@ class BaseRepository(Generic[T]):
     def select_one(self, condition: dict[str, Any]) -> Optional[T]:
         return self.manager.select_one(self.table_name, self.model_class, condition)
     
-    def select_many(self, condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None) -> tuple[List[T], int]:
-        return self.manager.select_many(self.table_name, self.model_class, condition, sort_by, sort_direction, start, end)
+    def select_many(self, condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None, columns: Optional[list[str]] = None, count: Optional[str] = None) -> tuple[List[T], int]:
+        return self.manager.select_many(self.table_name, self.model_class, condition, sort_by, sort_direction, start, end, columns, count)
+    
+    def find(self, query: Query) -> tuple[List[BaseModel], Optional[int]]:
+        result_type, columns = query_result_type(query, self.model_class)
+        return self.manager.select_many(self.table_name, result_type, query.condition, query.sort_by, query.sort_direction, query.start, query.end, columns, query.count)
+    
+    def find_one(self, query: Query) -> Optional[BaseModel]:
+        rows, _ = self.find(query.limit(1, query.offset))
+        return rows[0] if rows else None
     
     def insert(self, data: dict[str, Any]) -> T:
         return self.manager.insert(self.table_name, data, self.model_class)
@@ -27,3 +37,24 @@ class BaseRepository(Generic[T]):
     
     def exists(self, field: str, value: Any) -> bool:
         return self.manager.exists(self.table_name, field, value)
+    
+    def count(self, condition: Optional[dict[str, Any]] = None, method: str = "exact") -> int:
+        return self.manager.count(self.table_name, condition or {}, method)
+    
+    def exists_many(self, field: str, values: list[Any], chunk_size: Optional[int] = None) -> set[Any]:
+        return self.manager.exists_many(self.table_name, field, values, chunk_size)
+    
+    def insert_many(self, rows: list[dict[str, Any]], chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return self.manager.insert_many(self.table_name, rows, self.model_class, chunk_size)
+    
+    def upsert_many(self, rows: list[dict[str, Any]], on_conflict: Optional[list[str]] = None, chunk_size: Optional[int] = None) -> BulkResult[T]:
+        return self.manager.upsert_many(self.table_name, rows, self.model_class, on_conflict, chunk_size)
+    
+    def update_many(self, condition: dict[str, Any], data: dict[str, Any]) -> List[T]:
+        return self.manager.update_many(self.table_name, condition, data, self.model_class)
+    
+    def delete_where(self, condition: dict[str, Any]) -> int:
+        return self.manager.delete_where(self.table_name, condition)
+    
+    def delete_in(self, field: str, values: list[Any], chunk_size: Optional[int] = None) -> int:
+        return self.manager.delete_in(self.table_name, field, values, chunk_size)
@@ -1,10 +1,139 @@
 """
 db/repositories/parameter.py - Repository for Parameter model using Supabase
 """
+import asyncio
+import time
+from typing import Callable, Optional
+
+from db.changefeed import TableChange
 from db.models.parameter import ParameterInDB
 from db.repositories.base_repo import BaseRepository
+from db.repositories.async_base_repo import AsyncBaseRepository
 from db.supabasemanager import DatabaseManager
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from db.resilience import deadline
+from util.responses import dumps, etag_for
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+ALL_ENVIRONMENTS = "*"
 
 class ParameterRepository(BaseRepository[ParameterInDB]):
     def __init__(self, manager: DatabaseManager):
         super().__init__(manager, "parameters", ParameterInDB)
+
+class ParameterSnapshot:
+    """
+    Read-only view of the parameters merged for every environment.
+
+    Each environment sees the ``"*"`` parameters ordered by id, overridden (and extended)
+    by its own parameters ordered by id. Environments without overrides see the ``"*"`` set.
+    """
+    def __init__(self, parameters: list[ParameterInDB]):
+        parameters = sorted(parameters, key=lambda param: param.id)
+        defaults = {param.key: param for param in parameters if param.environment == ALL_ENVIRONMENTS}
+        self.environments: dict[str, dict[str, ParameterInDB]] = {ALL_ENVIRONMENTS: defaults}
+        for param in parameters:
+            if param.environment != ALL_ENVIRONMENTS:
+                self.environments.setdefault(param.environment, dict(defaults))[param.key] = param
+        self._json: dict[str, bytes] = {
+            environment: dumps(list(merged.values()))
+            for environment, merged in self.environments.items()
+        }
+        self._etags: dict[str, str] = {environment: etag_for(data) for environment, data in self._json.items()}
+
+    def merged(self, environment: str) -> dict[str, ParameterInDB]:
+        """Key to parameter mapping for environment."""
+        return self.environments.get(environment, self.environments[ALL_ENVIRONMENTS])
+
+    def json(self, environment: str) -> bytes:
+        """The merged parameter list for environment, already serialized to JSON."""
+        return self._json.get(environment, self._json[ALL_ENVIRONMENTS])
+
+    def etag(self, environment: str) -> str:
+        """Strong ETag of :meth:`json` for environment."""
+        return self._etags.get(environment, self._etags[ALL_ENVIRONMENTS])
+
+class AsyncParameterRepository(AsyncBaseRepository[ParameterInDB]):
+    """
+    Parameter repository that serves merged per-environment snapshots.
+
+    The snapshot is built on first use and rebuilt in the background every
+    ``parameter_snapshot_refresh_interval`` seconds or after the table is invalidated.
+    """
+    def __init__(self, manager: AsyncDatabaseManager, clock: Callable[[], float] = time.monotonic):
+        super().__init__(manager, "parameters", ParameterInDB)
+        self.clock = clock
+        self._snapshot: Optional[ParameterSnapshot] = None
+        self._next_refresh = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def refresh_snapshot(self) -> ParameterSnapshot:
+        """
+        Load every parameter and atomically replace the current snapshot.
+        """
+        parameters, _ = await self.select_many(condition={}, sort_by="id", sort_direction="asc")
+        self._snapshot = ParameterSnapshot(parameters)
+        self._next_refresh = self.clock() + settings.parameter_snapshot_refresh_interval
+        LOGGER.debug("Parameter snapshot built for %d environments.", len(self._snapshot.environments))
+        return self._snapshot
+
+    def invalidate_snapshot(self, table: Optional[str] = None) -> None:
+        """
+        Cache invalidation listener: rebuild the snapshot when parameters change.
+        """
+        if table is None or table == self.table_name:
+            self._next_refresh = 0.0
+
+    def apply_change(self, change: TableChange) -> None:
+        """
+        Change tracker listener: rebuild the snapshot now rather than on the next request.
+        """
+        if change.table != self.table_name or self._snapshot is None:
+            return
+        self.invalidate_snapshot(change.table)
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_in_background())
+
+    async def _refresh_in_background(self) -> None:
+        try:
+            # The task copied the request's context; give it a deadline of its own
+            with deadline(settings.request_deadline):
+                async with self._lock:
+                    await self.refresh_snapshot()
+        except Exception as e:
+            LOGGER.warning("Parameter snapshot refresh failed; serving the previous snapshot: %s", e)
+            self._next_refresh = self.clock() + settings.parameter_snapshot_refresh_interval
+        finally:
+            self._refresh_task = None
+
+    async def snapshot(self) -> ParameterSnapshot:
+        """
+        Return the current snapshot, building it on first use.
+        """
+        if self._snapshot is None:
+            async with self._lock:
+                if self._snapshot is None:
+                    return await self.refresh_snapshot()
+        elif self.clock() >= self._next_refresh and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_in_background())
+        return self._snapshot  # type: ignore
+
+    async def get(self, environment: str, key: str, default: Optional[str] = None) -> Optional[str]:
+        """
+        Value of parameter key as seen by environment.
+
+        :param environment: Environment name, e.g. 'production'
+        :type environment: str
+        :param key: Parameter key
+        :type key: str
+        :param default: Returned when the key is not defined
+        :type default: Optional[str]
+        :return: The merged parameter value
+        :rtype: Optional[str]
+        """
+        param = (await self.snapshot()).merged(environment).get(key)
+        return param.value if param is not None else default
@@ -1,10 +1,257 @@
 """
 db/repositories/court_opinion.py - Repository for CourtOpinion model using Supabase
 """
-from db.models.product import ProductInDB
+import asyncio
+import datetime
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional
+
+from db.changefeed import TableChange
+from db.conditions import gt, in_
+from db.models.product import ProductInDB, ProductSummary
 from db.repositories.base_repo import BaseRepository
+from db.repositories.async_base_repo import AsyncBaseRepository
 from db.supabasemanager import DatabaseManager
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from db.managerproxy import uncached
+from db.resilience import deadline
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+IndexListener = Callable[[list[ProductInDB], bool], None]
 
 class ProductRepository(BaseRepository[ProductInDB]):
     def __init__(self, manager: DatabaseManager):
         super().__init__(manager, "products", ProductInDB)
+
+def changed_at(product: ProductInDB) -> datetime.datetime:
+    """When product was last written: updated_at, or created_at if it was never updated."""
+    return product.updated_at or product.created_at
+
+class AsyncProductRepository(AsyncBaseRepository[ProductInDB]):
+    """
+    Product repository with an in-memory slug index.
+
+    The index is loaded in full on first use, then refreshed incrementally by fetching
+    only the rows whose updated_at/created_at is past the newest change already seen, less
+    ``changefeed_overlap`` seconds for transactions that commit after a later-stamped one.
+    Slugs that are not found are remembered for ``slug_index_negative_ttl`` seconds.
+    Incremental refreshes and slug lookups bypass the read cache: they must see the
+    database now, and one-off lookups would only evict hot cache entries.
+    Index listeners (e.g. the search index) see every product the index takes in.
+    Rows the change tracker reports are fetched by id, since a row committed late may carry
+    a timestamp below the high-water mark.
+    """
+    def __init__(self, manager: AsyncDatabaseManager, clock: Callable[[], float] = time.monotonic):
+        super().__init__(manager, "products", ProductInDB)
+        self.uncached_manager = uncached(manager)
+        self.clock = clock
+        self._by_slug: dict[str, ProductInDB] = {}
+        self._by_id: dict[int, ProductInDB] = {}
+        self._missing: OrderedDict[str, float] = OrderedDict()
+        self._high_water: Optional[datetime.datetime] = None
+        self._loaded = False
+        self._full_reload_needed = False
+        self._next_refresh = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._index_listeners: list[IndexListener] = []
+        self._all: Optional[list[ProductInDB]] = None
+        self._changed_ids: set[Any] = set()  # Reported by the change tracker, not yet fetched
+
+    def add_index_listener(self, listener: IndexListener) -> None:
+        """
+        Register a callback invoked with the products added to or changed in the slug index,
+        and reloaded=True (with every product) after a full reload.
+        """
+        self._index_listeners.append(listener)
+
+    def _index(self, products: Iterable[ProductInDB], reloaded: bool = False, advance: bool = True) -> None:
+        """
+        Add products to the index; advance=False leaves the high-water mark alone (point
+        lookups must not skip changes older than the product found but not yet refreshed).
+        """
+        # Rows re-read by the overlap window are usually unchanged; listeners need not see them
+        indexed = [product for product in products if self._by_id.get(product.id) != product]
+        if indexed:
+            self._all = None
+        for product in indexed:
+            previous = self._by_id.get(product.id)
+            if previous is not None and previous.slug != product.slug:
+                self._by_slug.pop(previous.slug, None)
+            self._by_id[product.id] = product
+            self._by_slug[product.slug] = product
+            self._missing.pop(product.slug, None)
+            stamp = changed_at(product)
+            if advance and (self._high_water is None or stamp > self._high_water):
+                self._high_water = stamp
+        if indexed or reloaded:
+            for listener in self._index_listeners:
+                try:
+                    listener(indexed, reloaded)
+                except Exception as e:
+                    LOGGER.error("Product index listener failed: %s", e)
+
+    async def reload_slug_index(self) -> None:
+        """
+        Rebuild the slug index from the full products table.
+        """
+        self._changed_ids.clear()  # The full read includes them
+        products, _ = await self.select_many(condition={})
+        self._by_slug = {}
+        self._by_id = {}
+        self._all = None
+        self._missing.clear()
+        self._high_water = None
+        self._index(products, reloaded=True)
+        self._loaded = True
+        self._full_reload_needed = False
+        self._next_refresh = self.clock() + settings.slug_index_refresh_interval
+        LOGGER.debug("Slug index loaded with %d products.", len(self._by_slug))
+
+    async def refresh_slug_index(self) -> None:
+        """
+        Pull rows changed since the index high-water mark (less the overlap window), or
+        reload everything if the index was invalidated (a delete cannot be seen incrementally).
+        """
+        if not self._loaded or self._full_reload_needed or self._high_water is None:
+            await self.reload_slug_index()
+            return
+        since = self._high_water - datetime.timedelta(seconds=settings.changefeed_overlap)
+        (updated, _), (created, _) = await asyncio.gather(
+            self.uncached_manager.select_many(self.table_name, self.model_class, {"updated_at": gt(since)}),
+            self.uncached_manager.select_many(self.table_name, self.model_class, {"created_at": gt(since)}),
+        )
+        self._index(updated)
+        self._index(created)
+        self._next_refresh = self.clock() + settings.slug_index_refresh_interval
+
+    async def refresh_changed(self) -> None:
+        """
+        Fetch the rows reported by the change tracker by id, leaving the high-water mark alone.
+        """
+        while self._changed_ids:
+            ids, self._changed_ids = sorted(self._changed_ids), set()
+            try:
+                for offset in range(0, len(ids), settings.db_exists_chunk_size):
+                    chunk = ids[offset:offset + settings.db_exists_chunk_size]
+                    products, _ = await self.uncached_manager.select_many(self.table_name, self.model_class, {"id": in_(chunk)})
+                    self._index(products, advance=False)
+            except Exception:
+                self._changed_ids.update(ids)
+                raise
+
+    def invalidate_slug_index(self, table: Optional[str] = None) -> None:
+        """
+        Cache invalidation listener: schedule a full reload when products change.
+        """
+        if table is None or table == self.table_name:
+            self._full_reload_needed = True
+            self._next_refresh = 0.0
+
+    def apply_change(self, change: TableChange) -> None:
+        """
+        Change tracker listener: pick up changed products now rather than at the next
+        scheduled refresh; by id, unless rows may have been deleted.
+        """
+        if change.table != self.table_name or not self._loaded:
+            return
+        if not change.complete:
+            self.invalidate_slug_index(change.table)
+        else:
+            # A slug remembered as missing may belong to a new product
+            self._missing.clear()
+            self._changed_ids.update(change.ids)
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_in_background())
+
+    async def _refresh_in_background(self) -> None:
+        try:
+            # The task copied the request's context; give it a deadline of its own
+            with deadline(settings.request_deadline):
+                async with self._lock:
+                    if not self._loaded or self._full_reload_needed or self.clock() >= self._next_refresh:
+                        await self.refresh_slug_index()
+                    await self.refresh_changed()
+        except Exception as e:
+            LOGGER.warning("Slug index refresh failed; serving the previous index: %s", e)
+            self._next_refresh = self.clock() + settings.slug_index_refresh_interval
+        finally:
+            self._refresh_task = None
+
+    async def _ensure_slug_index(self) -> None:
+        if not self._loaded:
+            async with self._lock:
+                if not self._loaded:
+                    await self.reload_slug_index()
+            return
+        if self.clock() >= self._next_refresh and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_in_background())
+
+    async def warm_slug_index(self) -> None:
+        """
+        Build the slug index now (start-up warm-up) instead of on the first lookup.
+        """
+        await self._ensure_slug_index()
+
+    def _remember_missing(self, slug: str) -> None:
+        self._missing[slug] = self.clock() + settings.slug_index_negative_ttl
+        self._missing.move_to_end(slug)
+        while len(self._missing) > settings.slug_index_max_negative:
+            self._missing.popitem(last=False)
+
+    async def get_by_slug(self, slug: str) -> Optional[ProductInDB]:
+        """
+        Look up a product by slug from the index.
+
+        A slug missing from the index gets one point query (it may be newer than the last
+        refresh); if that also misses, the slug is cached as not found.
+
+        :param slug: The product slug
+        :type slug: str
+        :return: The product, or None if no product has that slug.
+        :rtype: Optional[ProductInDB]
+        """
+        await self._ensure_slug_index()
+        product = self._by_slug.get(slug)
+        if product is not None:
+            return product
+
+        expires = self._missing.get(slug)
+        if expires is not None and expires > self.clock():
+            return None
+
+        products, _ = await self.uncached_manager.select_many(self.table_name, self.model_class, {"slug": slug})
+        if products:
+            self._index(products[:1], advance=False)
+            return products[0]
+        self._remember_missing(slug)
+        return None
+
+    async def all_products(self) -> list[ProductInDB]:
+        """
+        Every product ordered by id, from the slug index (no query once it is loaded).
+
+        The same list object is returned until a product changes, so its serialized JSON
+        can be cached by identity (util/responses.py). It must not be mutated.
+
+        :return: All products ordered by id.
+        :rtype: list[ProductInDB]
+        """
+        await self._ensure_slug_index()
+        if self._all is None:
+            self._all = sorted(self._by_id.values(), key=lambda product: product.id)
+        return self._all
+
+    async def select_summaries(self, condition: dict[str, Any], sort_by: Optional[str] = "id", sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None) -> list[ProductSummary]:
+        """
+        Select products without their description, for lists that only need titles, slugs and dates.
+
+        :return: The matching products as ProductSummary.
+        :rtype: list[ProductSummary]
+        """
+        summaries, _ = await self.manager.select_many(self.table_name, ProductSummary, condition, sort_by, sort_direction, start, end, list(ProductSummary.model_fields))
+        return summaries
@@ -0,0 +1,168 @@
+"""
+db/resilience.py - Request deadlines, the retry budget and the tenacity policy for database queries
+
+A deadline is an absolute time (time.monotonic) carried in a context variable: it is set
+once per HTTP request and every database call made on behalf of that request, however deep,
+sees how much time is left. Retries wait a jittered exponential backoff, are skipped when
+the backoff would overrun the deadline, and are drawn from a process-wide budget so an
+upstream incident cannot multiply the load on the database.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional
+
+from tenacity import retry_if_exception, stop_after_attempt, wait_random_exponential
+from tenacity.stop import stop_base
+
+from db.bulk import is_transient_error
+from util.metrics import DB_RETRIES_DENIED, record_retry
+from util.settings import settings
+
+_DEADLINE: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("db_deadline", default=None)
+
+
+class UpstreamUnavailableError(Exception):
+    """The database was not asked (or not waited for) because it is failing or too slow."""
+    retry_after: float = 1.0
+
+
+class DeadlineExceededError(UpstreamUnavailableError):
+    """The request's deadline passed before the database answered."""
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """The circuit breaker for a table is open; calls fail fast until it is probed again."""
+    def __init__(self, table: str, retry_after: float):
+        super().__init__(f"Circuit breaker for table '{table}' is open")
+        self.table = table
+        self.retry_after = retry_after
+
+
+def is_unavailable_error(e: BaseException) -> bool:
+    """
+    True when e means the database could not serve the call (as opposed to rejecting it),
+    i.e. when serving last-known-good data is the right fallback.
+    """
+    return isinstance(e, UpstreamUnavailableError) or is_transient_error(e)
+
+
+@contextlib.contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Run the enclosed block with a deadline seconds from now (None or 0 removes the deadline).
+
+    Background tasks copy the context of the request that spawned them, so they should
+    open their own deadline rather than inherit one that may already have passed.
+    """
+    token = _DEADLINE.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def time_remaining() -> Optional[float]:
+    """
+    Seconds left before the current deadline, or None when there is no deadline.
+
+    :return: Remaining seconds (0 once the deadline has passed) or None.
+    :rtype: Optional[float]
+    """
+    expires = _DEADLINE.get()
+    if expires is None:
+        return None
+    return max(0.0, expires - time.monotonic())
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of first attempts.
+
+    Every first attempt deposits ``ratio`` tokens and every retry spends one, plus
+    ``min_per_second`` tokens accrue over time so a quiet process can still retry.
+    The bucket holds at most ``max_tokens``.
+    """
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount: float) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            self._refill(0.0)
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+
+RETRY_BUDGET = RetryBudget(
+    settings.db_retry_budget_ratio,
+    settings.db_retry_budget_min_per_second,
+    settings.db_retry_budget_max_tokens,
+)
+
+
+class stop_before_deadline(stop_base):
+    """Stop when the next backoff would end after the current deadline."""
+    def __call__(self, retry_state: Any) -> bool:
+        remaining = time_remaining()
+        return remaining is not None and retry_state.upcoming_sleep >= remaining
+
+
+class stop_when_budget_exhausted(stop_base):
+    """Stop when the retry budget has no token left; spends one otherwise."""
+    def __call__(self, retry_state: Any) -> bool:
+        if RETRY_BUDGET.try_spend():
+            return False
+        DB_RETRIES_DENIED.inc(operation=getattr(retry_state.fn, "__name__", "unknown"))
+        return True
+
+
+def count_attempt(retry_state: Any) -> None:
+    """tenacity ``before`` hook: a first attempt earns retry budget."""
+    if retry_state.attempt_number == 1:
+        RETRY_BUDGET.deposit()
+
+
+# tenacity arguments for database queries. Stop conditions are checked left to right,
+# so the budget is only spent on a retry that will actually happen.
+QUERY_RETRY = dict(
+    stop=stop_after_attempt(settings.db_retry_attempts) | stop_before_deadline() | stop_when_budget_exhausted(),
+    wait=wait_random_exponential(multiplier=settings.db_retry_backoff, max=settings.db_retry_max_wait),
+    retry=retry_if_exception(is_transient_error),
+    before=count_attempt,
+    before_sleep=record_retry,
+    reraise=True,
+)
+
+
+class RequestDeadlineMiddleware:
+    """
+    ASGI middleware giving every HTTP request a deadline of ``request_deadline`` seconds
+    for its database work; endpoints may open a tighter or longer one with deadline().
+    """
+    def __init__(self, app: Any, seconds: Optional[float] = None):
+        self.app = app
+        self.seconds = settings.request_deadline if seconds is None else seconds
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not self.seconds:
+            await self.app(scope, receive, send)
+            return
+        with deadline(self.seconds):
+            await self.app(scope, receive, send)
@@ -0,0 +1,30 @@
+"""
+db/rows.py - Validating the rows a query returned into models
+"""
+import functools
+import time
+from typing import Any
+
+from pydantic import TypeAdapter
+
+from util.metrics import DB_PARSE_SECONDS, DB_ROWS
+
+
+@functools.lru_cache(maxsize=256)
+def rows_adapter(result_type: Any) -> TypeAdapter:
+    """The TypeAdapter validating a whole list of rows into result_type in one call."""
+    return TypeAdapter(list[result_type])
+
+
+def parse_rows(table: str, operation: str, result_type: Any, rows: list[dict[str, Any]]) -> list[Any]:
+    """
+    Validate rows into result_type, recording row count and parse time.
+
+    The list is validated in a single pydantic-core call rather than one constructor
+    call per row.
+    """
+    started = time.perf_counter()
+    items = rows_adapter(result_type).validate_python(rows)
+    DB_PARSE_SECONDS.observe(time.perf_counter() - started, table=table, operation=operation)
+    DB_ROWS.inc(len(items), table=table, operation=operation)
+    return items
@@ -0,0 +1,177 @@
+"""
+db/sharedcache.py - Key-value stores that let every uvicorn worker share one warmed read cache
+
+Entries are versioned by a per-table generation number kept in the same store.
+Invalidating a table bumps its generation: entries written under the old generation
+become unreachable (and expire), and other workers notice the new generation and drop
+their own in-process copies.
+"""
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+
+class KeyValueStore(ABC):
+    """Minimal byte store with TTLs and per-namespace generation counters."""
+    blocking = False  # True if calls do I/O and must run in a worker thread, not on the event loop
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        pass
+
+    @abstractmethod
+    def generations(self) -> dict[str, int]:
+        pass
+
+    @abstractmethod
+    def bump_generation(self, namespace: Optional[str] = None) -> None:
+        """Increment the generation of namespace, or of every namespace when None."""
+        pass
+
+    def get_object(self, key: str) -> Optional[tuple[Any, int]]:
+        """The unpickled value stored under key and its size in bytes, or None."""
+        data = self.get(key)
+        return (pickle.loads(data), len(data)) if data is not None else None
+
+    def set_object(self, key: str, value: Any, ttl: float) -> int:
+        """Store value pickled; return its size in bytes."""
+        # Results are written and read only by our own workers, so pickle is acceptable here.
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.set(key, data, ttl)
+        return len(data)
+
+
+class MemoryKeyValueStore(KeyValueStore):
+    """
+    In-process stand-in with the same semantics; useful for tests and single-worker runs.
+    """
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._entries: dict[str, tuple[bytes, float]] = {}
+        self._generations: dict[str, int] = {}
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= self.clock():
+            del self._entries[key]
+            return None
+        return entry[0]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._entries[key] = (value, self.clock() + ttl)
+
+    def generations(self) -> dict[str, int]:
+        return dict(self._generations)
+
+    def bump_generation(self, namespace: Optional[str] = None) -> None:
+        for name in ([namespace] if namespace is not None else list(self._generations)):
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+
+def default_sqlite_path() -> str:
+    """A file on /dev/shm when available (memory backed), otherwise in the temp dir."""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "kparalegal-cache.sqlite3")
+
+
+class SQLiteKeyValueStore(KeyValueStore):
+    """
+    KeyValueStore in a SQLite file shared by all worker processes on the host.
+
+    Uses WAL mode so readers never block each other. Each process opens its own
+    connection on first use. Expired rows are purged, and the table trimmed to
+    ``max_entries``, every ``purge_every`` writes. Calls block (up to the 1 s busy
+    timeout under write contention), so async callers run them in a thread.
+    """
+    blocking = True
+    def __init__(self, path: Optional[str] = None, max_entries: int = settings.cache_max_entries * 4, purge_every: int = 100):
+        self.path = path or default_sqlite_path()
+        self.max_entries = max_entries
+        self.purge_every = purge_every
+        self._writes = 0
+        self._pid: Optional[int] = None
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS generations (namespace TEXT PRIMARY KEY, generation INTEGER NOT NULL)")
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)", (key, value, time.time() + ttl)
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._purge()
+
+    def _purge(self) -> None:
+        self.connection.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        self.connection.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+        )
+
+    def generations(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self.connection.execute("SELECT namespace, generation FROM generations").fetchall())
+
+    def bump_generation(self, namespace: Optional[str] = None) -> None:
+        with self._lock:
+            if namespace is None:
+                self.connection.execute("UPDATE generations SET generation = generation + 1")
+            else:
+                self.connection.execute(
+                    "INSERT INTO generations (namespace, generation) VALUES (?, 1) "
+                    "ON CONFLICT(namespace) DO UPDATE SET generation = generation + 1", (namespace,)
+                )
+
+
+def create_shared_store(backend: str = settings.cache_shared_backend) -> Optional[KeyValueStore]:
+    """
+    Build the shared store selected by the cache_shared_backend setting.
+
+    :param backend: "none", "memory" or "sqlite".
+    :type backend: str
+    :return: The store, or None when sharing is disabled.
+    :rtype: Optional[KeyValueStore]
+    """
+    backend = backend.strip().lower()
+    if backend in ("", "none"):
+        return None
+    if backend == "memory":
+        return MemoryKeyValueStore()
+    if backend == "sqlite":
+        return SQLiteKeyValueStore(settings.cache_shared_path or None)
+    raise ValueError(f"Unknown cache_shared_backend: {backend}")
@@ -0,0 +1,51 @@
+"""
+db/singleflight.py - Coalesce concurrent identical reads into one database round trip
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Optional, Type
+
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from db.managerproxy import AsyncManagerProxy, query_key
+from db.supabasemanager import T
+from util.metrics import DB_COALESCED
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+
+class SingleFlightDatabaseManager(AsyncManagerProxy):
+    """
+    Deduplicates in-flight select_one/select_many/count calls with the same query key.
+
+    The first caller starts the query; callers that arrive before it finishes await the
+    same task and receive the same (shared, read-only) result or exception. The query
+    runs as its own task, so a cancelled caller does not cancel it for the others.
+    """
+    def __init__(self, inner: AsyncDatabaseManager):
+        super().__init__(inner)
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def _single_flight(self, key: tuple, loader: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+            DB_COALESCED.inc(table=key[1])
+            LOGGER.debug("Coalesced %s on %s with an in-flight query.", key[0], key[1])
+        return await asyncio.shield(task)
+
+    async def select_one(self, table: str, result_type: Type[T], condition: dict[str, Any]) -> Optional[T]:
+        key = query_key("select_one", table, result_type, condition)
+        return await self._single_flight(key, lambda: self.inner.select_one(table, result_type, condition))
+
+    async def select_many(self, table: str, result_type: Type[T], condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None, columns: Optional[list[str]] = None, count: Optional[str] = None) -> tuple[list[T], int]:
+        key = query_key("select_many", table, result_type, condition, sort_by, sort_direction, start, end, columns, count)
+        return await self._single_flight(key, lambda: self.inner.select_many(table, result_type, condition, sort_by, sort_direction, start, end, columns, count))
+
+    async def count(self, table: str, condition: dict[str, Any], method: str = "exact") -> int:
+        key = query_key("count", table, int, condition, count=method)
+        return await self._single_flight(key, lambda: self.inner.count(table, condition, method))
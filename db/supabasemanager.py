@@ -1,36 +1,190 @@
 from abc import ABC, abstractmethod
 import re
-from typing import Any, Optional, Type, TypeVar
+from typing import Any, Awaitable, Callable, Optional, Type, TypeVar
 from httpx import ConnectError
 from pydantic import BaseModel
 from supabase import create_client, Client
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import AsyncRetrying, Retrying, retry
 from postgrest.base_request_builder import APIResponse
 from postgrest.types import CountMethod
 from postgrest.exceptions import APIError
 
+from db.bulk import CHUNK_RETRY, BulkResult, RowError, chunked, is_transient_error
+from db.conditions import AnyOf, as_op, filter_value, or_filter, split_negation
+from db.resilience import QUERY_RETRY
+from db.rows import parse_rows
+from util.metrics import instrument_query
 from util.settings import settings
 from util.loggerfactory import LoggerFactory
 
-import logging
-
 LOGGER = LoggerFactory.create_logger(__name__)
 
-# Set the underlying libraries to DEBUG
-logging.getLogger("httpx").setLevel(logging.DEBUG)
-logging.getLogger("postgrest").setLevel(logging.DEBUG)
-
-# LOGGER = LoggerFactory.create_logger(__name__)
-
 T = TypeVar("T", bound=BaseModel)
 
+def duplicate_key_message(e: APIError) -> Optional[str]:
+    """
+    Describe a Postgres unique violation (code 23505), or return None for any other error.
+    """
+    if e.code != '23505':  # Dulicate key
+        return None
+    # e.details contains the key and value in this format: "Key (opinion_link)=(https://www.txcourts.gov/media/1461965/260010pc.pdf) already exists."
+    # Extract the Key ("opinion_link") and value ("https://www.txcourts...")
+    match = re.search(r'Key \(([^)]+)\)=\(([^)]+)\) already exists', e.details or '')
+    if match:
+        key_name = match.group(1)
+        key_value = match.group(2)
+        return f"Duplicate key detected. Key: {key_name}, Value: {key_value}"
+    return f"Duplicate key error {e.details}"
+
+def raise_if_duplicate_key(e: APIError) -> None:
+    """
+    Translate a Postgres unique violation into a KeyError naming the offending key.
+
+    :param e: Error raised by postgrest.
+    :type e: APIError
+    :raises KeyError: If the error is a duplicate key violation (code 23505).
+    """
+    message = duplicate_key_message(e)
+    if message is not None:
+        LOGGER.error("insert(): %s", message)
+        raise KeyError(message)
+
+def row_error_message(e: Exception) -> str:
+    """Message recorded in a bulk write report for a row that failed with e."""
+    if isinstance(e, APIError):
+        return duplicate_key_message(e) or e.message or str(e)
+    return str(e)
+
+def require_condition(operation: str, condition: dict[str, Any]) -> None:
+    """Refuse bulk updates/deletes without a filter, which would touch every row."""
+    if not condition:
+        raise ValueError(f"{operation} requires a non-empty condition")
+
+def present_values(values: list[Any], found: list[Any]) -> set[Any]:
+    """
+    The members of values that occur in found, the column values a query returned.
+
+    Values are compared as PostgREST renders them, so e.g. 5 matches a returned "5".
+    """
+    present = {str(filter_value(value)) for value in found}
+    return {value for value in values if str(filter_value(value)) in present}
+
+def chunk_failed(report: BulkResult, table: str, offset: int, chunk: list[dict[str, Any]], e: Exception) -> bool:
+    """
+    Handle a bulk write chunk that failed after its retries; return True to replay it row by row.
+
+    Only a chunk the database rejected (a constraint or a bad value in some row) is replayed,
+    to pinpoint the offending rows. After a network or server failure the replay would only
+    hit the same outage once per row, so every row of the chunk is reported failed.
+    """
+    if isinstance(e, APIError) and not is_transient_error(e):
+        LOGGER.warning("Bulk write of %d rows to %s at offset %d failed (%s); retrying row by row.", len(chunk), table, offset, e)
+        return True
+    LOGGER.warning("Bulk write of %d rows to %s at offset %d failed (%s); reporting the chunk failed.", len(chunk), table, offset, e)
+    message = row_error_message(e)
+    report.errors.extend(RowError(index, row, message) for index, row in enumerate(chunk, start=offset))
+    return False
+
+def log_bulk_report(table: str, report: BulkResult) -> None:
+    if report.errors:
+        LOGGER.error("Bulk write to %s: %d rows failed, %d succeeded.", table, len(report.errors), len(report.succeeded))
+
+def write_chunks(table: str, rows: list[dict[str, Any]], result_type: Type[T], write: Callable[[list[dict[str, Any]]], list[dict[str, Any]]], chunk_size: Optional[int]) -> BulkResult[T]:
+    """
+    Send rows in chunks through write(chunk) -> written rows, retrying transient failures
+    per chunk; a failed chunk is handled by chunk_failed. Used by the sync and local managers.
+
+    :return: Written records and per-row errors.
+    :rtype: BulkResult
+    """
+    report: BulkResult[T] = BulkResult()
+    for offset, chunk in chunked(rows, chunk_size or settings.db_bulk_chunk_size):
+        try:
+            for attempt in Retrying(**CHUNK_RETRY):
+                with attempt:
+                    written = write(chunk)
+        except Exception as e:
+            if not chunk_failed(report, table, offset, chunk, e):
+                continue
+            for index, row in enumerate(chunk, start=offset):
+                try:
+                    written = write([row])
+                except Exception as e:
+                    report.errors.append(RowError(index, row, row_error_message(e)))
+                else:
+                    report.succeeded.extend(result_type(**item) for item in written)
+        else:
+            report.succeeded.extend(result_type(**item) for item in written)
+    log_bulk_report(table, report)
+    return report
+
+async def write_chunks_async(table: str, rows: list[dict[str, Any]], result_type: Type[T], write: Callable[[list[dict[str, Any]]], Awaitable[list[dict[str, Any]]]], chunk_size: Optional[int]) -> BulkResult[T]:
+    """
+    write_chunks for an async write(chunk).
+    """
+    report: BulkResult[T] = BulkResult()
+    for offset, chunk in chunked(rows, chunk_size or settings.db_bulk_chunk_size):
+        try:
+            async for attempt in AsyncRetrying(**CHUNK_RETRY):
+                with attempt:
+                    written = await write(chunk)
+        except Exception as e:
+            if not chunk_failed(report, table, offset, chunk, e):
+                continue
+            for index, row in enumerate(chunk, start=offset):
+                try:
+                    written = await write([row])
+                except Exception as e:
+                    report.errors.append(RowError(index, row, row_error_message(e)))
+                else:
+                    report.succeeded.extend(result_type(**item) for item in written)
+        else:
+            report.succeeded.extend(result_type(**item) for item in written)
+    log_bulk_report(table, report)
+    return report
+
+# postgrest-py method for each condition operator whose name differs
+FILTER_METHODS = {"is": "is_", "in": "in_"}
+
+def apply_condition(query: Any, condition: dict[str, Any]) -> Any:
+    """
+    Add a PostgREST filter to query for each field in condition.
+
+    :param query: A sync or async postgrest filter request builder.
+    :type query: Any
+    :param condition: Field to value (or :class:`db.conditions.Op`) mapping.
+    :type condition: dict[str, Any]
+    :return: The filtered query builder.
+    :rtype: Any
+    """
+    for field, value in condition.items():
+        if isinstance(value, AnyOf):
+            query = query.or_(or_filter(value.alternatives))
+            continue
+        op = as_op(value)
+        negated, operator = split_negation(op.operator)
+        if negated:
+            query = query.not_
+        query = getattr(query, FILTER_METHODS.get(operator, operator))(field, filter_value(op.value))
+    return query
+
+def apply_order(query: Any, sort_by: Optional[str], sort_direction: str) -> Any:
+    """
+    Order query by sort_by, which may name several comma-separated columns (e.g. "updated_at,id").
+    """
+    if sort_by:
+        desc = sort_direction.lstrip().lower() == "desc"
+        for column in sort_by.split(","):
+            query = query.order(column.strip(), desc=desc)
+    return query
+
 class DatabaseManager(ABC):
     @abstractmethod
     def select_one(self, table:str, result_type: Type[T], condition: dict[str, Any]) -> Optional[T]:
         pass
 
     @abstractmethod
-    def select_many(self, table:str, result_type: Type[T], condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None) -> tuple[list[T], int]:
+    def select_many(self, table:str, result_type: Type[T], condition: dict[str, Any], sort_by: Optional[str] = None, sort_direction: str = "asc", start: Optional[int] = None, end: Optional[int] = None, columns: Optional[list[str]] = None, count: Optional[str] = None) -> tuple[list[T], int]:
         pass
 
     @abstractmethod
@@ -49,31 +203,68 @@ class DatabaseManager(ABC):
     def exists(self, table:str, field: str, value: Any) -> bool:
         pass
 
+    @abstractmethod
+    def count(self, table:str, condition: dict[str, Any], method: str = "exact") -> int:
+        pass
+
+    @abstractmethod
+    def exists_many(self, table:str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> set[Any]:
+        pass
+
+    @abstractmethod
+    def insert_many(self, table:str, rows: list[dict[str, Any]], result_type: Type[T], chunk_size: Optional[int] = None) -> BulkResult[T]:
+        pass
+
+    @abstractmethod
+    def upsert_many(self, table:str, rows: list[dict[str, Any]], result_type: Type[T], on_conflict: Optional[list[str]] = None, chunk_size: Optional[int] = None) -> BulkResult[T]:
+        pass
+
+    @abstractmethod
+    def update_many(self, table:str, condition: dict[str, Any], data: dict[str, Any], result_type: Type[T]) -> list[T]:
+        pass
+
+    @abstractmethod
+    def delete_where(self, table:str, condition: dict[str, Any]) -> int:
+        pass
+
+    @abstractmethod
+    def delete_in(self, table:str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> int:
+        pass
+
 class SupabaseManager(DatabaseManager):
     def __init__(self):
         self.url = settings.supabase_url
         self.key = settings.supabase_service_role_key
         if not self.url or not self.key:
             raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in .env")
+        # Connecting is deferred to the first query so constructing a manager never blocks.
+        self._client: Optional[Client] = None
+
+    @property
+    def client(self) -> Client:
+        """The Supabase client, connected (and credentials verified) on first use."""
+        if self._client is None:
+            self._client = self._connect()
+        return self._client
+
+    def _connect(self) -> Client:
         try:
-            self.client: Client = create_client(self.url, self.key)
+            client: Client = create_client(self.url, self.key)
             # Standard way to verify connection & credentials
-            self.client.auth.get_user() 
+            client.auth.get_user() 
             LOGGER.info("Successfully connected to Supabase.")
+            return client
         except ConnectError:
             LOGGER.error("Failed to connect: Network unreachable.")
             raise
         except APIError as e:
-            LOGGER.error(f"Supabase API Error (check your key): {e}")
+            LOGGER.error("Supabase API Error (check your key): %s", e)
             raise
         except Exception as e:
-            LOGGER.error(f"Unexpected Supabase connection error: {e}")
+            LOGGER.error("Unexpected Supabase connection error: %s", e)
             raise
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type(APIError)
-    )
+    @retry(**QUERY_RETRY)
+    @instrument_query("select_one")
     def select_one(
         self,
         table:str,
@@ -82,8 +273,7 @@ class SupabaseManager(DatabaseManager):
         ) -> Optional[T]:
 
         query = self.client.table(table).select("*")
-        for field, value in condition.items():
-            query = query.eq(field, value)
+        query = apply_condition(query, condition)
 
         try:
             result: APIResponse = query.single().execute()
@@ -94,14 +284,11 @@ class SupabaseManager(DatabaseManager):
             raise
 
         if isinstance(result.data, dict):
-            return result_type(**result.data)
+            return parse_rows(table, "select_one", result_type, [result.data])[0]
         raise ValueError(f"No record found matching the condition: %s", result.data)
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type(APIError)
-    )
+    @retry(**QUERY_RETRY)
+    @instrument_query("select_many")
     def select_many(
         self,
         table:str,
@@ -110,7 +297,9 @@ class SupabaseManager(DatabaseManager):
         sort_by: Optional[str] = None,
         sort_direction: str = "asc",
         start: Optional[int] = None,
-        end: Optional[int] = None
+        end: Optional[int] = None,
+        columns: Optional[list[str]] = None,
+        count: Optional[str] = None
         ) -> tuple[list[T], int]:
         """
         Select multiple records from the specified table based on conditions.
@@ -122,7 +311,7 @@ class SupabaseManager(DatabaseManager):
         :param result_type: Subclass of BaseModel to parse the results into.
         :type result_type: Type[BaseModel]
 
-        :param condition: Dictionary of field-value pairs for filtering results.
+        :param condition: Dictionary of field-value pairs for filtering results. Values may be wrapped in a db.conditions operator such as gt().
         :type condition: dict[str, Any]
 
         :param sort_by: Field to sort the results by.
@@ -137,27 +326,28 @@ class SupabaseManager(DatabaseManager):
         :param end: Ending index for the range of results to fetch.
         :type end: Optional[int]
 
+        :param columns: Columns to fetch instead of "*"; result_type must accept the projected rows.
+        :type columns: Optional[list[str]]
+
+        :param count: Count method ("exact", "planned" or "estimated") for the total; None skips counting.
+        :type count: Optional[str]
+
         :return: A tuple containing a list of parsed BaseModel instances and the total count of matching records.
         :rtype: tuple[list[BaseModel], int]
         """
 
-        query = self.client.table(table).select("*")
+        query = self.client.table(table).select(*(columns or ["*"]), count=CountMethod(count) if count else None)
 
-        for field, value in condition.items():
-            query = query.eq(field, value)
-        if sort_by:
-            query = query.order(sort_by, desc=(sort_direction.lstrip().lower() == "desc"))
+        query = apply_condition(query, condition)
+        query = apply_order(query, sort_by, sort_direction)
         if start is not None and end is not None:
             query = query.range(start, end)
 
         result = query.execute()
-        return [result_type(**item) for item in result.data], result.count  # type: ignore
+        return parse_rows(table, "select_many", result_type, result.data), result.count  # type: ignore
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type(APIError)
-    )
+    @retry(**QUERY_RETRY)
+    @instrument_query("insert")
     def insert(self, table: str, data: Any, result_type: Type[T]) -> T:
         """
         Docstring for insert
@@ -184,30 +374,15 @@ class SupabaseManager(DatabaseManager):
                 raise ValueError(f"Insert operation failed for table {table} with data: {data}")
             return result_type(**result.data[0])  # type: ignore
         except APIError as e:
-            if e.code == '23505':  # Dulicate key
-                # e.details contains the key and value in this format: "Key (opinion_link)=(https://www.txcourts.gov/media/1461965/260010pc.pdf) already exists."
-                # Extract the Key ("opinion_link") and value ("https://www.txcourts...")
-                # Generate the regex and re code
-                match = re.search(r'Key \(([^)]+)\)=\(([^)]+)\) already exists', e.details or '')
-                if match:
-                    key_name = match.group(1)
-                    key_value = match.group(2)
-                    message = f"Duplicate key detected. Key: {key_name}, Value: {key_value}"
-                else:
-                    message = f"Duplicate key error {e.details}"
-                LOGGER.error("insert(): %s", message)
-                raise KeyError(message)
+            raise_if_duplicate_key(e)
             raise
         except Exception as e:
-            LOGGER.error(f"Error inserting into {table}: {e}")
+            LOGGER.error("Error inserting into %s: %s", table, e)
             LOGGER.exception(e)
             raise
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type(APIError)
-    )
+    @retry(**QUERY_RETRY)
+    @instrument_query("update")
     def update(self, table:str, record_id: Any, data: dict[str, Any], result_type: Type[T]) -> T:
         """
         Docstring for update
@@ -228,11 +403,8 @@ class SupabaseManager(DatabaseManager):
         result = self.client.table(table).update(data).eq("id", record_id).execute()
         return result_type(**result.data[0])  # type: ignore
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type(APIError)
-    )
+    @retry(**QUERY_RETRY)
+    @instrument_query("delete")
     def delete(self, table:str, record_id: Any) -> bool:
         """
         Docstring for delete
@@ -249,37 +421,144 @@ class SupabaseManager(DatabaseManager):
         _ = self.client.table(table).delete().eq("id", record_id).execute()
         return True
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type(APIError)
-    )
+    @retry(**QUERY_RETRY)
+    @instrument_query("exists")
     def exists(self, table:str, field: str, value: Any) -> bool:
         """
-        Docstring for exists
-        
-        Args:
-        :param self: Description
-        :param table: Description
+        Whether any record has field equal to value (or matching an Op such as in_(...)).
+
+        Fetches at most one row of one column, so the database can stop at the first match.
+
+        :param table: Name of the table to probe.
         :type table: str
-        :param field: Description
+        :param field: Field to test.
         :type field: str
-        :param value: Description
+        :param value: Value or :class:`db.conditions.Op` to test field with.
         :type value: Any
 
-        :return: Description
+        :return: True if at least one record matches.
         :rtype: bool
         """
-        try:
-            result = self.client.table(table).select("id", count=CountMethod.exact).eq(field, value).single().execute()
-            return (result.count or 0) > 0
-        except APIError as e:
-            if e.code == 'PGRST116':  # No match found
-                return False
-        except Exception as e:
-            LOGGER.error("exists(): %s", e)
-            if logging.getLevelName(LOGGER.getEffectiveLevel()) == "DEBUG":
-                LOGGER.exception(e)
-            raise
-        return False
-    
\ No newline at end of file
+        result = apply_condition(self.client.table(table).select(field), {field: value}).limit(1).execute()
+        return bool(result.data)
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("count")
+    def count(self, table: str, condition: dict[str, Any], method: str = "exact") -> int:
+        """
+        Count the records matching condition without fetching any of them (a HEAD request).
+
+        :param table: Name of the table to count.
+        :type table: str
+        :param condition: Filter, as for select_many; empty counts the whole table.
+        :type condition: dict[str, Any]
+        :param method: "exact", or "planned"/"estimated" for a cheap estimate from the planner statistics.
+        :type method: str
+
+        :return: Number of matching records.
+        :rtype: int
+        """
+        query = self.client.table(table).select("*", count=CountMethod(method), head=True)
+        result = apply_condition(query, condition).execute()
+        return result.count or 0
+
+    @instrument_query("exists_many")
+    def exists_many(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> set[Any]:
+        """
+        Find which of values are present in field, with ``in`` queries of chunk_size values.
+
+        Values already found are left out of the next query for the same chunk, so a field
+        with many rows per value is paged through in at most db_max_rows rows at a time and
+        is never cut short by PostgREST's row limit. Each query is retried on its own.
+
+        :param table: Name of the table to probe.
+        :type table: str
+        :param field: Field to look values up in.
+        :type field: str
+        :param values: Candidate values, e.g. the slugs of rows about to be imported.
+        :type values: list[Any]
+        :param chunk_size: Values per request; defaults to the db_exists_chunk_size setting.
+        :type chunk_size: Optional[int]
+
+        :return: The members of values that some record has in field.
+        :rtype: set[Any]
+        """
+        found: list[Any] = []
+        for _, chunk in chunked(list(dict.fromkeys(values)), chunk_size or settings.db_exists_chunk_size):
+            remaining = chunk
+            while remaining:
+                for attempt in Retrying(**QUERY_RETRY):
+                    with attempt:
+                        result = self.client.table(table).select(field).in_(field, filter_value(remaining)).limit(settings.db_max_rows).execute()
+                page = [row[field] for row in result.data]
+                found.extend(page)
+                if len(page) < settings.db_max_rows:
+                    break
+                present = present_values(remaining, page)
+                remaining = [value for value in remaining if value not in present]
+        return present_values(values, found)
+
+    @instrument_query("insert_many")
+    def insert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], chunk_size: Optional[int] = None) -> BulkResult[T]:
+        """
+        Insert rows in chunks of chunk_size (default db_bulk_chunk_size) requests.
+
+        :return: Inserted records and, for rows that failed, their index and error (duplicate keys are named).
+        :rtype: BulkResult
+        """
+        return write_chunks(table, rows, result_type, lambda chunk: self.client.table(table).insert(chunk).execute().data, chunk_size)
+
+    @instrument_query("upsert_many")
+    def upsert_many(self, table: str, rows: list[dict[str, Any]], result_type: Type[T], on_conflict: Optional[list[str]] = None, chunk_size: Optional[int] = None) -> BulkResult[T]:
+        """
+        Insert rows, updating existing ones that collide on the on_conflict columns (the primary key by default).
+
+        :return: Written records and per-row errors.
+        :rtype: BulkResult
+        """
+        conflict = ",".join(on_conflict or [])
+        return write_chunks(table, rows, result_type, lambda chunk: self.client.table(table).upsert(chunk, on_conflict=conflict).execute().data, chunk_size)
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("update_many")
+    def update_many(self, table: str, condition: dict[str, Any], data: dict[str, Any], result_type: Type[T]) -> list[T]:
+        """
+        Apply the same data to every record matching condition in one request.
+
+        :return: The updated records.
+        :rtype: list[BaseModel]
+        :raises ValueError: If condition is empty.
+        """
+        require_condition("update_many", condition)
+        result = apply_condition(self.client.table(table).update(data), condition).execute()
+        return parse_rows(table, "update_many", result_type, result.data)
+
+    @retry(**QUERY_RETRY)
+    @instrument_query("delete_where")
+    def delete_where(self, table: str, condition: dict[str, Any]) -> int:
+        """
+        Delete every record matching condition in one request.
+
+        :return: Number of records deleted.
+        :rtype: int
+        :raises ValueError: If condition is empty.
+        """
+        require_condition("delete_where", condition)
+        result = apply_condition(self.client.table(table).delete(), condition).execute()
+        return len(result.data)
+
+    @instrument_query("delete_in")
+    def delete_in(self, table: str, field: str, values: list[Any], chunk_size: Optional[int] = None) -> int:
+        """
+        Delete records whose field is one of values, chunk_size values per request.
+
+        :return: Number of records deleted.
+        :rtype: int
+        """
+        deleted = 0
+        for _, chunk in chunked(values, chunk_size or settings.db_bulk_chunk_size):
+            for attempt in Retrying(**CHUNK_RETRY):
+                with attempt:
+                    result = self.client.table(table).delete().in_(field, chunk).execute()
+            deleted += len(result.data)
+        return deleted
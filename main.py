@@ -1,35 +1,125 @@
+import asyncio
 import os
-from typing import Dict, List
+from contextlib import asynccontextmanager
+from typing import Dict, List, Literal, Optional
 
-from fastapi import FastAPI, Request, HTTPException, Response
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from db.models.product import ProductInDB
+import anyio
+from fastapi import FastAPI, Query, Request, HTTPException, Response
+from fastapi.responses import JSONResponse
+from db.models.product import ProductInDB, ProductSummary
 from db.models.parameter import ParameterInDB
 
 from util.loggerfactory import LoggerFactory
-from db.supabasemanager import SupabaseManager
-from db.repositories.product import ProductRepository
-from db.repositories.parameter import ParameterRepository
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from db.cachingmanager import CachingDatabaseManager
+from db.changefeed import ChangeTracker, create_change_source
+from db.circuitbreaker import CircuitBreakerDatabaseManager
+from db.managerfactory import DatabaseManagerFactory
+from db.sharedcache import create_shared_store
+from db.singleflight import SingleFlightDatabaseManager
+from db.repositories.product import AsyncProductRepository
+from db.repositories.parameter import ALL_ENVIRONMENTS, AsyncParameterRepository
+from db.resilience import RequestDeadlineMiddleware, UpstreamUnavailableError
+from util.metrics import METRICS, PROMETHEUS_MEDIA_TYPE, RequestMetricsMiddleware
+from util.responses import conditional_response, json_response
+from util.search import ProductSearch
 from util.settings import settings
+from util.sitemap import SitemapService
+from util.batch import BatchReader, BatchRequest
+from util.images import ImageVariants
+from util.prerender import PageRenderer
+from util.staticassets import AssetFiles
+from util.startup import StartupState
 
 LOGGER = LoggerFactory.create_logger(__name__)
 
+# --- DATA MODELS (For response_model in endpoints) ---
+DB_MANAGER: AsyncDatabaseManager = DatabaseManagerFactory.create_async_manager()
+if settings.db_breaker_enabled:
+    DB_MANAGER = CircuitBreakerDatabaseManager(DB_MANAGER)
+# The change tracker reads below the single-flight and caching layers
+CHANGE_SOURCE = create_change_source(DB_MANAGER, ["products", "parameters"])
+if settings.db_single_flight:
+    DB_MANAGER = SingleFlightDatabaseManager(DB_MANAGER)
+if settings.cache_enabled:
+    DB_MANAGER = CachingDatabaseManager(DB_MANAGER, shared=create_shared_store())
+PRODUCTS = AsyncProductRepository(DB_MANAGER)
+PARAMETERS = AsyncParameterRepository(DB_MANAGER)
+SITEMAP = SitemapService(PRODUCTS)
+SEARCH = ProductSearch(PRODUCTS)
+BATCH = BatchReader(PRODUCTS, PARAMETERS, SEARCH)
+if isinstance(DB_MANAGER, CachingDatabaseManager):
+    DB_MANAGER.add_invalidation_listener(PRODUCTS.invalidate_slug_index)
+    DB_MANAGER.add_invalidation_listener(PARAMETERS.invalidate_snapshot)
+    DB_MANAGER.add_invalidation_listener(SITEMAP.invalidate)
+STARTUP = StartupState(DB_MANAGER)
+DIST_FILES = AssetFiles(directory="dist", html=True, hashed_dir="assets") if os.path.exists("dist") else None
+PAGES = PageRenderer(DIST_FILES, PRODUCTS) if DIST_FILES is not None and settings.prerender_enabled else None
+IMAGE_FILES = AssetFiles(directory="images") if os.path.exists("images") else None
+IMAGES = ImageVariants(IMAGE_FILES) if IMAGE_FILES is not None else None
+CHANGES = ChangeTracker(CHANGE_SOURCE) if CHANGE_SOURCE is not None else None
+if CHANGES is not None:
+    if isinstance(DB_MANAGER, CachingDatabaseManager):
+        CHANGES.add_listener(DB_MANAGER.apply_change)
+    CHANGES.add_listener(PRODUCTS.apply_change)
+    CHANGES.add_listener(PARAMETERS.apply_change)
+    CHANGES.add_listener(lambda change: SITEMAP.invalidate(change.table))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Application lifespan: moves uvicorn's loggers onto the non-blocking log pipeline, warms the
+    product, parameter and sitemap caches and the static files in the background (the worker serves liveness checks
+    immediately and reports ready once the warm-up finishes), starts the change tracker and the
+    metrics flusher, and releases the pooled database connections on shutdown.
+    """
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        LoggerFactory.adopt_logger(name)
+    METRICS.start()
+    tasks = []
+    if settings.startup_warmup:
+        tasks.append(STARTUP.start_warm_up({
+            "products": PRODUCTS.warm_slug_index,
+            "parameters": PARAMETERS.snapshot,
+            "sitemap": SITEMAP.warm,
+            **({"static": DIST_FILES.warm} if DIST_FILES is not None else {}),
+        }))
+    if CHANGES is not None:
+        tasks.append(CHANGES.start())
+    if settings.image_pregenerate and IMAGES is not None:
+        tasks.append(asyncio.create_task(pregenerate_product_images()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if IMAGES is not None:
+        IMAGES.close()
+    await DB_MANAGER.aclose()
+    METRICS.close()
+
 app = FastAPI(
     title="K-Paralegal API",
     version=settings.version,
     docs_url="/api/docs",
     redoc_url="/api/redoc",
     openapi_url="/api/openapi.json",
-    description="API for Texas Law Brand Engine - Strategic Litigation Roadmap Generator"
+    description="API for Texas Law Brand Engine - Strategic Litigation Roadmap Generator",
+    lifespan=lifespan
 )
 
-# --- DATA MODELS (For response_model in endpoints) ---
-DB_MANAGER = SupabaseManager()
-PRODUCTS = ProductRepository(DB_MANAGER)
-PARAMETERS = ParameterRepository(DB_MANAGER)
 # --- HELPER FUNCTIONS & CLASSES ---
 
+async def pregenerate_product_images() -> None:
+    """
+    Encode the configured variants of every product image in /images ahead of the first visitors.
+    """
+    products = await PRODUCTS.select_summaries({})
+    names = {product.image_path.rsplit("/", 1)[-1] for product in products if product.image_path.startswith("/images/")}
+    await IMAGES.pregenerate(sorted(names))
+
+app.add_middleware(RequestDeadlineMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+
 
 # --- Crawler Information Route ---
 @app.get('/robots.txt')
@@ -43,75 +133,76 @@ async def robots_txt() -> Response:
     content = "User-agent: *\nAllow: *\n\nSitemap: {}/sitemap.xml".format(settings.host_url)
     return Response(content=content, media_type="text/plain")
 
-def products_sitemap_urls() -> List[Dict[str, str]]:
-    """
-    Generate sitemap URLs for court opinions.
-
-    :return: List of URLs for court opinions.
-    :rtype: List[Dict[str, str]]
+@app.get('/sitemap.xml')
+async def sitemap_xml(request: Request) -> Response:
     """
-    products: List[ProductInDB]
-    products, _ = PRODUCTS.select_many(condition={})
-    urls: List[Dict[str, str]] = [{"loc": f"{settings.host_url}/products/{product.slug}", "lastmod": (product.updated_at or product.created_at).strftime("%Y-%m-%d")} for product in products]  # type: ignore
-    return urls
+    Serves the sitemap.xml file (or a sitemap index for large catalogs) for SEO purposes.
 
-def static_page_urls() -> List[Dict[str, str]]:
-    """
-    Generate sitemap URLS for static pages
-    
-    :return: List of site map data
-    :rtype: List[Dict[str, str]]
+    :return: XML response containing the sitemap, or 304 if the crawler's copy is current.
+    :rtype: Response
     """
-    urls = ['about', 'contact', 'privacy', 'blog', 'services', 'terms']
-    return [
-        {"loc": f"{settings.host_url}/{url}", "lastmod": "2026-02-07"} for url in urls
-    ]
-
+    return await SITEMAP.response(request.headers)
 
-@app.get('/sitemap.xml')
-async def sitemap_xml():
+@app.get('/sitemap-{part}.xml')
+async def sitemap_part_xml(part: int, request: Request) -> Response:
     """
-    Serves the sitemap.xml file for SEO purposes.
+    Serves one numbered sitemap file listed in the sitemap index.
 
-    :return: XML response containing the sitemap.
+    :param part: 1-based sitemap file number
+    :type part: int
+    :return: XML response containing the sitemap file.
     :rtype: Response
     """
-    product_urls = products_sitemap_urls()
-    static_urls = static_page_urls()
-    all_urls = product_urls + static_urls
-    url_entries = ""
-    for url in all_urls:
-        url_entries += f"""   <url>
-        <loc>{url['loc']}</loc>
-        <lastmod>{url['lastmod']}</lastmod>
-        <changefreq>monthly</changefreq>
-    </url>
-"""
-    content = f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n{url_entries}</urlset>'
-    return Response(content=content, media_type="application/xml")
+    return await SITEMAP.response(request.headers, part)
 
 
 # --- TEST ENDPOINT ---
 
 @app.get("/api/healthcheck")
 async def healthcheck():
+    """
+    Liveness check: answers as soon as the worker is up, without touching the database.
+    """
     return {"status": "ok", "message": "Texas Law Brand Engine API is running."}
 
+@app.get("/api/readiness")
+async def readiness() -> JSONResponse:
+    """
+    Readiness check: 200 once every warm-up step has succeeded and the database answers, 503 before that.
+
+    :return: The verdict with the status of each warm-up step and of the database.
+    :rtype: JSONResponse
+    """
+    ready, report = await STARTUP.readiness()
+    return JSONResponse(status_code=200 if ready else 503, content=report)
+
+@app.get("/api/metrics")
+async def metrics() -> Response:
+    """
+    Serves request, database and cache metrics for all workers in the Prometheus text format.
+
+    :return: Plain text exposition of every metric.
+    :rtype: Response
+    """
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=await anyio.to_thread.run_sync(METRICS.render), media_type=PROMETHEUS_MEDIA_TYPE)
+
 # -- PARAMS ENDPOINTS ---
 
 @app.get("/api/parameters", response_model=List[ParameterInDB])
-async def get_parameters():
+async def get_parameters(request: Request) -> Response:
     """
     Get all parameters ordered by their id field.
 
     :return: List of parameters
     :rtype: List[ParameterInDB]
     """
-    parameters, _ = PARAMETERS.select_many(condition={"environment": "*"}, sort_by="id", sort_direction="asc")
-    return parameters
+    snapshot = await PARAMETERS.snapshot()
+    return conditional_response(request, snapshot.json("*"), snapshot.etag("*"))
 
 @app.get("/api/parameters/{environment}", response_model=List[ParameterInDB])
-async def get_parameters_by_environment(environment: str):
+async def get_parameters_by_environment(environment: str, request: Request) -> Response:
     """
     Get parameters by environment.
 
@@ -120,33 +211,69 @@ async def get_parameters_by_environment(environment: str):
     :return: List of parameters for the specified environment
     :rtype: List[ParameterInDB]
     """
-
-    # First get all parameters (environment="*"), then get overrides for the specific environment and merge them
-    all_parameters, _ = PARAMETERS.select_many(condition={"environment": "*"}, sort_by="id", sort_direction="asc")
-    env_parameters, _ = PARAMETERS.select_many(condition={"environment": environment}, sort_by="id", sort_direction="asc")
-
-    # Create a dictionary to hold the merged parameters
-    merged_parameters = {param.key: param for param in all_parameters}
-    for param in env_parameters:
-        merged_parameters[param.key] = param
-
-    return list(merged_parameters.values())
+    # All parameters (environment="*") merged with the overrides for the environment, precomputed and pre-serialized
+    snapshot = await PARAMETERS.snapshot()
+    return conditional_response(request, snapshot.json(environment), snapshot.etag(environment))
 
 # --- PRODUCT ENDPOINTS ---
 
 @app.get("/api/products", response_model=List[ProductInDB])
-async def get_products():
+async def get_products(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=settings.products_page_max_limit, description="Page size; omit to return every product"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    order: Literal["id", "updated_at"] = Query("id", description="Keyset order; updated_at ties are broken by id"),
+    count: Optional[Literal["exact", "planned", "estimated"]] = Query(None, description="Return the total in X-Total-Count"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return instead of the whole product"),
+    view: Literal["full", "summary"] = Query("full", description="summary omits the markdown description"),
+) -> Response:
     """
-    Get all products ordered by their id field.
+    Get products ordered by id (or by updated_at, id), optionally one page at a time.
+
+    The cursor for the next page is returned in the X-Next-Cursor header (and a Link rel="next" header).
 
     :return: List of products
     :rtype: List[ProductInDB]
+    :raises HTTPException: 400 for an unknown field or a malformed cursor
+    """
+    try:
+        page = await PRODUCTS.select_page(
+            limit,
+            cursor,
+            order,
+            fields=[name.strip() for name in fields.split(",") if name.strip()] if fields else None,
+            count=count,
+            result_type=ProductSummary if view == "summary" else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers: Dict[str, str] = {}
+    if page.next_cursor:
+        headers["X-Next-Cursor"] = page.next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=page.next_cursor)}>; rel="next"'
+    if page.total is not None:
+        headers["X-Total-Count"] = str(page.total)
+    return json_response(request, page.items, headers)
+
+@app.get("/api/products/search", response_model=List[ProductSummary])
+async def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200, description="Search words; the last may be partial and spelling may be off"),
+    limit: int = Query(settings.search_default_limit, ge=1, le=settings.search_max_limit),
+) -> Response:
+    """
+    Search product titles, slugs and descriptions, most relevant first.
+
+    Declared before /api/products/{slug} so "search" is not taken for a slug.
+
+    :return: Matching products without their descriptions
+    :rtype: List[ProductSummary]
     """
-    products, _ = PRODUCTS.select_many(condition={}, sort_by="id", sort_direction="asc")
-    return products
+    return json_response(request, await SEARCH.search(q, limit))
 
 @app.get("/api/products/{slug}", response_model=ProductInDB)
-async def get_product_by_slug(slug: str):
+async def get_product_by_slug(slug: str, request: Request) -> Response:
     """
     Get a single product by its slug.
 
@@ -156,27 +283,99 @@ async def get_product_by_slug(slug: str):
     :rtype: ProductInDB
     :raises HTTPException: 404 if product not found
     """
-    products, _ = PRODUCTS.select_many(condition={"slug": slug})
-    if not products:
+    product = await PRODUCTS.get_by_slug(slug)
+    if product is None:
         raise HTTPException(status_code=404, detail=f"Product with slug '{slug}' not found")
-    return products[0]
+    return json_response(request, product)
+
+# --- BATCH ENDPOINTS ---
+
+@app.post("/api/batch")
+async def batch(batch_request: BatchRequest) -> Response:
+    """
+    Resolve several named reads (product, products, parameters, search) concurrently in one round trip.
+
+    :return: {"results": {name: {"status": ..., "body": ...}}}; each read fails on its own
+    :rtype: Response
+    """
+    return Response(content=await BATCH.run(batch_request), media_type="application/json")
+
+@app.get("/api/bootstrap")
+@app.get("/api/bootstrap/{environment}")
+async def bootstrap(request: Request, environment: str = ALL_ENVIRONMENTS) -> Response:
+    """
+    Everything a page load needs in one payload: every product and the merged parameters.
+
+    :param environment: The environment whose parameters to merge (e.g., 'production'); all environments when omitted
+    :type environment: str
+    :return: {"products": [...], "parameters": [...]}, or 304 if unchanged
+    :rtype: Response
+    """
+    body, etag = await BATCH.bootstrap(environment)
+    return conditional_response(request, body, etag)
+
+# --- IMAGE ENDPOINTS ---
+
+@app.api_route("/images/{name}", methods=["GET", "HEAD"], include_in_schema=False)
+async def get_image(
+    name: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=4096, description="Width in pixels, rounded up to a configured width; never enlarges"),
+    fmt: Optional[Literal["auto", "avif", "webp", "jpeg", "png"]] = Query(None, description="Output format; auto picks AVIF or WebP from the Accept header"),
+) -> Response:
+    """
+    Serve an image from /images, resized and re-encoded when w or fmt is given.
+
+    :raises HTTPException: 404 if there is no such image
+    """
+    if IMAGES is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return await IMAGES.response(name, request.scope, w, fmt)
 
 # --- STATIC FILES & SPA ROUTING ---
 
-# Images directory
-if os.path.exists("images"):
+@app.get("/product/{slug}", include_in_schema=False)
+@app.get("/products/{slug}", include_in_schema=False)
+async def get_product_page(slug: str, request: Request) -> Response:
+    """
+    Serve the SPA page for a product with its title, description, image, canonical URL
+    and JSON-LD already in the HTML, for crawlers and link previews.
+
+    :raises HTTPException: 404 if pages are not prerendered (the SPA shell is served instead)
+    """
+    if PAGES is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return await PAGES.product_response(slug, request)
+
+# Images directory (nested paths; single file names are served by get_image)
+if IMAGE_FILES is not None:
     LOGGER.debug("Mounting 'images' directory for static files.")
-    app.mount("/images", StaticFiles(directory="images"), name="images")
+    app.mount("/images", IMAGE_FILES, name="images")
 
 # Other public static resources
 if os.path.exists("public"):
     LOGGER.debug("Mounting 'public' directory for static files.")
-    app.mount("/public", StaticFiles(directory="public"), name="public")
+    app.mount("/public", AssetFiles(directory="public"), name="public")
 
 # Mount the 'dist' directory created by 'npm run build'
-if os.path.exists("dist"):
+if DIST_FILES is not None:
     LOGGER.debug("Mounting 'dist' directory for static files.")
-    app.mount("/", StaticFiles(directory="dist", html=True), name="static")
+    app.mount("/", DIST_FILES, name="static")
+
+@app.exception_handler(UpstreamUnavailableError)
+async def upstream_unavailable_exception_handler(request: Request, exc: UpstreamUnavailableError) -> JSONResponse:
+    """
+    The database is failing or too slow (circuit open or deadline passed) and no
+    last-known-good data was cached: answer 503 quickly instead of hanging.
+
+    :return: 503 with a Retry-After header.
+    :rtype: JSONResponse
+    """
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
 
 @app.exception_handler(404)
 async def not_found_exception_handler(request: Request, exc: HTTPException):
@@ -189,19 +388,23 @@ async def not_found_exception_handler(request: Request, exc: HTTPException):
         exc: The exception that was raised.
 
     Returns:
-        FileResponse: The index.html file to let React Router handle the route (for non-API paths only).
+        Response: The index.html file to let React Router handle the route (for non-API paths only).
     """
     # If this is an API request, return the proper JSON 404 error
     if request.url.path.startswith("/api/"):
-        from fastapi.responses import JSONResponse
         return JSONResponse(
             status_code=404,
             content={"detail": str(exc.detail) if hasattr(exc, 'detail') else "Not found"}
         )
 
-    # For all other paths, serve index.html for SPA client-side routing
-    LOGGER.debug(f"404 Not Found: {request.url.path}. Serving index.html for SPA routing.")
-    return FileResponse("dist/index.html")
+    # For all other paths, serve index.html (held in memory) for SPA client-side routing
+    LOGGER.debug("404 Not Found: %s. Serving index.html for SPA routing.", request.url.path)
+    if DIST_FILES is None:
+        return JSONResponse(status_code=404, content={"detail": "Not found"})
+    if PAGES is not None:
+        # Known landing pages get their own title, description and canonical URL
+        return await PAGES.page_response(request)
+    return await DIST_FILES.index_response(request.scope)
 
 if __name__ == "__main__":
     import uvicorn
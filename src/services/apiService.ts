@@ -1,4 +1,5 @@
 import {
+  Bootstrap,
   Parameter,
   Product
 } from '../types';
@@ -19,25 +20,43 @@ const getBaseUrl = () => {
 
 const API_BASE = getBaseUrl();
 
+// Products and parameters arrive together in one request, shared by every page of the visit
+let bootstrapRequest: Promise<Bootstrap> | null = null;
+let bootstrapData: Bootstrap | null = null;
+
 
 export const apiService = {
-    getProducts: async (): Promise<Product[]> => {
-        try {
-        const url = `${API_BASE}/products`;
-        const response = await fetch(url);
-            
-        if (!response.ok) {
-            throw new Error(`Network response from ${url} was not ok: ${response.statusText}`);
-        }
-            
-        return await response.json();
-        } catch (error) {
-        console.error("Failed to fetch products:", error);
-        throw error;
+    getBootstrap: (): Promise<Bootstrap> => {
+        if (!bootstrapRequest) {
+            bootstrapRequest = (async () => {
+                const url = `${API_BASE}/bootstrap`;
+                const response = await fetch(url);
+
+                if (!response.ok) {
+                    throw new Error(`Network response from ${url} was not ok: ${response.statusText}`);
+                }
+
+                bootstrapData = await response.json();
+                return bootstrapData as Bootstrap;
+            })().catch((error) => {
+                // Let the next call try again
+                bootstrapRequest = null;
+                console.error("Failed to fetch bootstrap data:", error);
+                throw error;
+            });
         }
+        return bootstrapRequest;
+    },
+
+    getProducts: async (): Promise<Product[]> => {
+        return (await apiService.getBootstrap()).products;
     },
 
     getProductBySlug: async (slug: string): Promise<Product> => {
+        const loaded = bootstrapData?.products.find((product) => product.slug === slug);
+        if (loaded) {
+            return loaded;
+        }
         try {
         const url = `${API_BASE}/products/${slug}`;
         const response = await fetch(url);
@@ -54,6 +73,9 @@ export const apiService = {
     },
 
     getParameters: async (environment?: string): Promise<Parameter[]> => {
+        if (!environment) {
+            return (await apiService.getBootstrap()).parameters;
+        }
         try {
         const url = `${API_BASE}/parameters${environment ? `/environment=${environment}` : ''}`;
         const response = await fetch(url);
@@ -17,4 +17,9 @@ export interface Product {
     slug: string;
     created_at: string;
     updated_at?: string;
-}
\ No newline at end of file
+}
+
+export interface Bootstrap {
+    products: Product[];
+    parameters: Parameter[];
+}
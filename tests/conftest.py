@@ -0,0 +1,21 @@
+"""
+tests/conftest.py - Fixtures shared by the test modules
+"""
+import pytest
+
+
+class FakeClock:
+    """A monotonic clock that only moves when a test advances it."""
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
@@ -0,0 +1,72 @@
+"""
+tests/test_batch.py - Batched reads: one failed read does not fail the others
+"""
+import asyncio
+
+import orjson
+import pytest
+
+from db.localmanager import AsyncLocalDatabaseManager, LocalDatabaseManager
+from db.models.parameter import ParameterInDB
+from db.models.product import ProductInDB
+from db.repositories.parameter import AsyncParameterRepository
+from db.repositories.product import AsyncProductRepository
+from db.resilience import CircuitOpenError
+from util.batch import BatchReader, BatchRequest
+
+CREATED = "2024-05-01T12:00:00+00:00"
+
+
+class BrokenSearch:
+    async def search(self, q, limit):
+        raise RuntimeError("index corrupted")
+
+
+class UnavailableParameters:
+    async def snapshot(self):
+        raise CircuitOpenError("parameters", retry_after=5.0)
+
+
+@pytest.fixture
+def manager() -> AsyncLocalDatabaseManager:
+    local = LocalDatabaseManager()
+    for slug in ("a", "b", "c"):
+        local.insert("products", {"title": slug.upper(), "order_link": "o", "image_path": "i", "icon": "c",
+                                  "slug": slug, "description": "d", "created_at": CREATED}, ProductInDB)
+    local.insert("parameters", {"key": "greeting", "value": "hello", "environment": "*", "created_at": CREATED}, ParameterInDB)
+    return AsyncLocalDatabaseManager(local)
+
+
+def run(reader: BatchReader, reads: dict) -> dict:
+    body = asyncio.run(reader.run(BatchRequest.model_validate({"reads": reads})))
+    return orjson.loads(body)["results"]
+
+
+def test_reads_are_answered_under_their_names(manager):
+    reader = BatchReader(AsyncProductRepository(manager), AsyncParameterRepository(manager), BrokenSearch())
+    results = run(reader, {
+        "product": {"op": "product", "slug": "b"},
+        "page": {"op": "products", "limit": 2, "view": "summary"},
+        "params": {"op": "parameters", "environment": "production"},
+    })
+    assert results["product"]["status"] == 200 and "next_cursor" not in results["product"]
+    assert results["product"]["body"]["title"] == "B"
+    assert [item["slug"] for item in results["page"]["body"]] == ["a", "b"]
+    assert results["page"]["next_cursor"]
+    assert results["params"]["body"][0]["value"] == "hello"
+
+
+def test_each_failed_read_gets_its_own_status(manager):
+    reader = BatchReader(AsyncProductRepository(manager), UnavailableParameters(), BrokenSearch())
+    results = run(reader, {
+        "found": {"op": "product", "slug": "a"},
+        "missing": {"op": "product", "slug": "zzz"},
+        "bad_cursor": {"op": "products", "cursor": "not-a-cursor"},
+        "params": {"op": "parameters"},
+        "search": {"op": "search", "q": "a"},
+    })
+    assert {name: result["status"] for name, result in results.items()} == {
+        "found": 200, "missing": 404, "bad_cursor": 400, "params": 503, "search": 500,
+    }
+    assert results["search"]["body"] == {"detail": "Internal Server Error"}
+    assert "circuit" in results["params"]["body"]["detail"].lower()
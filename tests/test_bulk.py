@@ -0,0 +1,101 @@
+"""
+tests/test_bulk.py - Chunked bulk writes: retries, row-by-row replay and error classification
+"""
+import asyncio
+
+import httpx
+import pytest
+from postgrest.exceptions import APIError
+from pydantic import BaseModel
+from tenacity import wait_none
+
+from db.bulk import CHUNK_RETRY, chunked, is_transient_error
+from db.supabasemanager import write_chunks, write_chunks_async
+
+
+class Row(BaseModel):
+    n: int
+
+
+def api_error(code: str) -> APIError:
+    return APIError({"code": code, "message": f"error {code}", "details": None, "hint": None})
+
+
+@pytest.fixture(autouse=True)
+def no_retry_wait(monkeypatch):
+    monkeypatch.setitem(CHUNK_RETRY, "wait", wait_none())
+
+
+@pytest.mark.parametrize("error, transient", [
+    (httpx.ConnectError("connection refused"), True),
+    (httpx.ReadTimeout("timed out"), True),
+    (api_error("PGRST000"), True),  # Could not connect to the database
+    (api_error("57014"), True),  # Statement timeout
+    (api_error("23505"), False),
+    (api_error("22P02"), False),
+    (api_error("42501"), False),
+    (api_error("PGRST204"), False),
+    (ValueError("bad"), False),
+])
+def test_is_transient_error(error, transient):
+    assert is_transient_error(error) is transient
+
+
+def test_chunked():
+    assert list(chunked([1, 2, 3, 4, 5], 2)) == [(0, [1, 2]), (2, [3, 4]), (4, [5])]
+    assert list(chunked([1], 0)) == [(0, [1])]
+
+
+class Writer:
+    """Writes rows, rejecting n == bad with a constraint violation and failing the first `outages` calls."""
+    def __init__(self, bad: int = -1, outages: int = 0):
+        self.bad = bad
+        self.outages = outages
+        self.calls: list[list[int]] = []
+
+    def __call__(self, chunk):
+        self.calls.append([row["n"] for row in chunk])
+        if self.outages:
+            self.outages -= 1
+            raise httpx.ConnectError("connection refused")
+        if any(row["n"] == self.bad for row in chunk):
+            raise api_error("23514")
+        return chunk
+
+
+def rows(count: int) -> list[dict]:
+    return [{"n": n} for n in range(count)]
+
+
+def test_rejected_chunk_is_replayed_row_by_row():
+    writer = Writer(bad=3)
+    report = write_chunks("t", rows(6), Row, writer, chunk_size=3)
+    assert [row.n for row in report.succeeded] == [0, 1, 2, 4, 5]
+    assert [(error.index, error.row) for error in report.errors] == [(3, {"n": 3})]
+    assert writer.calls == [[0, 1, 2], [3, 4, 5], [3], [4], [5]]
+
+
+def test_transient_failure_is_retried_per_chunk():
+    writer = Writer(outages=1)
+    report = write_chunks("t", rows(4), Row, writer, chunk_size=2)
+    assert report.ok and len(report.succeeded) == 4
+    assert writer.calls == [[0, 1], [0, 1], [2, 3]]
+
+
+def test_outage_fails_the_chunk_without_a_replay():
+    writer = Writer(outages=3)
+    report = write_chunks("t", rows(4), Row, writer, chunk_size=2)
+    assert [error.index for error in report.errors] == [0, 1]
+    assert [row.n for row in report.succeeded] == [2, 3]
+    assert writer.calls == [[0, 1]] * 3 + [[2, 3]]
+
+
+def test_async_writes_replay_the_same_way():
+    writer = Writer(bad=1)
+
+    async def write(chunk):
+        return writer(chunk)
+
+    report = asyncio.run(write_chunks_async("t", rows(3), Row, write, chunk_size=3))
+    assert [row.n for row in report.succeeded] == [0, 2]
+    assert [error.index for error in report.errors] == [1]
@@ -0,0 +1,135 @@
+"""
+tests/test_cachingmanager.py - Read cache: TTL, stale-while-revalidate and last-known-good data
+"""
+import asyncio
+
+import httpx
+import pytest
+from postgrest.exceptions import APIError
+
+from db.cachingmanager import CachingDatabaseManager, QueryCache
+from db.localmanager import AsyncLocalDatabaseManager, LocalDatabaseManager
+from db.managerproxy import AsyncManagerProxy
+from db.models.parameter import ParameterInDB
+
+
+class FlakyManager(AsyncManagerProxy):
+    """Counts reads and raises `error` from them while it is set."""
+    def __init__(self, inner):
+        super().__init__(inner)
+        self.reads = 0
+        self.error = None
+
+    async def select_one(self, table, result_type, condition):
+        self.reads += 1
+        if self.error is not None:
+            raise self.error
+        return await super().select_one(table, result_type, condition)
+
+
+@pytest.fixture
+def local() -> LocalDatabaseManager:
+    local = LocalDatabaseManager()
+    local.insert("parameters", {"key": "greeting", "value": "hello", "environment": "production",
+                                 "created_at": "2024-05-01T12:00:00+00:00"}, ParameterInDB)
+    return local
+
+
+@pytest.fixture
+def inner(local) -> FlakyManager:
+    return FlakyManager(AsyncLocalDatabaseManager(local))
+
+
+@pytest.fixture
+def manager(inner, clock) -> CachingDatabaseManager:
+    cache = QueryCache(default_ttl=10, table_ttls={}, stale_ttl=20, last_good_ttl=100, clock=clock)
+    return CachingDatabaseManager(inner, cache)
+
+
+async def greeting(manager) -> str:
+    return (await manager.select_one("parameters", ParameterInDB, {"key": "greeting"})).value
+
+
+def test_entry_is_fresh_then_stale_then_last_good_then_gone(clock):
+    cache = QueryCache(default_ttl=10, table_ttls={"products": 0}, stale_ttl=20, last_good_ttl=100, clock=clock)
+    key = ("select_one", "parameters")
+    cache.set(key, "value")
+    assert cache.get(key).fresh_until == clock() + 10
+    clock.advance(29)
+    assert cache.get(key).value == "value"  # Stale, still served
+    clock.advance(1)
+    assert cache.get(key) is None
+    assert cache.last_good(key).value == "value"
+    clock.advance(100)
+    assert cache.last_good(key) is None and len(cache) == 0
+    cache.set(("select_one", "products"), "value")
+    assert len(cache) == 0  # A TTL of 0 disables caching for the table
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = QueryCache(max_entries=2, default_ttl=10, table_ttls={}, clock=clock)
+    cache.set(("a", "t"), 1)
+    cache.set(("b", "t"), 2)
+    cache.get(("a", "t"))
+    cache.set(("c", "t"), 3)
+    assert cache.get(("b", "t")) is None
+    assert [cache.get((name, "t")).value for name in ("a", "c")] == [1, 3]
+
+
+def test_stale_entry_is_served_while_it_refreshes_once(manager, inner, local, clock):
+    async def scenario():
+        assert await greeting(manager) == "hello"
+        local.update("parameters", 1, {"value": "hi"}, ParameterInDB)
+        clock.advance(15)
+        assert await greeting(manager) == "hello"
+        assert await greeting(manager) == "hello"
+        await asyncio.gather(*manager._refreshing.values())
+        assert inner.reads == 2  # One load, one background refresh
+        assert await greeting(manager) == "hi"
+
+    asyncio.run(scenario())
+
+
+def test_writes_invalidate_the_table(manager, inner):
+    async def scenario():
+        assert await greeting(manager) == "hello"
+        await manager.update("parameters", 1, {"value": "hi"}, ParameterInDB)
+        assert await greeting(manager) == "hi"
+        assert inner.reads == 2
+
+    asyncio.run(scenario())
+
+
+def test_last_good_data_is_served_only_when_the_database_is_unavailable(manager, inner, clock):
+    async def scenario():
+        assert await greeting(manager) == "hello"
+        clock.advance(30)
+        inner.error = httpx.ConnectError("connection refused")
+        assert await greeting(manager) == "hello"
+        inner.error = APIError({"code": "42501", "message": "permission denied"})
+        with pytest.raises(APIError):
+            await greeting(manager)
+        clock.advance(100)
+        inner.error = httpx.ConnectError("connection refused")
+        with pytest.raises(httpx.ConnectError):
+            await greeting(manager)
+
+    asyncio.run(scenario())
+
+
+def test_result_loaded_across_a_write_is_not_cached(manager, inner, local):
+    async def scenario():
+        original = inner.select_one
+
+        async def select_during_write(*args):
+            result = await original(*args)
+            await manager.invalidate("parameters")
+            return result
+
+        inner.select_one = select_during_write
+        assert await greeting(manager) == "hello"
+        inner.select_one = original
+        local.update("parameters", 1, {"value": "hi"}, ParameterInDB)
+        assert await greeting(manager) == "hi"
+
+    asyncio.run(scenario())
@@ -0,0 +1,122 @@
+"""
+tests/test_changefeed.py - Change detection and how the product slug index applies changes
+"""
+import asyncio
+import datetime
+
+import pytest
+
+from db.changefeed import HighWaterChangeSource, LocalChangeFeedSource, TableChange
+from db.localmanager import AsyncLocalDatabaseManager, LocalDatabaseManager, SQLiteLocalStore
+from db.models.product import ProductInDB
+from db.repositories.product import AsyncProductRepository
+
+UTC = datetime.timezone.utc
+NOW = datetime.datetime(2024, 5, 1, 12, 0, tzinfo=UTC)
+
+
+def stamp(seconds: float) -> str:
+    return (NOW + datetime.timedelta(seconds=seconds)).isoformat()
+
+
+def product(slug: str, created: float, **fields) -> dict:
+    return {"title": slug.upper(), "order_link": "o", "image_path": "i", "icon": "c", "slug": slug,
+            "description": "d", "created_at": stamp(created), **fields}
+
+
+@pytest.fixture
+def local() -> LocalDatabaseManager:
+    local = LocalDatabaseManager()
+    local.insert_many("products", [product("a", 0), product("b", 10), product("c", 20)], ProductInDB)
+    return local
+
+
+def poll(source: HighWaterChangeSource) -> list[TableChange]:
+    return asyncio.run(source.poll())
+
+
+def test_high_water_source_reports_rows_committed_behind_the_mark(local, clock):
+    source = HighWaterChangeSource(AsyncLocalDatabaseManager(local), ["products"], overlap=5.0, count_interval=30, clock=clock)
+    assert poll(source) == []  # Sets the starting point
+    assert poll(source) == []
+    # Stamped 2 s before the newest row but committed only now
+    late = local.insert("products", product("late", 18), ProductInDB)
+    assert poll(source) == [TableChange("products", frozenset({late.id}))]
+    assert poll(source) == []  # Still in the window, but already reported
+    # An update stamped behind the updated_at mark is found as well
+    local.update("products", 1, {"title": "A2", "updated_at": stamp(100)}, ProductInDB)
+    local.update("products", 2, {"title": "B2", "updated_at": stamp(97)}, ProductInDB)
+    assert poll(source) == [TableChange("products", frozenset({1, 2}))]
+    local.update("products", 3, {"title": "C2", "updated_at": stamp(96)}, ProductInDB)
+    assert poll(source) == [TableChange("products", frozenset({3}))]
+
+
+def test_high_water_source_counts_for_deletes_every_count_interval(local, clock):
+    source = HighWaterChangeSource(AsyncLocalDatabaseManager(local), ["products"], overlap=5.0, count_interval=30, clock=clock)
+    poll(source)
+    local.delete("products", 1)
+    clock.advance(10)
+    assert poll(source) == []
+    clock.advance(20)
+    assert poll(source) == [TableChange("products", complete=False)]
+    clock.advance(30)
+    assert poll(source) == []  # The new count is the baseline
+
+
+def test_high_water_source_created_rows_keep_the_count_balanced(local, clock):
+    source = HighWaterChangeSource(AsyncLocalDatabaseManager(local), ["products"], overlap=5.0, count_interval=30, clock=clock)
+    poll(source)
+    created = local.insert("products", product("d", 30), ProductInDB)
+    clock.advance(30)
+    assert poll(source) == [TableChange("products", frozenset({created.id}))]
+
+
+def test_high_water_source_reports_bulk_changes_as_incomplete(local, clock):
+    source = HighWaterChangeSource(AsyncLocalDatabaseManager(local), ["products"], max_rows=2, overlap=0.0, clock=clock)
+    poll(source)
+    local.insert_many("products", [product(f"new-{i}", 30 + i) for i in range(3)], ProductInDB)
+    assert poll(source) == [TableChange("products", complete=False)]
+
+
+def test_local_feed_reports_ids_and_deletes(local):
+    source = LocalChangeFeedSource(local.store, ["products"])
+    assert asyncio.run(source.poll()) == []
+    local.update("products", 2, {"title": "B2"}, ProductInDB)
+    assert asyncio.run(source.poll()) == [TableChange("products", frozenset({2}))]
+    local.delete("products", 3)
+    assert asyncio.run(source.poll()) == [TableChange("products", frozenset(), complete=False)]
+
+
+def test_slug_index_applies_changes_stamped_below_its_high_water_mark(local):
+    async def scenario():
+        products = AsyncProductRepository(AsyncLocalDatabaseManager(local))
+        assert (await products.get_by_slug("a")).title == "A"
+        local.update("products", 1, {"title": "A2", "updated_at": stamp(5)}, ProductInDB)
+        products.apply_change(TableChange("products", frozenset({1})))
+        await products._refresh_task
+        assert (await products.get_by_slug("a")).title == "A2"
+        assert [product.title for product in await products.all_products()] == ["A2", "B", "C"]
+
+    asyncio.run(scenario())
+
+
+def test_slug_index_reloads_after_an_incomplete_change(local):
+    async def scenario():
+        products = AsyncProductRepository(AsyncLocalDatabaseManager(local))
+        await products.warm_slug_index()
+        local.delete("products", 2)
+        products.apply_change(TableChange("products", complete=False))
+        await products._refresh_task
+        assert await products.get_by_slug("b") is None
+        assert [product.slug for product in await products.all_products()] == ["a", "c"]
+
+    asyncio.run(scenario())
+
+
+def test_local_feed_reads_a_sqlite_store(tmp_path):
+    local = LocalDatabaseManager(SQLiteLocalStore(str(tmp_path / "local.db")))
+    local.insert("products", product("a", 0), ProductInDB)
+    source = LocalChangeFeedSource(local.store, ["products"])
+    assert asyncio.run(source.poll()) == []
+    local.update("products", 1, {"title": "A2"}, ProductInDB)
+    assert asyncio.run(source.poll()) == [TableChange("products", frozenset({1}))]
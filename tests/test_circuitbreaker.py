@@ -0,0 +1,127 @@
+"""
+tests/test_circuitbreaker.py - Breaker state machine and which failures trip it
+"""
+import asyncio
+
+import httpx
+import pytest
+from postgrest.exceptions import APIError
+
+from db.circuitbreaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakerDatabaseManager
+from db.resilience import CircuitOpenError, DeadlineExceededError, deadline
+
+
+class FakeManager:
+    """Answers ping/insert by running the next scripted outcome: an exception to raise, a delay, or a value."""
+    def __init__(self):
+        self.outcomes = []
+        self.calls = 0
+
+    async def _next(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if isinstance(outcome, BaseException):
+            raise outcome
+        if isinstance(outcome, float):
+            await asyncio.sleep(outcome)
+        return outcome
+
+    async def ping(self, table):
+        return await self._next()
+
+    async def insert(self, table, data, result_type):
+        return await self._next()
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("products", failure_threshold=3, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+
+def test_half_open_admits_one_trial_call(clock):
+    breaker = CircuitBreaker("products", failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.advance(4)
+    assert not breaker.allow()
+    assert breaker.retry_after() == pytest.approx(6)
+    clock.advance(6)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens_and_successful_trial_closes(clock):
+    breaker = CircuitBreaker("products", failure_threshold=5, reset_timeout=10, clock=clock)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.advance(10)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.retry_after() == pytest.approx(10)
+    clock.advance(10)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.failures == 0
+
+
+def transport_error():
+    return httpx.ConnectError("connection refused")
+
+
+def test_transient_errors_open_the_breaker_and_calls_fail_fast():
+    inner = FakeManager()
+    manager = CircuitBreakerDatabaseManager(inner, failure_threshold=2, reset_timeout=30)
+    inner.outcomes = [transport_error(), transport_error()]
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await manager.ping("products")
+        with pytest.raises(CircuitOpenError) as raised:
+            await manager.ping("products")
+        assert raised.value.retry_after == pytest.approx(30, abs=1)
+        await manager.ping("parameters")  # Breakers are per table
+
+    asyncio.run(scenario())
+    assert inner.calls == 3
+    assert manager.breaker("products").state == OPEN
+
+
+def test_rejected_queries_prove_the_database_is_up():
+    inner = FakeManager()
+    manager = CircuitBreakerDatabaseManager(inner, failure_threshold=2, reset_timeout=30)
+    inner.outcomes = [transport_error(), APIError({"code": "23505", "message": "duplicate key"}), transport_error()]
+
+    async def scenario():
+        for error in (httpx.ConnectError, APIError, httpx.ConnectError):
+            with pytest.raises(error):
+                await manager.ping("products")
+
+    asyncio.run(scenario())
+    assert manager.breaker("products").state == CLOSED
+
+
+def test_read_deadline_counts_as_failure_but_write_deadline_does_not():
+    inner = FakeManager()
+    manager = CircuitBreakerDatabaseManager(inner, failure_threshold=1, reset_timeout=30)
+    inner.outcomes = [1.0, 1.0]
+
+    async def scenario():
+        with deadline(0.01):
+            with pytest.raises(DeadlineExceededError):
+                await manager.insert("products", {}, dict)
+            assert manager.breaker("products").state == CLOSED
+            with pytest.raises(DeadlineExceededError):
+                await manager.ping("products")
+        assert manager.breaker("products").state == OPEN
+
+    asyncio.run(scenario())
@@ -0,0 +1,80 @@
+"""
+tests/test_conditions.py - Condition helpers and their PostgREST rendering
+"""
+import datetime
+
+import pytest
+from postgrest import SyncPostgrestClient
+
+from db.conditions import Op, any_of, as_op, filter_value, gt, ilike, in_, is_null, lte, neq, not_, not_null, or_filter
+from db.supabasemanager import apply_condition
+
+
+def rendered_params(condition):
+    query = apply_condition(SyncPostgrestClient("http://db.test").from_("products").select("*"), condition)
+    return dict(query.request.params)
+
+
+def test_plain_value_is_equality():
+    assert as_op("divorce") == Op("eq", "divorce")
+
+
+def test_unsupported_operator_is_rejected():
+    with pytest.raises(ValueError):
+        as_op(Op("between", (1, 2)))
+    with pytest.raises(ValueError):
+        as_op(Op("not.between", (1, 2)))
+
+
+def test_not_negates_and_double_negation_cancels():
+    assert not_(in_([1, 2])) == Op("not.in", (1, 2))
+    assert not_("x") == Op("not.eq", "x")
+    assert not_(not_(gt(3))) == gt(3)
+    assert not_null() == Op("not.is", None)
+
+
+def test_filter_value_formats_dates_and_collections():
+    moment = datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc)
+    assert filter_value(moment) == "2024-05-01T12:30:00+00:00"
+    assert filter_value(datetime.date(2024, 5, 1)) == "2024-05-01"
+    assert filter_value((1, moment)) == [1, "2024-05-01T12:30:00+00:00"]
+
+
+def test_or_filter_renders_single_terms_and_and_groups():
+    rendered = or_filter(({"updated_at": gt(5)}, {"updated_at": 5, "id": gt(10)}, {"updated_at": is_null()}))
+    assert rendered == 'updated_at.gt."5",and(updated_at.eq."5",id.gt."10"),updated_at.is.null'
+
+
+def test_or_filter_renders_negation_in_and_nested_groups():
+    rendered = or_filter((
+        {"slug": not_(in_(["a", "b"]))},
+        {"or": any_of({"title": ilike("%custody%")}, {"price": lte(10)})},
+    ))
+    assert rendered == 'slug.not.in.("a","b"),or(title.ilike."%custody%",price.lte."10")'
+
+
+def test_or_filter_quotes_reserved_characters():
+    assert or_filter(({"title": 'say "hi", (now)'},)) == 'title.eq."say \\"hi\\", (now)"'
+    assert or_filter(({"path": "a\\b"},)) == 'path.eq."a\\\\b"'
+
+
+def test_or_filter_renders_dates_in_iso_format():
+    moment = datetime.datetime(2024, 5, 1, tzinfo=datetime.timezone.utc)
+    assert or_filter(({"updated_at": gt(moment)},)) == 'updated_at.gt."2024-05-01T00:00:00+00:00"'
+
+
+def test_apply_condition_renders_each_operator():
+    params = rendered_params({
+        "slug": "divorce",
+        "id": not_(in_([1, 2])),
+        "icon": neq("fa-gavel"),
+        "updated_at": is_null(),
+        "description": not_null(),
+        "or": any_of({"title": ilike("%will%")}, {"id": gt(7)}),
+    })
+    assert params["slug"] == "eq.divorce"
+    assert params["id"] == "not.in.(1,2)"
+    assert params["icon"] == "neq.fa-gavel"
+    assert params["updated_at"] == "is.null"
+    assert params["description"] == "not.is.null"
+    assert params["or"] == '(title.ilike."%will%",id.gt."7")'
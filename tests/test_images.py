@@ -0,0 +1,109 @@
+"""
+tests/test_images.py - Image variants: rendering, fallback to the original and temporary files
+"""
+import asyncio
+import io
+import os
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from util import images
+from util.images import ImageVariants, UnconvertibleImageError, render_variant
+from util.staticassets import AssetFiles
+
+
+def scope(path: str, query: str = "") -> dict:
+    return {"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "headers": []}
+
+
+@pytest.fixture
+def variants(tmp_path):
+    originals = tmp_path / "images"
+    originals.mkdir()
+    Image.new("RGB", (640, 480), (200, 30, 30)).save(originals / "photo.png")
+    (originals / "bad.jpg").write_bytes(b"not a jpeg at all")
+    variants = ImageVariants(AssetFiles(str(originals)), cache_dir=str(tmp_path / "cache"))
+    yield variants
+    variants.close()
+
+
+async def body(response) -> bytes:
+    chunks = []
+
+    async def receive():
+        await asyncio.Event().wait()  # The client never disconnects
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await response(scope("/"), receive, send)
+    return b"".join(chunks)
+
+
+class RefusingExecutor:
+    def submit(self, *args, **kwargs):
+        raise AssertionError("the process pool should not be asked again")
+
+
+def test_variant_is_resized_and_encoded(variants):
+    async def scenario():
+        response = await variants.response("photo.png", scope("/images/photo.png"), width=300, fmt="jpeg")
+        assert response.media_type == "image/jpeg"
+        with Image.open(io.BytesIO(await body(response))) as image:
+            assert image.format == "JPEG"
+            assert image.width == variants.snap_width(300)
+
+    asyncio.run(scenario())
+
+
+def test_undecodable_source_is_served_as_is_and_not_rendered_again(variants):
+    async def scenario():
+        response = await variants.response("bad.jpg", scope("/images/bad.jpg"), width=320)
+        assert response.status_code == 200
+        assert await body(response) == b"not a jpeg at all"
+        pool, variants._pool = variants._pool, RefusingExecutor()
+        try:
+            response = await variants.response("bad.jpg", scope("/images/bad.jpg"), width=640, fmt="webp")
+            assert await body(response) == b"not a jpeg at all"
+        finally:
+            variants._pool = pool
+
+    asyncio.run(scenario())
+
+
+def test_a_replaced_source_is_tried_again(variants):
+    async def scenario():
+        await variants.response("bad.jpg", scope("/images/bad.jpg"), width=320)
+        path = os.path.join(variants.originals.root, "bad.jpg")
+        Image.new("RGB", (800, 600)).save(path, "JPEG")
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000_000))
+        response = await variants.response("bad.jpg", scope("/images/bad.jpg"), width=320)
+        with Image.open(io.BytesIO(await body(response))) as image:
+            assert image.width == variants.snap_width(320)
+
+    asyncio.run(scenario())
+
+
+def test_render_variant_raises_for_undecodable_source(tmp_path):
+    source = tmp_path / "bad.jpg"
+    source.write_bytes(b"\xff\xd8\xff garbage")
+    with pytest.raises(UnconvertibleImageError):
+        render_variant(str(source), str(tmp_path / "out.webp"), 100, "webp", 80)
+
+
+def test_failed_save_leaves_no_temporary_file(tmp_path, monkeypatch):
+    source = tmp_path / "photo.png"
+    Image.new("RGB", (64, 64)).save(source)
+
+    def failing_save(image, path, *args, **kwargs):
+        with open(path, "wb") as partial:
+            partial.write(b"half an image")
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(images.Image.Image, "save", failing_save)
+    with pytest.raises(OSError):
+        render_variant(str(source), str(tmp_path / "photo-32.png"), 32, "png", 0)
+    assert sorted(os.listdir(tmp_path)) == ["photo.png"]
@@ -0,0 +1,156 @@
+"""
+tests/test_localmanager.py - SQL semantics of the local backend's filters and ordering
+"""
+import asyncio
+import threading
+
+import pytest
+from postgrest.exceptions import APIError
+
+from db.conditions import any_of, gt, gte, ilike, in_, is_null, like, lt, neq, not_, not_null
+from db.localmanager import AsyncLocalDatabaseManager, LocalDatabaseManager, SQLiteLocalStore, like_pattern, matches, sort_rows
+from db.models.parameter import ParameterInDB
+
+ROW = {"id": 3, "slug": "divorce-petition", "title": "Divorce Petition", "price": 12.5, "active": True,
+       "updated_at": "2024-05-01T10:00:00+00:00", "icon": None}
+
+
+@pytest.mark.parametrize("condition", [
+    {"slug": "divorce-petition"},
+    {"id": "3"},
+    {"id": gt(2), "price": lt(13)},
+    {"updated_at": gte("2024-05-01T10:00:00Z")},
+    {"active": "true"},
+    {"active": "t"},
+    {"slug": in_(["will", "divorce-petition"])},
+    {"id": not_(in_([1, 2]))},
+    {"icon": is_null()},
+    {"title": not_null()},
+])
+def test_matching_conditions(condition):
+    assert matches(ROW, condition)
+
+
+@pytest.mark.parametrize("condition", [
+    {"slug": "will"},
+    {"id": "4"},
+    {"id": gt(2), "price": lt(12)},
+    {"active": "false"},
+    {"id": in_([1, 2])},
+    {"icon": not_null()},
+    {"title": is_null()},
+])
+def test_non_matching_conditions(condition):
+    assert not matches(ROW, condition)
+
+
+@pytest.mark.parametrize("condition", [
+    {"icon": "fa-gavel"},
+    {"icon": neq("fa-gavel")},
+    {"icon": not_("fa-gavel")},
+    {"icon": in_(["fa-gavel"])},
+    {"icon": not_(in_(["fa-gavel"]))},
+    {"icon": like("%")},
+    {"icon": not_(like("fa-%"))},
+    {"slug": None},
+])
+def test_null_compares_as_unknown(condition):
+    # In SQL a comparison with NULL is neither true nor false, and neither is its negation
+    assert not matches(ROW, condition)
+
+
+def test_any_of_matches_any_alternative():
+    assert matches(ROW, {"or": any_of({"slug": "will"}, {"id": gt(2), "icon": is_null()})})
+    assert not matches(ROW, {"or": any_of({"slug": "will"}, {"id": gt(3)})})
+    assert matches(ROW, {"or": any_of({"slug": "will"}, {"id": 3}), "or_dates": any_of({"icon": is_null()})})
+
+
+@pytest.mark.parametrize("pattern, ignore_case, text, expected", [
+    ("divorce%", False, "divorce-petition", True),
+    ("%petition", False, "divorce-petition", True),
+    ("%PETITION", False, "divorce-petition", False),
+    ("%PETITION", True, "divorce-petition", True),
+    ("divorce_petition", False, "divorce-petition", True),
+    ("divorce_petition", False, "divorce--petition", False),
+    ("100\\%", False, "100%", True),
+    ("100\\%", False, "1000", False),
+    ("a\\_b", False, "a_b", True),
+    ("a\\_b", False, "axb", False),
+    ("a.b*", False, "a.b*", True),
+    ("a.b*", False, "axbb", False),
+    ("%", False, "line one\nline two", True),
+])
+def test_like_pattern(pattern, ignore_case, text, expected):
+    assert (like_pattern(pattern, ignore_case).fullmatch(text) is not None) is expected
+
+
+def test_like_and_ilike_filters():
+    assert matches(ROW, {"title": like("Divorce%")})
+    assert not matches(ROW, {"title": like("divorce%")})
+    assert matches(ROW, {"title": ilike("%PETITION")})
+    assert matches(ROW, {"title": not_(ilike("%will%"))})
+
+
+@pytest.mark.parametrize("condition, type_name", [
+    ({"id": "abc"}, "bigint"),
+    ({"price": gt("cheap")}, "double precision"),
+    ({"active": "maybe"}, "boolean"),
+])
+def test_unparsable_filter_value_raises_postgrest_error(condition, type_name):
+    with pytest.raises(APIError) as raised:
+        matches(ROW, condition)
+    assert raised.value.code == "22P02"
+    assert type_name in raised.value.message
+
+
+def test_sort_rows_puts_nulls_last_ascending_and_first_descending():
+    rows = [{"id": 1, "updated_at": None}, {"id": 2, "updated_at": "2024-02-01T00:00:00Z"}, {"id": 3, "updated_at": "2024-01-01T00:00:00Z"}]
+    assert [row["id"] for row in sort_rows(list(rows), "updated_at,id", "asc")] == [3, 2, 1]
+    assert [row["id"] for row in sort_rows(list(rows), "updated_at,id", "desc")] == [1, 2, 3]
+
+
+def test_select_many_filters_sorts_and_counts():
+    manager = LocalDatabaseManager()
+    for key, environment in (("b", "*"), ("a", "production"), ("c", "staging")):
+        manager.insert("parameters", {"key": key, "value": key.upper(), "environment": environment}, ParameterInDB)
+    rows, total = manager.select_many("parameters", ParameterInDB, {"environment": in_(["*", "production"])}, sort_by="key", count="exact")
+    assert [row.key for row in rows] == ["a", "b"]
+    assert total == 2
+
+
+def test_duplicate_insert_raises_key_error_like_supabase():
+    manager = LocalDatabaseManager(unique_columns={"parameters": ["environment,key"]})
+    manager.insert("parameters", {"key": "k", "value": "1", "environment": "*"}, ParameterInDB)
+    manager.insert("parameters", {"key": "k", "value": "1", "environment": "production"}, ParameterInDB)
+    with pytest.raises(KeyError, match="environment, key"):
+        manager.insert("parameters", {"key": "k", "value": "2", "environment": "*"}, ParameterInDB)
+
+
+def test_delete_in_casts_values_like_select():
+    manager = LocalDatabaseManager()
+    for key in ("a", "b", "c"):
+        manager.insert("parameters", {"key": key, "value": key, "environment": "*"}, ParameterInDB)
+    assert len(manager.select_many("parameters", ParameterInDB, {"id": in_(["1"])})[0]) == 1
+    assert manager.delete_in("parameters", "id", ["1", "3"]) == 2
+    assert [row.key for row in manager.select_many("parameters", ParameterInDB, {})[0]] == ["b"]
+    assert manager.delete_in("parameters", "id", []) == 0
+
+
+def test_async_manager_runs_sqlite_calls_in_a_worker_thread(tmp_path, monkeypatch):
+    threads = set()
+    rows = SQLiteLocalStore.rows
+
+    def recording_rows(self, table):
+        threads.add(threading.get_ident())
+        return rows(self, table)
+
+    monkeypatch.setattr(SQLiteLocalStore, "rows", recording_rows)
+    manager = AsyncLocalDatabaseManager(LocalDatabaseManager(SQLiteLocalStore(str(tmp_path / "local.db"))))
+
+    async def scenario():
+        await manager.insert("parameters", {"key": "k", "value": "v", "environment": "*"}, ParameterInDB)
+        found, _ = await manager.select_many("parameters", ParameterInDB, {"key": "k"})
+        assert [parameter.value for parameter in found] == ["v"]
+
+    asyncio.run(scenario())
+    assert threads and threading.get_ident() not in threads
@@ -0,0 +1,67 @@
+"""
+tests/test_pagination.py - Keyset cursors and the conditions that select the next page
+"""
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from db.conditions import gt
+from db.localmanager import matches, sort_rows
+from db.pagination import KEYSET_ORDERS, decode_cursor, encode_cursor, keyset_condition
+
+UTC = datetime.timezone.utc
+
+
+def row(id, updated_at=None):
+    return SimpleNamespace(id=id, updated_at=updated_at)
+
+
+def test_id_cursor_round_trip():
+    cursor = encode_cursor("id", row(42))
+    assert "=" not in cursor
+    assert decode_cursor("id", cursor) == {"o": "id", "id": 42}
+
+
+def test_updated_at_cursor_round_trip():
+    moment = datetime.datetime(2024, 5, 1, 10, 0, tzinfo=UTC)
+    assert decode_cursor("updated_at", encode_cursor("updated_at", row(7, moment)))["u"] == moment
+    assert decode_cursor("updated_at", encode_cursor("updated_at", row(7)))["u"] is None
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", "e30", encode_cursor("updated_at", row(1))])
+def test_malformed_or_foreign_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid pagination cursor"):
+        decode_cursor("id", cursor)
+
+
+def test_id_keyset_condition():
+    assert keyset_condition("id", encode_cursor("id", row(5))) == {"id": gt(5)}
+
+
+def paginate(rows, order, page_size):
+    """Walk every page of rows as the repositories do: filter after the cursor, sort, take a page."""
+    pages, cursor = [], None
+    while True:
+        remaining = [item for item in rows if cursor is None or matches(item, keyset_condition(order, cursor))]
+        page = sort_rows(remaining, KEYSET_ORDERS[order], "asc")[:page_size]
+        if not page:
+            return pages
+        pages.append([item["id"] for item in page])
+        last = page[-1]
+        updated_at = datetime.datetime.fromisoformat(last["updated_at"]) if last["updated_at"] else None
+        cursor = encode_cursor(order, row(last["id"], updated_at))
+
+
+def test_updated_at_pages_visit_every_row_once_with_nulls_last():
+    rows = [
+        {"id": 1, "updated_at": "2024-01-02T00:00:00+00:00"},
+        {"id": 2, "updated_at": None},
+        {"id": 3, "updated_at": "2024-01-01T00:00:00+00:00"},
+        {"id": 4, "updated_at": "2024-01-02T00:00:00+00:00"},
+        {"id": 5, "updated_at": None},
+        {"id": 6, "updated_at": "2024-01-01T00:00:00+00:00"},
+    ]
+    assert paginate(rows, "updated_at", 2) == [[3, 6], [1, 4], [2, 5]]
+    assert paginate(rows, "updated_at", 4) == [[3, 6, 1, 4], [2, 5]]
+    assert paginate(rows, "id", 4) == [[1, 2, 3, 4], [5, 6]]
@@ -0,0 +1,106 @@
+"""
+tests/test_prerender.py - Prerendered product pages and when they are rendered again
+"""
+import asyncio
+import os
+
+import pytest
+
+from db.changefeed import TableChange
+from db.localmanager import AsyncLocalDatabaseManager, LocalDatabaseManager
+from db.models.product import ProductInDB
+from db.repositories.product import AsyncProductRepository
+from util.prerender import PageRenderer
+from util.staticassets import AssetFiles
+
+SHELL = """<!doctype html><html><head><title>K-Paralegal</title>
+<meta name="description" content="Shell" /></head>
+<body><div id="root"></div><script type="module" src="/assets/index-B3xQ1abc.js"></script></body></html>"""
+
+
+@pytest.fixture
+def local() -> LocalDatabaseManager:
+    local = LocalDatabaseManager()
+    for slug in ("a", "b"):
+        local.insert("products", {"title": f"Title {slug}", "order_link": "https://example.com/order", "image_path": "/images/a.png",
+                                  "icon": "c", "slug": slug, "description": f"About {slug}.",
+                                  "created_at": "2024-05-01T12:00:00+00:00"}, ProductInDB)
+    return local
+
+
+@pytest.fixture
+def dist(tmp_path):
+    (tmp_path / "index.html").write_text(SHELL)
+    return tmp_path
+
+
+@pytest.fixture
+def products(local) -> AsyncProductRepository:
+    return AsyncProductRepository(AsyncLocalDatabaseManager(local))
+
+
+@pytest.fixture
+def pages(dist, products) -> PageRenderer:
+    return PageRenderer(AssetFiles(str(dist)), products)
+
+
+async def apply(products: AsyncProductRepository, *ids: int) -> None:
+    products.apply_change(TableChange("products", frozenset(ids)))
+    await products._refresh_task
+
+
+def test_product_page_has_its_tags_and_content(pages):
+    async def scenario():
+        page = await pages.product_page("a")
+        html = page.body.decode()
+        assert html.count("<title>") == 1 and "<title>Title a | " in html
+        assert 'content="Shell"' not in html
+        assert '<div id="root"><main><article><h1>Title a</h1><p>About a.</p>' in html
+        assert '"@type": "Service"' in html
+
+    asyncio.run(scenario())
+
+
+def test_changed_product_is_rendered_again(pages, products, local):
+    async def scenario():
+        first = await pages.product_page("a")
+        other = await pages.product_page("b")
+        local.update("products", 1, {"title": "Renamed"}, ProductInDB)
+        await apply(products, 1)
+        changed = await pages.product_page("a")
+        assert changed.etag != first.etag and b"<h1>Renamed</h1>" in changed.body
+        assert await pages.product_page("b") is other  # Unchanged products keep their page
+
+    asyncio.run(scenario())
+
+
+def test_page_under_an_old_slug_is_dropped(pages, products, local):
+    async def scenario():
+        await pages.product_page("a")
+        local.update("products", 1, {"slug": "a-new"}, ProductInDB)
+        await apply(products, 1)
+        assert (await pages.product_page("a")).status_code == 404
+        assert (await pages.product_page("a-new")).status_code == 200
+
+    asyncio.run(scenario())
+
+
+def test_rebuilt_shell_drops_every_page(pages, dist):
+    async def scenario():
+        first = await pages.product_page("a")
+        index = dist / "index.html"
+        index.write_text(SHELL.replace("index-B3xQ1abc", "index-C4yR2bcd"))
+        os.utime(index, ns=(0, os.stat(index).st_mtime_ns + 1_000_000_000))
+        rebuilt = await pages.product_page("a")
+        assert rebuilt is not first and b"index-C4yR2bcd" in rebuilt.body
+
+    asyncio.run(scenario())
+
+
+def test_unknown_slugs_are_not_cached(pages):
+    async def scenario():
+        page = await pages.product_page("missing")
+        assert page.status_code == 404 and b'name="robots" content="noindex"' in page.body
+        assert "missing" not in pages._pages
+
+    asyncio.run(scenario())
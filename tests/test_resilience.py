@@ -0,0 +1,62 @@
+"""
+tests/test_resilience.py - Request deadlines, the retry budget and the retry stop conditions
+"""
+from types import SimpleNamespace
+
+import pytest
+
+import db.resilience as resilience
+from db.resilience import RetryBudget, deadline, stop_before_deadline, time_remaining
+
+
+@pytest.fixture(autouse=True)
+def frozen_time(monkeypatch, clock):
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+
+
+def test_deadline_is_scoped_and_nests(clock):
+    assert time_remaining() is None
+    with deadline(10):
+        clock.advance(4)
+        assert time_remaining() == pytest.approx(6)
+        with deadline(None):
+            assert time_remaining() is None
+        with deadline(2):
+            assert time_remaining() == pytest.approx(2)
+        clock.advance(10)
+        assert time_remaining() == 0.0
+    assert time_remaining() is None
+
+
+def test_retry_budget_spends_its_burst_then_denies(clock):
+    budget = RetryBudget(ratio=0.5, min_per_second=0.0, max_tokens=3)
+    assert [budget.try_spend() for _ in range(4)] == [True, True, True, False]
+
+
+def test_first_attempts_earn_retries(clock):
+    budget = RetryBudget(ratio=0.5, min_per_second=0.0, max_tokens=3)
+    budget.tokens = 0.0
+    budget.deposit()
+    assert not budget.try_spend()
+    budget.deposit()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+
+def test_budget_refills_over_time_up_to_max(clock):
+    budget = RetryBudget(ratio=0.2, min_per_second=1.0, max_tokens=5)
+    budget.tokens = 0.0
+    clock.advance(2.5)
+    assert [budget.try_spend() for _ in range(3)] == [True, True, False]
+    clock.advance(1000)
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == 5
+
+
+def test_stop_before_deadline(clock):
+    stop = stop_before_deadline()
+    assert not stop(SimpleNamespace(upcoming_sleep=60))
+    with deadline(5):
+        assert not stop(SimpleNamespace(upcoming_sleep=1))
+        assert stop(SimpleNamespace(upcoming_sleep=5))
@@ -0,0 +1,91 @@
+"""
+tests/test_search.py - Tokenizing, typo tolerance and ranking of the product search index
+"""
+import pytest
+
+from util.search import SearchIndex, deletions, edit_distance, strip_markdown, tokenize, typo_budget
+
+WEIGHTS = {"title": 3.0, "description": 1.0}
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex(WEIGHTS)
+    index.add(1, {"title": "Divorce Petition", "description": "File for divorce in Texas."})
+    index.add(2, {"title": "Child Custody", "description": "Custody and visitation after a divorce."})
+    index.add(3, {"title": "Last Will", "description": "A simple will and testament."})
+    return index
+
+
+def ids(results):
+    return [doc_id for doc_id, _ in results]
+
+
+def test_tokenize_folds_case_accents_and_apostrophes():
+    assert tokenize("Client's Rights — Café, 2024!") == ["clients", "rights", "cafe", "2024"]
+
+
+def test_strip_markdown_keeps_readable_text():
+    text = strip_markdown("See [the form](https://x.test/f) ![map](m.png) <b>now</b> &amp; https://y.test\n```py\ncode\n```")
+    assert tokenize(text) == ["see", "the", "form", "map", "now", "code"]
+
+
+@pytest.mark.parametrize("a, b, distance", [
+    ("custody", "custody", 0),
+    ("custody", "custdy", 1),
+    ("custody", "cusotdy", 1),  # adjacent transposition
+    ("custody", "kustodi", 2),
+    ("custody", "visitation", 3),
+])
+def test_edit_distance_is_capped_at_limit_plus_one(a, b, distance):
+    assert edit_distance(a, b, 2) == distance
+
+
+def test_deletions_and_typo_budget():
+    assert deletions("ab", 1) == {"ab", "a", "b"}
+    assert [typo_budget(word) for word in ("tax", "will", "custody", "visitation")] == [0, 1, 1, 2]
+
+
+def test_every_query_word_must_match(index):
+    assert ids(index.search("divorce")) == [1, 2]
+    assert ids(index.search("divorce custody")) == [2]
+    assert index.search("divorce testament") == []
+    assert index.search("!!!") == []
+
+
+def test_title_matches_outrank_description_matches(index):
+    assert ids(index.search("custody")) == [2]
+    assert ids(index.search("will")) == [3]
+    index.add(4, {"title": "Estate Planning", "description": "Will, will, will."})
+    assert ids(index.search("will")) == [3, 4]
+
+
+def test_prefix_and_typo_matches_count_for_less(index):
+    assert ids(index.search("cust")) == [2]
+    assert ids(index.search("petiton")) == [1]
+    assert ids(index.search("petit")) == [1]
+    exact = dict(index.search("divorce"))[1]
+    typo = dict(index.search("divorse"))[1]
+    assert 0 < typo < exact
+
+
+def test_words_under_four_letters_get_no_typo_tolerance(index):
+    assert ids(index.search("wlil")) == [3]
+    assert index.search("fro") == []
+    assert ids(index.search("for")) == [1]
+
+
+def test_replace_and_remove_documents(index):
+    index.add(1, {"title": "Name Change", "description": "Change your legal name."})
+    assert ids(index.search("divorce")) == [2]
+    assert ids(index.search("name")) == [1]
+    index.remove(1)
+    index.remove(99)
+    assert index.search("name") == []
+    assert len(index) == 2 and 1 not in index
+
+
+def test_limit_and_tie_order(index):
+    index.add(5, {"title": "Divorce Petition", "description": "File for divorce in Texas."})
+    assert index.search("divorce petition", limit=1) == index.search("divorce petition")[:1]
+    assert ids(index.search("divorce petition")) == [1, 5]
@@ -0,0 +1,79 @@
+"""
+tests/test_sharedcache.py - The key-value stores shared by workers and invalidation through their generations
+"""
+import asyncio
+
+import pytest
+
+from db.cachingmanager import CachingDatabaseManager, QueryCache
+from db.localmanager import AsyncLocalDatabaseManager, LocalDatabaseManager
+from db.managerproxy import AsyncManagerProxy
+from db.models.parameter import ParameterInDB
+from db.sharedcache import MemoryKeyValueStore, SQLiteKeyValueStore, create_shared_store
+from util.settings import settings
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryKeyValueStore()
+    return SQLiteKeyValueStore(str(tmp_path / "cache.sqlite3"))
+
+
+def test_store_keeps_values_until_their_ttl(store):
+    assert store.set_object("a", {"value": 1}, ttl=60) > 0
+    assert store.get_object("a")[0] == {"value": 1}
+    store.set("b", b"x", ttl=-1)
+    assert store.get("b") is None and store.get_object("missing") is None
+
+
+def test_store_counts_generations_per_namespace(store):
+    assert store.generations() == {}
+    store.bump_generation("products")
+    store.bump_generation("products")
+    store.bump_generation("parameters")
+    store.bump_generation()
+    assert store.generations() == {"products": 3, "parameters": 2}
+
+
+def test_create_shared_store_by_name():
+    assert create_shared_store("none") is None
+    assert isinstance(create_shared_store(" Memory "), MemoryKeyValueStore)
+    with pytest.raises(ValueError):
+        create_shared_store("redis")
+
+
+class CountingManager(AsyncManagerProxy):
+    def __init__(self, inner):
+        super().__init__(inner)
+        self.reads = 0
+
+    async def select_one(self, table, result_type, condition):
+        self.reads += 1
+        return await super().select_one(table, result_type, condition)
+
+
+def test_workers_share_results_and_invalidations(clock):
+    local = LocalDatabaseManager()
+    local.insert("parameters", {"key": "greeting", "value": "hello", "environment": "production",
+                                "created_at": "2024-05-01T12:00:00+00:00"}, ParameterInDB)
+    shared = MemoryKeyValueStore()
+    workers = []
+    for _ in range(2):
+        inner = CountingManager(AsyncLocalDatabaseManager(local))
+        workers.append((inner, CachingDatabaseManager(inner, QueryCache(clock=clock), shared)))
+    (first_db, first), (second_db, second) = workers
+
+    async def greeting(manager) -> str:
+        return (await manager.select_one("parameters", ParameterInDB, {"key": "greeting"})).value
+
+    async def scenario():
+        assert await greeting(first) == "hello"
+        assert await greeting(second) == "hello"
+        assert (first_db.reads, second_db.reads) == (1, 0)
+        await first.update("parameters", 1, {"value": "hi"}, ParameterInDB)
+        clock.advance(settings.cache_shared_poll_interval)
+        assert await greeting(second) == "hi"
+        assert second_db.reads == 1
+
+    asyncio.run(scenario())
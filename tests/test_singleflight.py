@@ -0,0 +1,72 @@
+"""
+tests/test_singleflight.py - Coalescing of concurrent identical reads
+"""
+import asyncio
+
+import pytest
+
+from db.singleflight import SingleFlightDatabaseManager
+
+
+class SlowManager:
+    """Answers count after the test releases it, counting the calls that reached it."""
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.error = None
+
+    async def count(self, table, condition, method="exact"):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return len(condition)
+
+
+def test_concurrent_identical_reads_share_one_query():
+    async def scenario():
+        inner = SlowManager()
+        manager = SingleFlightDatabaseManager(inner)
+        same = [asyncio.create_task(manager.count("products", {"slug": "a"})) for _ in range(3)]
+        other = asyncio.create_task(manager.count("products", {"slug": "a", "title": "A"}))
+        await asyncio.sleep(0)
+        inner.release.set()
+        assert await asyncio.gather(*same, other) == [1, 1, 1, 2]
+        assert inner.calls == 2 and manager.coalesced == 2
+        # Finished queries are forgotten: the next read goes to the database
+        assert await manager.count("products", {"slug": "a"}) == 1
+        assert inner.calls == 3
+
+    asyncio.run(scenario())
+
+
+def test_waiters_share_the_exception():
+    async def scenario():
+        inner = SlowManager()
+        inner.error = RuntimeError("boom")
+        manager = SingleFlightDatabaseManager(inner)
+        callers = [asyncio.create_task(manager.count("products", {})) for _ in range(2)]
+        await asyncio.sleep(0)
+        inner.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+        assert inner.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_a_cancelled_caller_does_not_cancel_the_query_for_the_others():
+    async def scenario():
+        inner = SlowManager()
+        manager = SingleFlightDatabaseManager(inner)
+        first = asyncio.create_task(manager.count("products", {}))
+        second = asyncio.create_task(manager.count("products", {}))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        inner.release.set()
+        assert await second == 0
+        assert inner.calls == 1
+
+    asyncio.run(scenario())
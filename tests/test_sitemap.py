@@ -0,0 +1,52 @@
+"""
+tests/test_sitemap.py - Conditional GET on /sitemap.xml
+"""
+import asyncio
+import datetime
+
+import pytest
+from starlette.datastructures import Headers
+
+from db.localmanager import AsyncLocalDatabaseManager, LocalDatabaseManager
+from db.models.product import ProductInDB
+from db.repositories.product import AsyncProductRepository
+from util.sitemap import SitemapService, is_not_modified
+
+LASTMOD = datetime.datetime(2024, 5, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def sitemap() -> SitemapService:
+    local = LocalDatabaseManager()
+    local.insert("products", {"title": "A", "order_link": "o", "image_path": "i", "icon": "c", "slug": "a",
+                              "description": "d", "created_at": LASTMOD.isoformat()}, ProductInDB)
+    return SitemapService(AsyncProductRepository(AsyncLocalDatabaseManager(local)))
+
+
+@pytest.mark.parametrize("if_none_match, expected", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", W/"abc"', True),
+    ("*", True),
+    ('"xyz"', False),
+])
+def test_if_none_match_compares_weakly(if_none_match, expected):
+    assert is_not_modified(Headers({"if-none-match": if_none_match}), '"abc"', LASTMOD) is expected
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    headers = Headers({"if-none-match": '"xyz"', "if-modified-since": "Thu, 01 Jan 2099 00:00:00 GMT"})
+    assert not is_not_modified(headers, '"abc"', LASTMOD)
+    assert is_not_modified(Headers({"if-none-match": "*"}), None, LASTMOD)
+    assert not is_not_modified(Headers({"if-none-match": '"abc"'}), None, LASTMOD)
+
+
+def test_weak_etag_from_a_compressing_proxy_gets_304(sitemap):
+    async def scenario():
+        first = await sitemap.response(Headers())
+        assert first.status_code == 200 and b"/products/a" in first.body
+        again = await sitemap.response(Headers({"if-none-match": "W/" + first.headers["etag"]}))
+        assert again.status_code == 304
+        assert again.headers["etag"] == first.headers["etag"]
+
+    asyncio.run(scenario())
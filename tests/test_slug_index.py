@@ -0,0 +1,76 @@
+"""
+tests/test_slug_index.py - The product repository's in-memory slug index
+"""
+import asyncio
+import datetime
+
+import pytest
+
+from db.localmanager import AsyncLocalDatabaseManager, LocalDatabaseManager
+from db.models.product import ProductInDB
+from db.repositories.product import AsyncProductRepository
+from util.settings import settings
+
+NOW = datetime.datetime(2024, 5, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def stamp(seconds: float) -> str:
+    return (NOW + datetime.timedelta(seconds=seconds)).isoformat()
+
+
+def product(slug: str, created: float) -> dict:
+    return {"title": slug.upper(), "order_link": "o", "image_path": "i", "icon": "c", "slug": slug,
+            "description": "d", "created_at": stamp(created)}
+
+
+@pytest.fixture
+def local() -> LocalDatabaseManager:
+    local = LocalDatabaseManager()
+    local.insert_many("products", [product("a", 0), product("b", 10), product("c", 20)], ProductInDB)
+    return local
+
+
+class CountingManager(AsyncLocalDatabaseManager):
+    def __init__(self, local: LocalDatabaseManager):
+        super().__init__(local)
+        self.selects = 0
+
+    async def select_many(self, *args, **kwargs):
+        self.selects += 1
+        return await super().select_many(*args, **kwargs)
+
+
+def test_refresh_rereads_the_overlap_window(local, clock):
+    async def scenario():
+        products = AsyncProductRepository(AsyncLocalDatabaseManager(local), clock=clock)
+        changed = []
+        products.add_index_listener(lambda items, reloaded: changed.append(sorted(item.slug for item in items)))
+        await products.warm_slug_index()
+        # Stamped before the newest row, committed after the index was loaded
+        local.insert("products", product("late", 20 - settings.changefeed_overlap / 2), ProductInDB)
+        clock.advance(settings.slug_index_refresh_interval)
+        await products.warm_slug_index()
+        await products._refresh_task
+        assert [item.slug for item in await products.all_products()] == ["a", "b", "c", "late"]
+        # Unchanged rows re-read by the window are not reported to listeners again
+        assert changed == [["a", "b", "c"], ["late"]]
+
+    asyncio.run(scenario())
+
+
+def test_lookups_are_served_from_the_index(local, clock):
+    async def scenario():
+        manager = CountingManager(local)
+        products = AsyncProductRepository(manager, clock=clock)
+        await products.warm_slug_index()
+        loaded = manager.selects
+        assert (await products.get_by_slug("b")).title == "B"
+        assert manager.selects == loaded
+        assert await products.get_by_slug("missing") is None
+        assert await products.get_by_slug("missing") is None
+        assert manager.selects == loaded + 1  # One point query, then remembered as missing
+        clock.advance(settings.slug_index_negative_ttl)
+        local.insert("products", product("missing", 30), ProductInDB)
+        assert (await products.get_by_slug("missing")).title == "MISSING"
+
+    asyncio.run(scenario())
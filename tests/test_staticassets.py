@@ -0,0 +1,80 @@
+"""
+tests/test_staticassets.py - Static files: encoding negotiation, cache headers and conditional requests
+"""
+import gzip
+import os
+
+import pytest
+from starlette.testclient import TestClient
+
+from util.staticassets import HTML_CACHE_CONTROL, IMMUTABLE_CACHE_CONTROL, AssetFiles, choose_encoding
+
+SCRIPT = b"console.log('hello');\n" * 200
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, deflate, br", "br"),
+    ("gzip;q=1.0, br;q=0.5", "br"),  # Any acceptable encoding is served in our order of preference
+    ("br;q=0, gzip", "gzip"),
+    ("*", "br"),
+    ("*, br;q=0", "gzip"),
+    ("identity", None),
+    ("gzip;q=bogus", None),
+    ("", None),
+])
+def test_choose_encoding(accept_encoding, expected):
+    assert choose_encoding(accept_encoding, ["br", "gzip"]) == expected
+
+
+def test_choose_encoding_only_picks_available_variants():
+    assert choose_encoding("br, gzip", ["gzip"]) == "gzip"
+    assert choose_encoding("br", ["gzip"]) is None
+
+
+@pytest.fixture
+def dist(tmp_path):
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "assets" / "index-B3xQ1abc.js").write_bytes(SCRIPT)
+    (tmp_path / "index-B3xQ1abc.js").write_bytes(SCRIPT)  # Hash-like name outside the assets directory
+    (tmp_path / "assets" / "logo.svg").write_bytes(b"<svg/>")
+    (tmp_path / "index.html").write_bytes(b"<!doctype html><title>k</title>")
+    return tmp_path
+
+
+@pytest.fixture
+def client(dist):
+    return TestClient(AssetFiles(str(dist), html=True, max_age=600, hashed_dir="assets"))
+
+
+def test_cache_control_rules(client):
+    assert client.get("/assets/index-B3xQ1abc.js").headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert client.get("/index-B3xQ1abc.js").headers["cache-control"] == "public, max-age=600"
+    assert client.get("/assets/logo.svg").headers["cache-control"] == "public, max-age=600"
+    assert client.get("/").headers["cache-control"] == HTML_CACHE_CONTROL
+
+
+def test_compressed_variant_has_its_own_etag(client):
+    plain = client.get("/assets/index-B3xQ1abc.js", headers={"accept-encoding": "identity"})
+    compressed = client.get("/assets/index-B3xQ1abc.js", headers={"accept-encoding": "gzip"})
+    assert "content-encoding" not in plain.headers
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert compressed.content == SCRIPT  # Decoded by the client
+    assert compressed.headers["etag"] == plain.headers["etag"][:-1] + '-gzip"'
+    repeat = client.get("/assets/index-B3xQ1abc.js", headers={"accept-encoding": "gzip", "if-none-match": compressed.headers["etag"]})
+    assert repeat.status_code == 304
+
+
+def test_build_time_sibling_is_served(dist, client):
+    path = dist / "assets" / "index-B3xQ1abc.js.gz"
+    path.write_bytes(gzip.compress(b"from the build"))
+    os.utime(path, ns=(0, os.stat(dist / "assets" / "index-B3xQ1abc.js").st_mtime_ns + 1))
+    response = client.get("/assets/index-B3xQ1abc.js", headers={"accept-encoding": "gzip"})
+    assert response.content == b"from the build"
+
+
+def test_range_request_gets_the_identity_encoding(client):
+    response = client.get("/assets/index-B3xQ1abc.js", headers={"accept-encoding": "gzip", "range": "bytes=0-6"})
+    assert response.status_code == 206
+    assert "content-encoding" not in response.headers
+    assert response.content == b"console"
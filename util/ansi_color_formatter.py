@@ -25,17 +25,20 @@ class AnsiColorFormatter(logging.Formatter):
         'cyan_light': '\033[96m',
         'white_light': '\033[97m'
     }
+    LEVEL_STYLES = {
+        'DEBUG': STYLES['black_light'],
+        'INFO': STYLES['cyan'],
+        'WARNING': STYLES['yellow'],
+        'ERROR': STYLES['red'],
+        'CRITICAL': STYLES['red_light'] + STYLES['bold'],
+    }
+
     def format(self, record: logging.LogRecord):
-        level_style = {
-            'DEBUG': self.STYLES['black_light'],
-            'INFO': self.STYLES['cyan'],
-            'WARNING': self.STYLES['yellow'],
-            'ERROR': self.STYLES['red'],
-            'CRITICAL': self.STYLES['red_light'] + self.STYLES['bold'],
-        }.get(record.levelname, self.STYLES['no_style'])
+        level_style = self.LEVEL_STYLES.get(record.levelname, self.STYLES['no_style'])
         end_style = self.STYLES['no_style']
 
-        if isinstance(record.msg, str):
+        # Only messages with a {style} placeholder need the (comparatively costly) str.format pass
+        if isinstance(record.msg, str) and '{' in record.msg:
             try:
                 record.msg = record.msg.format(**self.STYLES)
             except Exception:
@@ -0,0 +1,173 @@
+"""
+util/batch.py - Several reads in one request: /api/batch and the /api/bootstrap payload
+
+``POST /api/batch`` takes named reads, e.g.::
+
+    {"reads": {"product": {"op": "product", "slug": "divorce-petition"},
+               "params": {"op": "parameters", "environment": "production"}}}
+
+resolves them concurrently and answers ``{"results": {"product": {"status": 200, "body": ...},
+...}}``; a failed read gets its own status and ``{"detail": ...}`` body without failing the
+others. The bodies are the same pre-serialized JSON the single endpoints serve, spliced into
+the response rather than parsed and serialized again.
+
+``GET /api/bootstrap/{environment}`` is the payload a page load needs, every product and the
+merged parameters, assembled from the slug index and the parameter snapshot and kept
+serialized until either changes.
+"""
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Annotated, Literal, Optional, Union
+
+from pydantic import BaseModel, Field
+
+from db.models.product import ProductSummary
+from db.repositories.parameter import ALL_ENVIRONMENTS, AsyncParameterRepository
+from db.repositories.product import AsyncProductRepository
+from db.resilience import UpstreamUnavailableError
+from util.responses import JSON_CACHE, dumps, etag_for
+from util.search import ProductSearch
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+BOOTSTRAP_CACHE_SIZE = 16  # Assembled payloads kept, one per environment in use
+
+
+class ProductRead(BaseModel):
+    """One product by slug, as /api/products/{slug}."""
+    op: Literal["product"]
+    slug: str
+
+
+class ProductsRead(BaseModel):
+    """A page of products, as /api/products; the result carries next_cursor."""
+    op: Literal["products"]
+    limit: Optional[int] = Field(None, ge=1, le=settings.products_page_max_limit)
+    cursor: Optional[str] = None
+    order: Literal["id", "updated_at"] = "id"
+    view: Literal["full", "summary"] = "full"
+
+
+class ParametersRead(BaseModel):
+    """Merged parameters of an environment, as /api/parameters/{environment}."""
+    op: Literal["parameters"]
+    environment: str = ALL_ENVIRONMENTS
+
+
+class SearchRead(BaseModel):
+    """Product search, as /api/products/search."""
+    op: Literal["search"]
+    q: str = Field(min_length=1, max_length=200)
+    limit: int = Field(settings.search_default_limit, ge=1, le=settings.search_max_limit)
+
+
+BatchRead = Annotated[Union[ProductRead, ProductsRead, ParametersRead, SearchRead], Field(discriminator="op")]
+
+
+class BatchRequest(BaseModel):
+    reads: dict[str, BatchRead] = Field(min_length=1, max_length=settings.batch_max_reads, description="Reads by a name the results are returned under")
+
+
+@dataclass
+class BatchResult:
+    status: int
+    body: bytes  # JSON
+    next_cursor: Optional[str] = None
+
+    @classmethod
+    def error(cls, status: int, detail: str) -> "BatchResult":
+        return cls(status, dumps({"detail": detail}))
+
+
+class BatchReader:
+    """
+    Resolves batched reads and the bootstrap payload against the repositories.
+
+    :param products: Product repository (its slug index serves single products and the bootstrap list).
+    :type products: AsyncProductRepository
+    :param parameters: Parameter repository (its snapshot serves merged parameters).
+    :type parameters: AsyncParameterRepository
+    :param search: Product search index.
+    :type search: ProductSearch
+    """
+    def __init__(self, products: AsyncProductRepository, parameters: AsyncParameterRepository, search: ProductSearch):
+        self.products = products
+        self.parameters = parameters
+        self.search = search
+        self._bootstrap: OrderedDict[tuple[str, str], tuple[bytes, str]] = OrderedDict()
+
+    async def read(self, read: BatchRead) -> BatchResult:
+        """
+        Resolve one read.
+
+        :raises ValueError: On an invalid argument, e.g. a malformed cursor.
+        """
+        if isinstance(read, ProductRead):
+            product = await self.products.get_by_slug(read.slug)
+            if product is None:
+                return BatchResult.error(404, f"Product with slug '{read.slug}' not found")
+            return BatchResult(200, JSON_CACHE.render(product)[0])
+        if isinstance(read, ProductsRead):
+            page = await self.products.select_page(read.limit, read.cursor, read.order, result_type=ProductSummary if read.view == "summary" else None)
+            return BatchResult(200, JSON_CACHE.render(page.items)[0], page.next_cursor)
+        if isinstance(read, ParametersRead):
+            return BatchResult(200, (await self.parameters.snapshot()).json(read.environment))
+        return BatchResult(200, JSON_CACHE.render(await self.search.search(read.q, read.limit))[0])
+
+    async def _read_or_error(self, name: str, read: BatchRead) -> BatchResult:
+        try:
+            return await self.read(read)
+        except ValueError as e:
+            return BatchResult.error(400, str(e))
+        except UpstreamUnavailableError as e:
+            return BatchResult.error(503, str(e))
+        except Exception as e:
+            LOGGER.error("Batched read %s (%s) failed: %s", name, read.op, e)
+            return BatchResult.error(500, "Internal Server Error")
+
+    async def run(self, request: BatchRequest) -> bytes:
+        """
+        Resolve every read of request concurrently.
+
+        :param request: The named reads.
+        :type request: BatchRequest
+        :return: The JSON response body: {"results": {name: {"status", "body"[, "next_cursor"]}}}.
+        :rtype: bytes
+        """
+        names = list(request.reads)
+        results = await asyncio.gather(*(self._read_or_error(name, request.reads[name]) for name in names))
+        entries = []
+        for name, result in zip(names, results):
+            entry = b'{"status":' + str(result.status).encode() + b',"body":' + result.body
+            if result.next_cursor is not None:
+                entry += b',"next_cursor":' + dumps(result.next_cursor)
+            entries.append(dumps(name) + b":" + entry + b"}")
+        return b'{"results":{' + b",".join(entries) + b"}}"
+
+    async def bootstrap(self, environment: str = ALL_ENVIRONMENTS) -> tuple[bytes, str]:
+        """
+        The initial-state payload, {"products": [...], "parameters": [...]}, for environment.
+
+        Both parts come from in-memory state (the slug index and the parameter snapshot), and
+        the assembled payload is reused until either changes.
+
+        :param environment: Environment whose merged parameters to include.
+        :type environment: str
+        :return: The JSON body and its ETag.
+        :rtype: tuple[bytes, str]
+        """
+        products, snapshot = await asyncio.gather(self.products.all_products(), self.parameters.snapshot())
+        products_json, products_etag = JSON_CACHE.render(products)
+        key = (products_etag, snapshot.etag(environment))
+        cached = self._bootstrap.get(key)
+        if cached is not None:
+            self._bootstrap.move_to_end(key)
+            return cached
+        body = b'{"products":' + products_json + b',"parameters":' + snapshot.json(environment) + b"}"
+        cached = self._bootstrap[key] = (body, etag_for(body))
+        while len(self._bootstrap) > BOOTSTRAP_CACHE_SIZE:
+            self._bootstrap.popitem(last=False)
+        return cached
@@ -0,0 +1,333 @@
+"""
+util/images.py - Resized and re-encoded image variants with a bounded on-disk cache
+
+``/images/{name}?w=640&fmt=webp`` serves the original scaled down to (a width rounded up to
+one of ``image_widths``) and encoded as WebP, AVIF, JPEG or PNG; ``fmt=auto`` picks AVIF or
+WebP from the Accept header. A variant is encoded once, in a process pool, and stored under
+``image_cache_dir`` with a name derived from the source's path, size and mtime, so replacing
+an original yields new variants. The directory is trimmed, least recently served first
+(by access time, which every hit refreshes), past ``image_cache_max_bytes``. Without
+Pillow, and for sources Pillow cannot decode, the originals are served unchanged.
+"""
+import asyncio
+import contextlib
+import hashlib
+import mimetypes
+import multiprocessing
+import os
+import stat
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable, Optional
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+
+from util.metrics import IMAGE_RENDER_SECONDS, IMAGE_VARIANTS
+from util.staticassets import AssetFiles
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Optional: without Pillow, /images/{name} ignores w and fmt
+    Image = None
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+# fmt -> (Pillow format, media type, file extension)
+IMAGE_FORMATS = {
+    "avif": ("AVIF", "image/avif", ".avif"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "png": ("PNG", "image/png", ".png"),
+}
+SOURCE_FORMATS = {"image/jpeg": "jpeg", "image/png": "png", "image/webp": "webp", "image/avif": "avif"}
+NEGOTIATED_FORMATS = ("avif", "webp")  # fmt=auto preference when the Accept header allows them
+TOUCH_INTERVAL = 60.0  # Seconds between access time updates of a variant that keeps being served
+RENDER_ATTEMPTS = 2  # A variant trimmed (by any worker) right after being rendered is rendered again
+
+
+class UnconvertibleImageError(Exception):
+    """The source image could not be decoded, so no variant of it can be made."""
+
+
+def supported_formats() -> set[str]:
+    """The output formats the installed Pillow can encode."""
+    if Image is None:
+        return set()
+    return {"jpeg", "png"} | {fmt for fmt in ("webp", "avif") if features.check(fmt)}
+
+
+def render_variant(source: str, target: str, width: Optional[int], fmt: str, quality: int) -> int:
+    """
+    Process-pool worker: write source scaled down to width (never up) and encoded as fmt to target.
+
+    :return: Size of the written file in bytes.
+    :rtype: int
+    """
+    pil_format = IMAGE_FORMATS[fmt][0]
+    original = None
+    try:
+        original = Image.open(source)
+        original.load()
+    except (OSError, ValueError, SyntaxError, EOFError, Image.DecompressionBombError) as e:
+        if original is not None:
+            original.close()
+        raise UnconvertibleImageError(f"Cannot decode {source}: {e}") from None
+    with original:
+        image = ImageOps.exif_transpose(original)
+        if width and width < image.width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        if fmt == "jpeg" and has_alpha:
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        elif fmt == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        options: dict[str, Any] = {"optimize": True} if fmt == "png" else {"quality": quality}
+        if fmt == "jpeg":
+            options.update(optimize=True, progressive=True)
+        temporary = f"{target}.{os.getpid()}.tmp"
+        try:
+            image.save(temporary, pil_format, **options)
+            os.replace(temporary, target)
+        finally:
+            # _trim leaves *.tmp files alone, so a failed save must not leave one behind
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temporary)
+    return os.path.getsize(target)
+
+
+def touch(path: str) -> os.stat_result:
+    """
+    Stat path and mark it used, so trimming keeps it (blocking: run it in a thread).
+
+    :raises FileNotFoundError: If the variant is not, or no longer, cached.
+    """
+    result = os.stat(path)
+    if time.time() - result.st_atime > TOUCH_INTERVAL:
+        # Only the access time changes: mtime feeds the ETag and Last-Modified headers
+        os.utime(path, ns=(time.time_ns(), result.st_mtime_ns))
+    return result
+
+
+def accepts(accept: str, media_type: str) -> bool:
+    """True if the Accept header lists media_type itself with a non-zero q (wildcards do not count)."""
+    for part in accept.lower().split(","):
+        name, *params = [item.strip() for item in part.split(";")]
+        if name != media_type:
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+class ImageVariants:
+    """
+    Generates and serves image variants for the files of an AssetFiles directory.
+
+    :param originals: The mounted images directory; originals are served through it.
+    :type originals: AssetFiles
+    :param cache_dir: Directory for variants; defaults to the image_cache_dir setting.
+    :type cache_dir: Optional[str]
+    """
+    def __init__(self, originals: AssetFiles, cache_dir: Optional[str] = None, max_bytes: int = settings.image_cache_max_bytes):
+        self.originals = originals
+        self.cache_dir = cache_dir or settings.image_cache_dir or os.path.join(tempfile.gettempdir(), "kparalegal-images")
+        self.max_bytes = max_bytes
+        self.formats = supported_formats()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._rendering: dict[str, asyncio.Future] = {}
+        self._cache_bytes: Optional[int] = None
+        self._unconvertible: dict[str, int] = {}  # Source path -> mtime_ns of a version Pillow cannot decode
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # spawn: forking a process that runs the event loop and the log thread is unsafe
+            self._pool = ProcessPoolExecutor(settings.image_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def snap_width(self, width: int) -> int:
+        """Round width up to the nearest configured width (the largest if none is wide enough)."""
+        widths = sorted(settings.image_widths)
+        return next((allowed for allowed in widths if allowed >= width), widths[-1])
+
+    def choose_format(self, fmt: Optional[str], source_format: str, accept: str) -> str:
+        if fmt == "auto":
+            for candidate in NEGOTIATED_FORMATS:
+                if candidate in self.formats and accepts(accept, IMAGE_FORMATS[candidate][1]):
+                    return candidate
+            return source_format
+        if fmt is None or fmt not in self.formats:
+            return source_format
+        return fmt
+
+    def variant_path(self, full_path: str, stat_result: os.stat_result, width: Optional[int], fmt: str) -> str:
+        quality = settings.image_quality.get(fmt, 0)
+        key = f"{os.path.abspath(full_path)}|{stat_result.st_size}|{stat_result.st_mtime_ns}|{width}|{fmt}|{quality}"
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(full_path))[0]
+        return os.path.join(self.cache_dir, f"{stem}-{width or 'full'}-{digest}{IMAGE_FORMATS[fmt][2]}")
+
+    async def variant(self, full_path: str, stat_result: os.stat_result, width: Optional[int], fmt: str) -> tuple[str, os.stat_result]:
+        """
+        Path and stat of a variant, encoding it first if it is not cached; concurrent requests
+        for the same variant share one encoding.
+
+        :raises UnconvertibleImageError: If this version of the source cannot be decoded.
+        """
+        if self._unconvertible.get(full_path) == stat_result.st_mtime_ns:
+            raise UnconvertibleImageError(f"Cannot decode {full_path}")
+        target = self.variant_path(full_path, stat_result, width, fmt)
+        try:
+            result = await anyio.to_thread.run_sync(touch, target)
+            IMAGE_VARIANTS.inc(result="hit")
+            return target, result
+        except FileNotFoundError:
+            pass
+        attempts = 0
+        while True:
+            future = self._rendering.get(target)
+            if future is None:
+                future = asyncio.ensure_future(self._render(full_path, stat_result, target, width, fmt))
+                self._rendering[target] = future
+                future.add_done_callback(lambda _: self._rendering.pop(target, None))
+            await asyncio.shield(future)
+            try:
+                return target, await anyio.to_thread.run_sync(os.stat, target)
+            except FileNotFoundError:
+                attempts += 1
+                if attempts >= RENDER_ATTEMPTS:
+                    raise
+                LOGGER.info("Variant %s was trimmed before it could be served; rendering it again.", target)
+
+    async def _render(self, full_path: str, stat_result: os.stat_result, target: str, width: Optional[int], fmt: str) -> None:
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            size = await loop.run_in_executor(self.pool, render_variant, full_path, target, width, fmt, settings.image_quality.get(fmt, 0))
+        except UnconvertibleImageError as e:
+            # Remembered until the file changes, so it is not sent to the pool again
+            self._unconvertible[full_path] = stat_result.st_mtime_ns
+            IMAGE_VARIANTS.inc(result="unconvertible")
+            LOGGER.warning("Serving %s unconverted: %s", full_path, e)
+            raise
+        IMAGE_RENDER_SECONDS.observe(time.perf_counter() - started, format=fmt)
+        IMAGE_VARIANTS.inc(result="render")
+        LOGGER.debug("Rendered %s (%d bytes) in %.3fs.", target, size, time.perf_counter() - started)
+        if self._cache_bytes is None:
+            self._cache_bytes = await anyio.to_thread.run_sync(self._trim)
+        else:
+            self._cache_bytes += size
+            if self._cache_bytes > self.max_bytes:
+                self._cache_bytes = await anyio.to_thread.run_sync(self._trim)
+
+    def _trim(self) -> int:
+        """
+        Delete the least recently served variants until the cache directory is under 90% of
+        max_bytes (blocking: run it in a thread).
+
+        :return: Bytes left in the directory.
+        :rtype: int
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                info = entry.stat()
+                entries.append((info.st_atime, info.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return total
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        LOGGER.info("Trimmed the image variant cache to %d bytes.", total)
+        return total
+
+    async def response(self, name: str, scope: Scope, width: Optional[int] = None, fmt: Optional[str] = None) -> Response:
+        """
+        Respond with image name scaled to width and encoded as fmt ("auto" negotiates),
+        or with the original when neither is given or the file cannot be converted.
+
+        :raises HTTPException: 404 if there is no such image.
+        """
+        if width is None and fmt is None:
+            return await self.originals.get_response(name, scope)
+        full_path, stat_result = await anyio.to_thread.run_sync(self.originals.lookup_path, name)
+        source_format = SOURCE_FORMATS.get(mimetypes.guess_type(full_path)[0] or "")
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode) or source_format is None or not self.formats:
+            IMAGE_VARIANTS.inc(result="original")
+            return await self.originals.get_response(name, scope)
+
+        request_headers = Headers(scope=scope)
+        chosen = self.choose_format(fmt, source_format, request_headers.get("accept", ""))
+        try:
+            target, target_stat = await self.variant(full_path, stat_result, self.snap_width(width) if width else None, chosen)
+        except UnconvertibleImageError:
+            IMAGE_VARIANTS.inc(result="original")
+            return await self.originals.get_response(name, scope)
+        except Exception as e:
+            LOGGER.error("Rendering %s at %s as %s failed; serving the original: %s", name, width, chosen, e)
+            IMAGE_VARIANTS.inc(result="original")
+            return await self.originals.get_response(name, scope)
+        headers = {"cache-control": f"public, max-age={self.originals.max_age}"}
+        if fmt == "auto":
+            headers["vary"] = "Accept"
+        response = FileResponse(target, headers=headers, media_type=IMAGE_FORMATS[chosen][1], stat_result=target_stat)
+        if self.originals.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    async def pregenerate(self, names: Iterable[str], widths: Optional[list[int]] = None, formats: Optional[list[str]] = None) -> int:
+        """
+        Encode the variants of names for widths x formats ahead of the first requests.
+
+        :return: Number of variants encoded or already cached.
+        :rtype: int
+        """
+        widths = widths or settings.image_pregenerate_widths
+        formats = [fmt for fmt in (formats or settings.image_pregenerate_formats) if fmt in self.formats]
+        done = 0
+        for name in names:
+            full_path, stat_result = await anyio.to_thread.run_sync(self.originals.lookup_path, name)
+            if stat_result is None:
+                LOGGER.warning("Cannot pre-generate variants of missing image %s.", name)
+                continue
+            for width in widths:
+                for fmt in formats:
+                    try:
+                        await self.variant(full_path, stat_result, self.snap_width(width), fmt)
+                        done += 1
+                    except UnconvertibleImageError:
+                        break
+                    except Exception as e:
+                        LOGGER.warning("Pre-generating %s at %dpx as %s failed: %s", name, width, fmt, e)
+        LOGGER.info("Pre-generated %d image variants.", done)
+        return done
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,38 @@
+"""
+util.json_formatter - One-line JSON log records for log shippers
+"""
+import datetime
+import logging
+from typing import Any
+
+import orjson
+
+# Attributes every LogRecord has; anything else was passed through ``extra=`` and is emitted as a field.
+STANDARD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON object: timestamp, level, logger, message, source location,
+    process id, any ``extra`` fields and, when present, the formatted exception.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        document: dict[str, Any] = {
+            "timestamp": datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "process": record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_ATTRIBUTES and not key.startswith("_"):
+                document[key] = value
+        if record.exc_info:
+            document["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            document["exception"] = record.exc_text
+        if record.stack_info:
+            document["stack"] = self.formatStack(record.stack_info)
+        return orjson.dumps(document, default=str).decode()
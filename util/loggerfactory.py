@@ -1,15 +1,175 @@
 """
 logger_factory.py - This module contains the factory class for creating logger instances
+
+In "queue" mode (the default) loggers only put records on an in-memory queue; a
+single QueueListener thread per process formats them and writes to the console, so
+request handling never waits on formatting or console I/O. When the queue is full,
+records are dropped rather than blocking the caller.
 """
+import atexit
+import copy
+import itertools
 import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
 from typing import Optional
 from util.settings import settings
 from util.ansi_color_formatter import AnsiColorFormatter
+from util.json_formatter import JSONFormatter
+
+# Third-party loggers that are chatty at INFO/DEBUG (httpx logs every request)
+LIBRARY_LOGGERS = ("httpx", "httpcore", "hpack", "postgrest", "supabase")
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in every N records below WARNING from loggers configured in
+    ``log_sample_rates`` (logger name prefix to fraction kept). Warnings and errors
+    always pass.
+    """
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        # Longest prefix first so "httpx.client" can be sampled differently from "httpx"
+        self.every = sorted(
+            ((prefix, max(1, round(1 / rate)) if rate > 0 else 0) for prefix, rate in rates.items()),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        self.counters: dict[str, itertools.count] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.every:
+            return True
+        for prefix, every in self.every:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                if every == 0:
+                    return False
+                counter = self.counters.setdefault(prefix, itertools.count())
+                return next(counter) % every == 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks: records that do not fit in the queue are counted and dropped.
+
+    Only the message arguments are merged in the caller's thread; the exception traceback is
+    rendered to text so it survives the hop, and all other formatting happens in the listener.
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
 
 class LoggerFactory:
     """Factory class for creating logger instances"""
 
+    _queue_handler: Optional[NonBlockingQueueHandler] = None
+    _listener: Optional[QueueListener] = None
+    _libraries_configured = False
+
+    @staticmethod
+    def create_formatter() -> logging.Formatter:
+        """
+        Create the formatter selected by the log_formatter setting ("ansi", "plain" or "json").
+        """
+        formatter = settings.log_formatter.strip().lower()
+        if formatter == "json":
+            return JSONFormatter()
+        if formatter == "plain":
+            return logging.Formatter(settings.log_format, style='{')
+        return AnsiColorFormatter(settings.log_format, style='{')
+
+    @staticmethod
+    def _shared_queue_handler() -> NonBlockingQueueHandler:
+        """
+        The QueueHandler shared by every logger in this process, starting its listener on first use.
+        """
+        if LoggerFactory._queue_handler is None:
+            log_queue: queue.Queue = queue.Queue(maxsize=settings.log_queue_size)
+            console = logging.StreamHandler(sys.stderr)
+            console.setFormatter(LoggerFactory.create_formatter())
+            handler = NonBlockingQueueHandler(log_queue)
+            if settings.log_sample_rates:
+                handler.addFilter(SamplingFilter(settings.log_sample_rates))
+            listener = QueueListener(log_queue, console, respect_handler_level=False)
+            listener.start()
+            atexit.register(LoggerFactory.shutdown)
+            LoggerFactory._queue_handler = handler
+            LoggerFactory._listener = listener
+        return LoggerFactory._queue_handler
+
+    @staticmethod
+    def shutdown() -> None:
+        """
+        Flush queued records and stop the listener thread (registered with atexit).
+        """
+        listener, LoggerFactory._listener = LoggerFactory._listener, None
+        if listener is not None:
+            listener.stop()
+        if LoggerFactory._queue_handler is not None and LoggerFactory._queue_handler.dropped:
+            sys.stderr.write(f"{LoggerFactory._queue_handler.dropped} log records were dropped because the log queue was full\n")
+
+    @staticmethod
+    def create_handler() -> logging.Handler:
+        """
+        Create (or share) the handler for the log_pipeline setting: "queue" or "sync".
+        """
+        if settings.log_pipeline.strip().lower() == "sync":
+            handler = logging.StreamHandler()
+            handler.setFormatter(LoggerFactory.create_formatter())
+            if settings.log_sample_rates:
+                handler.addFilter(SamplingFilter(settings.log_sample_rates))
+            return handler
+        return LoggerFactory._shared_queue_handler()
+
+    @staticmethod
+    def configure_libraries() -> None:
+        """
+        Route third-party loggers through the same pipeline at log_library_level.
+        """
+        if LoggerFactory._libraries_configured:
+            return
+        LoggerFactory._libraries_configured = True
+        level = getattr(logging, settings.log_library_level.upper(), logging.WARNING)
+        handler = LoggerFactory.create_handler()
+        for name in LIBRARY_LOGGERS:
+            library_logger = logging.getLogger(name)
+            library_logger.setLevel(level)
+            library_logger.handlers.clear()
+            library_logger.addHandler(handler)
+            library_logger.propagate = False
+
+    @staticmethod
+    def adopt_logger(name: str) -> None:
+        """
+        Replace the handlers of an existing logger (e.g. "uvicorn.access") with this pipeline's,
+        keeping its level. Only applies in queue mode.
+        """
+        if settings.log_pipeline.strip().lower() == "sync":
+            return
+        existing = logging.getLogger(name)
+        existing.handlers.clear()
+        existing.addHandler(LoggerFactory.create_handler())
+        existing.propagate = False
+
     @staticmethod
     def create_logger(name: str, loglevel: Optional[str] = None) -> logging.Logger:
         """
@@ -25,7 +185,7 @@ class LoggerFactory:
         """
         if loglevel is None:
             loglevel = settings.log_level
-            
+
         loglevel = loglevel.upper()
 
         # Validate loglevel
@@ -35,14 +195,12 @@ class LoggerFactory:
             logging.warning(f"Invalid loglevel '{loglevel}' provided. Defaulting to 'INFO'.")
             loglevel = 'INFO'
 
+        LoggerFactory.configure_libraries()
         result_logger = logging.getLogger(name)
         result_logger.handlers.clear()
+        # The logger level is the early exit: records below it are never created.
         result_logger.setLevel(getattr(logging, loglevel))
-        handler = logging.StreamHandler()
-        formatter = AnsiColorFormatter(settings.log_format, style='{')
-        handler.setFormatter(formatter)
-        handler.setLevel(getattr(logging, loglevel))
-        result_logger.addHandler(handler)
+        result_logger.addHandler(LoggerFactory.create_handler())
         result_logger.propagate = False
-        result_logger.debug(f"Logger '{name}' created with loglevel '{loglevel}'")
+        result_logger.debug("Logger '%s' created with loglevel '%s'", name, loglevel)
         return result_logger
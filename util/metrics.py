@@ -0,0 +1,370 @@
+"""
+util/metrics.py - In-process counters and histograms rendered in the Prometheus text format
+
+Each uvicorn worker keeps its own registry and a background thread periodically writes
+a JSON snapshot of it to ``metrics_dir``; /api/metrics merges the snapshots of every worker, so a scrape
+that lands on any worker sees the totals for the whole host.
+"""
+import asyncio
+import functools
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PARSE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+
+
+class Metric:
+    """A named family of samples, one per combination of label values."""
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, labels: tuple[str, ...]):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.samples: dict[tuple[str, ...], Any] = {}
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1.0, **labels: Any) -> None:
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self.registry.lock:
+            self.samples[key] = self.samples.get(key, 0.0) + value
+        self.registry.dirty = True
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self.registry.lock:
+            self.samples[key] = float(value)
+        self.registry.dirty = True
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, labels: tuple[str, ...], buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels: Any) -> None:
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self.registry.lock:
+            sample = self.samples.get(key)
+            if sample is None:
+                # per-bucket (not cumulative) counts, the +Inf bucket last, then sum
+                sample = self.samples[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            sample[index] += 1
+            sample[-1] += value
+        self.registry.dirty = True
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def default_metrics_dir() -> str:
+    """A directory on /dev/shm when available (memory backed), otherwise in the temp dir."""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "kparalegal-metrics")
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics of this process and merges the snapshots of all worker processes.
+
+    :param directory: Where worker snapshots are exchanged; None keeps metrics per process.
+    :type directory: Optional[str]
+    :param flush_interval: Seconds between snapshot writes by the flusher thread (see start).
+    :type flush_interval: float
+    """
+    def __init__(self, directory: Optional[str] = None, flush_interval: float = 5.0, enabled: bool = True):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.metrics: dict[str, Metric] = {}
+        self.lock = threading.Lock()
+        self.dirty = False  # Samples changed since the last snapshot write
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(self, name, documentation, labels)
+        self.metrics[name] = metric
+        return metric
+
+    def gauge(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(self, name, documentation, labels)
+        self.metrics[name] = metric
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(self, name, documentation, labels, buckets)
+        self.metrics[name] = metric
+        return metric
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        """JSON-compatible copy of this process's samples."""
+        with self.lock:
+            return {
+                name: {"samples": [[list(key), value if isinstance(value, float) else list(value)] for key, value in metric.samples.items()]}
+                for name, metric in self.metrics.items()
+            }
+
+    def start(self) -> None:
+        """
+        Start the thread that writes this process's snapshot every flush_interval seconds while
+        samples change, keeping file writes off the request path. Does nothing without a directory.
+        """
+        if self.directory is None or (self._flusher is not None and self._flusher.is_alive()):
+            return
+        self._stop.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+        self._flusher.start()
+
+    def close(self) -> None:
+        """Stop the flusher thread and write a final snapshot."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        if self.dirty:
+            self.flush()
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            if self.dirty:
+                self.flush()
+
+    def flush(self) -> None:
+        """Write this process's snapshot to the shared directory."""
+        if self.directory is None:
+            return
+        self.dirty = False
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{os.getpid()}.json")
+            with open(f"{path}.tmp", "w", encoding="utf-8") as snapshot_file:
+                json.dump(self.snapshot(), snapshot_file)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            LOGGER.warning("Could not write metrics snapshot: %s", e)
+
+    def _worker_snapshots(self) -> list[dict[str, dict[str, Any]]]:
+        if self.directory is None:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            pid = os.path.basename(path)[:-len(".json")]
+            if pid.isdigit() and not _alive(int(pid)):
+                # A worker that exited (or a previous run); its counts go with it
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path, encoding="utf-8") as snapshot_file:
+                    snapshots.append(json.load(snapshot_file))
+            except (OSError, ValueError) as e:
+                LOGGER.debug("Skipping metrics snapshot %s: %s", path, e)
+        return snapshots
+
+    def collect(self) -> dict[str, dict[tuple[str, ...], Any]]:
+        """
+        Samples summed over every worker's snapshot (counters and gauges add, histogram buckets add).
+        """
+        merged: dict[str, dict[tuple[str, ...], Any]] = {name: {} for name in self.metrics}
+        for snapshot in self._worker_snapshots():
+            for name, family in snapshot.items():
+                if name not in merged:
+                    continue
+                samples = merged[name]
+                for key, value in family["samples"]:
+                    key = tuple(key)
+                    if isinstance(value, list):
+                        current = samples.get(key)
+                        samples[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                    else:
+                        samples[key] = samples.get(key, 0.0) + value
+        return merged
+
+    def render(self) -> str:
+        """
+        All metrics, merged across workers, in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, samples in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(samples.items()):
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, count in zip([_number(bound) for bound in metric.buckets] + ["+Inf"], value[:-1]):
+                        cumulative += count
+                        le = f'le="{bound}"'
+                        lines.append(f"{name}_bucket{_labels(metric.labels, key, le)} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(metric.labels, key)} {_number(value[-1])}")
+                    lines.append(f"{name}_count{_labels(metric.labels, key)} {cumulative}")
+                else:
+                    lines.append(f"{name}{_labels(metric.labels, key)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry(
+    directory=(settings.metrics_dir or default_metrics_dir()) if settings.metrics_multiprocess else None,
+    flush_interval=settings.metrics_flush_interval,
+    enabled=settings.metrics_enabled,
+)
+
+DB_QUERY_SECONDS = METRICS.histogram("kparalegal_db_query_duration_seconds", "Time per database request attempt, including parsing", ("table", "operation"))
+DB_QUERY_ERRORS = METRICS.counter("kparalegal_db_query_errors_total", "Database request attempts that raised", ("table", "operation", "code"))
+DB_RETRIES = METRICS.counter("kparalegal_db_retries_total", "Database requests retried by tenacity", ("operation",))
+DB_RETRY_SLEEP = METRICS.counter("kparalegal_db_retry_sleep_seconds_total", "Time spent waiting between tenacity retries", ("operation",))
+DB_ROWS = METRICS.counter("kparalegal_db_rows_returned_total", "Rows returned by the database", ("table", "operation"))
+DB_PARSE_SECONDS = METRICS.histogram("kparalegal_db_parse_duration_seconds", "Time spent validating rows into models", ("table", "operation"), PARSE_BUCKETS)
+CACHE_REQUESTS = METRICS.counter("kparalegal_cache_requests_total", "Cached reads by outcome (hit, stale, shared, miss, last_good)", ("table", "result"))
+DB_COALESCED = METRICS.counter("kparalegal_db_coalesced_total", "Reads served by an identical in-flight query", ("table",))
+DB_RETRIES_DENIED = METRICS.counter("kparalegal_db_retries_denied_total", "Retries skipped because the retry budget was exhausted", ("operation",))
+DB_DEADLINE_EXCEEDED = METRICS.counter("kparalegal_db_deadline_exceeded_total", "Database calls abandoned at the request deadline", ("table",))
+DB_BREAKER_OPEN = METRICS.gauge("kparalegal_db_breaker_open", "Workers whose circuit breaker for the table is open", ("table",))
+DB_BREAKER_TRANSITIONS = METRICS.counter("kparalegal_db_breaker_transitions_total", "Circuit breaker state changes by new state", ("table", "state"))
+DB_BREAKER_REJECTED = METRICS.counter("kparalegal_db_breaker_rejected_total", "Calls failed fast by an open circuit breaker", ("table",))
+CHANGEFEED_CHANGES = METRICS.counter("kparalegal_changefeed_changes_total", "Table changes pushed to caches by the change tracker (rows, or a full reload)", ("table", "kind"))
+CHANGEFEED_ERRORS = METRICS.counter("kparalegal_changefeed_errors_total", "Change feed polls that failed")
+IMAGE_VARIANTS = METRICS.counter("kparalegal_image_variants_total", "Image variant requests by outcome (hit, render, unconvertible or original)", ("result",))
+IMAGE_RENDER_SECONDS = METRICS.histogram("kparalegal_image_render_seconds", "Time to resize and encode an image variant", ("format",))
+HTTP_REQUEST_SECONDS = METRICS.histogram("kparalegal_http_request_duration_seconds", "Time to produce a response", ("route", "method", "status"))
+
+
+def _observe_query(table: str, operation: str, started: float, error: Optional[BaseException], args: tuple) -> None:
+    elapsed = time.perf_counter() - started
+    DB_QUERY_SECONDS.observe(elapsed, table=table, operation=operation)
+    if error is not None:
+        DB_QUERY_ERRORS.inc(table=table, operation=operation, code=getattr(error, "code", None) or type(error).__name__)
+    if settings.slow_query_threshold and elapsed >= settings.slow_query_threshold:
+        condition = next((arg for arg in args if isinstance(arg, dict)), None)
+        LOGGER.warning("Slow query: %s on %s took %.3fs (%s)", operation, table, elapsed, condition)
+
+
+def instrument_query(operation: str) -> Callable:
+    """
+    Decorator for DatabaseManager methods whose first argument (after self) is the table.
+
+    Times every call (so under @retry, every attempt), counts failures by error code and
+    logs calls slower than the slow_query_threshold setting. Works on sync and async methods.
+    """
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, table: str, *args, **kwargs):
+                started, error = time.perf_counter(), None
+                try:
+                    return await func(self, table, *args, **kwargs)
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    _observe_query(table, operation, started, error, args)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, table: str, *args, **kwargs):
+            started, error = time.perf_counter(), None
+            try:
+                return func(self, table, *args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                _observe_query(table, operation, started, error, args)
+        return wrapper
+    return decorator
+
+
+def record_retry(retry_state: Any) -> None:
+    """tenacity ``before_sleep`` hook: count the retry and the wait that follows it."""
+    operation = getattr(retry_state.fn, "__name__", "unknown")
+    DB_RETRIES.inc(operation=operation)
+    if retry_state.next_action is not None:
+        DB_RETRY_SLEEP.inc(retry_state.next_action.sleep, operation=operation)
+    LOGGER.warning("Retrying %s after attempt %d failed: %s", operation, retry_state.attempt_number, retry_state.outcome.exception() if retry_state.outcome else None)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request, labelled by route template (not the raw
+    path, to bound cardinality). Pure ASGI rather than BaseHTTPMiddleware so responses
+    are not funnelled through an extra task and stream.
+    """
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or ("static" if status < 400 else "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=scope["method"], status=status)
@@ -0,0 +1,315 @@
+"""
+util/prerender.py - Product and landing pages with their meta tags and content in the HTML
+
+The SPA shell (dist/index.html) carries the landing page's title, description, Open Graph
+tags and canonical URL, so crawlers and link unfurlers that do not run JavaScript see the
+same page everywhere. PageRenderer serves the shell with those tags replaced:
+
+* /product/{slug} (and /products/{slug}, the sitemap's form) gets the product's title,
+  description, image, canonical URL and Service JSON-LD, and its title and description
+  inside ``<div id="root">`` (React's createRoot replaces it on load);
+* known landing pages get their own title, description and canonical URL.
+
+Pages are built from the in-memory slug index and cached until the product changes or
+the shell is rebuilt.
+"""
+import html
+import json
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+
+from db.models.product import ProductInDB
+from db.repositories.product import AsyncProductRepository
+from util.responses import conditional_response, etag_for, etag_matches
+from util.search import strip_markdown
+from util.settings import settings
+from util.staticassets import HTML_CACHE_CONTROL, AssetFiles
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+HTML_MEDIA_TYPE = "text/html; charset=utf-8"
+PRODUCT_PATH = "/product/{slug}"  # The SPA route, used as the canonical URL
+DEFAULT_IMAGE = "/images/ogimage.png"
+# Path -> (title, description), None for site_title/site_description. Mirrors the SEO props of src/pages.
+LANDING_PAGES: dict[str, tuple[Optional[str], Optional[str]]] = {
+    "/about": ("About Marissa Daley | K-Paralegal, LLC", "Meet Marissa A. Daley, certificated paralegal with 13+ years of experience in Texas Family Law. Expert in case management, legal research, and document preparation."),
+    "/contact": ("Contact K-Paralegal | Texas Family Law Paralegal Support", "Get in touch with K-Paralegal, LLC for expert Texas Family Law paralegal services. Fast response times and professional support for attorneys."),
+    "/services": ("Paralegal Services for Texas Family Law | K-Paralegal", "Comprehensive paralegal services for Texas Family Law attorneys. Document preparation, case management, legal research, and court filing services."),
+    "/services/case-management": (None, None),
+    "/services/legal-research": (None, None),
+    "/services/court-filing": (None, None),
+    "/privacy": (None, None),
+    "/terms": (None, None),
+    "/blog": (None, None),
+}
+# Tags of the shell that every rendered page replaces
+REPLACED_TAGS = re.compile(
+    r"""<title\b[^>]*>.*?</title>\s*"""
+    r"""|<meta\s[^>]*?(?:name|property)=["'](?:title|description|og:(?:type|url|title|description|image)|twitter:(?:url|title|description|image))["'][^>]*>\s*"""
+    r"""|<link\s[^>]*?rel=["']canonical["'][^>]*>\s*"""
+    r"""|<script\s[^>]*?type=["']application/ld\+json["'][^>]*>.*?</script>\s*""",
+    re.IGNORECASE | re.DOTALL,
+)
+HEAD_CLOSE = re.compile(r"</head\s*>", re.IGNORECASE)
+EMPTY_ROOT = re.compile(r"""<div\s+id=["']?root["']?\s*>\s*</div>""", re.IGNORECASE)
+MARKUP = re.compile(r"[#*_>`~|]+")
+SPACE_BEFORE_PUNCTUATION = re.compile(r"\s+([.,;:!?])")
+
+
+def plain_text(markdown: str) -> str:
+    """markdown as one line of text, without links, tags or emphasis markers."""
+    return SPACE_BEFORE_PUNCTUATION.sub(r"\1", " ".join(MARKUP.sub(" ", strip_markdown(markdown)).split()))
+
+
+def summarize(text: str, length: int) -> str:
+    """text cut at a word boundary to at most length characters, with an ellipsis if cut."""
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1].rsplit(" ", 1)[0].rstrip(",.;:")
+    return cut + "…"
+
+
+def absolute_url(path: str) -> str:
+    return path if path.startswith(("http://", "https://")) else settings.host_url.rstrip("/") + "/" + path.lstrip("/")
+
+
+def json_ld(data: dict[str, Any]) -> str:
+    # "</" would close the script element early
+    return '<script type="application/ld+json">' + json.dumps(data, ensure_ascii=False).replace("</", "<\\/") + "</script>"
+
+
+def head_tags(title: str, description: str, url: str, image: str, page_type: str = "website", structured_data: Optional[dict[str, Any]] = None, noindex: bool = False) -> str:
+    """
+    The title, description, Open Graph, Twitter, canonical and JSON-LD tags of a page
+    (the tags src/components/SEO.tsx sets in the browser).
+    """
+    title, description, url, image = (html.escape(value) for value in (title, description, url, image))
+    tags = [
+        f"<title>{title}</title>",
+        f'<meta name="title" content="{title}" />',
+        f'<meta name="description" content="{description}" />',
+        f'<meta property="og:type" content="{page_type}" />',
+        f'<meta property="og:url" content="{url}" />',
+        f'<meta property="og:title" content="{title}" />',
+        f'<meta property="og:description" content="{description}" />',
+        f'<meta property="og:image" content="{image}" />',
+        f'<meta name="twitter:url" content="{url}" />',
+        f'<meta name="twitter:title" content="{title}" />',
+        f'<meta name="twitter:description" content="{description}" />',
+        f'<meta name="twitter:image" content="{image}" />',
+        f'<link rel="canonical" href="{url}" />',
+    ]
+    if noindex:
+        tags.append('<meta name="robots" content="noindex" />')
+    if structured_data:
+        tags.append(json_ld(structured_data))
+    return "\n    ".join(tags) + "\n  "
+
+
+def product_structured_data(product: ProductInDB, url: str, description: str) -> dict[str, Any]:
+    """Service and BreadcrumbList JSON-LD for a product, as ProductDetailPage builds it."""
+    data: dict[str, Any] = {
+        "@context": "https://schema.org",
+        "@type": "Service",
+        "name": product.title,
+        "description": description,
+        "provider": {"@type": "Organization", "name": settings.site_name, "url": absolute_url("/")},
+        "areaServed": {"@type": "State", "name": "Texas"},
+        "serviceType": "Paralegal Services",
+        "breadcrumb": {
+            "@type": "BreadcrumbList",
+            "itemListElement": [
+                {"@type": "ListItem", "position": 1, "name": "Home", "item": absolute_url("/")},
+                {"@type": "ListItem", "position": 2, "name": "Services", "item": absolute_url("/services")},
+                {"@type": "ListItem", "position": 3, "name": product.title, "item": url},
+            ],
+        },
+    }
+    if product.image_path:
+        data["image"] = absolute_url(product.image_path)
+    if product.order_link:
+        data["url"] = product.order_link
+    return data
+
+
+def product_body(product: ProductInDB) -> str:
+    """The product's title and description as static HTML for the root element."""
+    paragraphs = (plain_text(block) for block in re.split(r"\n\s*\n", product.description))
+    content = "".join(f"<p>{html.escape(text)}</p>" for text in paragraphs if text)
+    order = f'<p><a href="{html.escape(product.order_link)}">Order</a></p>' if product.order_link else ""
+    return f"<main><article><h1>{html.escape(product.title)}</h1>{content}{order}</article></main>"
+
+
+@dataclass
+class Shell:
+    """dist/index.html with the replaced tags removed, split where the page's parts go."""
+    version: str  # ETag of the index.html it was made from
+    before_head: str
+    before_root: str
+    after_root: str
+    has_root: bool
+
+    @classmethod
+    def parse(cls, version: str, document: str) -> "Shell":
+        document = REPLACED_TAGS.sub("", document)
+        head = HEAD_CLOSE.search(document)
+        split = head.start() if head is not None else 0
+        before_head, rest = document[:split], document[split:]
+        root = EMPTY_ROOT.search(rest)
+        if root is None:
+            return cls(version, before_head, rest, "", False)
+        open_tag = rest[root.start():rest.index(">", root.start()) + 1]
+        return cls(version, before_head, rest[:root.start()] + open_tag, "</div>" + rest[root.end():], True)
+
+    def render(self, head: str, body: str = "") -> bytes:
+        return (self.before_head + head + self.before_root + (body if self.has_root else "") + self.after_root).encode("utf-8")
+
+
+@dataclass
+class Page:
+    body: bytes
+    etag: str
+    status_code: int = 200
+
+
+class PageRenderer:
+    """
+    Serves SPA pages with page-specific meta tags; see the module docstring.
+
+    Register ``invalidate_products`` as a product index listener so cached product pages
+    follow product changes.
+
+    :param dist: The mounted dist directory holding index.html.
+    :type dist: AssetFiles
+    :param products: Repository whose slug index supplies the products.
+    :type products: AsyncProductRepository
+    """
+    def __init__(self, dist: AssetFiles, products: AsyncProductRepository, max_entries: int = settings.prerender_cache_max_entries):
+        self.dist = dist
+        self.products = products
+        self.max_entries = max_entries
+        self._shell: Optional[Shell] = None
+        self._pages: OrderedDict[str, Page] = OrderedDict()  # Product slug or landing path -> page
+        self._rendered_slugs: dict[int, str] = {}  # Product id -> slug its page is cached under
+        products.add_index_listener(self.invalidate_products)
+
+    def invalidate_products(self, products: list[ProductInDB], reloaded: bool) -> None:
+        """
+        Product index listener: drop the cached pages of changed products (all of them after a reload).
+        """
+        if reloaded:
+            self._pages.clear()
+            self._rendered_slugs.clear()
+            return
+        for product in products:
+            previous = self._rendered_slugs.pop(product.id, None)
+            if previous is not None:
+                self._pages.pop(previous, None)
+
+    async def shell(self) -> Shell:
+        """
+        The parsed index.html, re-read (and the page cache dropped) when it is rebuilt.
+        """
+        full_path, stat_result = await anyio.to_thread.run_sync(self.dist.lookup_path, "index.html")
+        if stat_result is None:
+            raise FileNotFoundError("index.html")
+        asset = self.dist.asset(full_path, stat_result)
+        version = asset.etag or f"{stat_result.st_size}-{stat_result.st_mtime_ns}"
+        if self._shell is None or self._shell.version != version:
+            if asset.body is not None:
+                document = asset.body
+            else:
+                document = await anyio.Path(full_path).read_bytes()
+            self._shell = Shell.parse(version, document.decode("utf-8"))
+            self._pages.clear()
+            self._rendered_slugs.clear()
+        return self._shell
+
+    def _remember(self, key: str, page: Page) -> Page:
+        self._pages[key] = page
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_entries:
+            self._pages.popitem(last=False)
+        return page
+
+    def _respond(self, request: Request, page: Page) -> Response:
+        headers = {"Cache-Control": HTML_CACHE_CONTROL}
+        if page.status_code == 200:
+            return conditional_response(request, page.body, page.etag, headers, HTML_MEDIA_TYPE)
+        if etag_matches(request.headers, page.etag):
+            return Response(status_code=304, headers={**headers, "ETag": page.etag})
+        return Response(page.body, page.status_code, {**headers, "ETag": page.etag}, HTML_MEDIA_TYPE)
+
+    async def product_page(self, slug: str) -> Page:
+        """
+        The page for a product, or a noindex 404 page if there is no such product.
+
+        404 pages are rendered for each request rather than cached, so requests for made-up
+        slugs cannot push product pages out of the cache.
+        """
+        shell = await self.shell()
+        page = self._pages.get(slug)
+        if page is not None:
+            self._pages.move_to_end(slug)
+            return page
+        product = await self.products.get_by_slug(slug)
+        if product is None:
+            head = head_tags(f"Not found | {settings.site_name}", "", absolute_url(PRODUCT_PATH.format(slug=slug)), absolute_url(DEFAULT_IMAGE), noindex=True)
+            body = shell.render(head)
+            return Page(body, etag_for(body), 404)
+        url = absolute_url(PRODUCT_PATH.format(slug=product.slug))
+        text = plain_text(product.description)
+        head = head_tags(
+            f"{product.title} | {settings.site_name}",
+            summarize(text, settings.prerender_description_length),
+            url,
+            absolute_url(product.image_path or DEFAULT_IMAGE),
+            "article",
+            product_structured_data(product, url, summarize(text, 200)),
+        )
+        body = shell.render(head, product_body(product))
+        self._rendered_slugs[product.id] = slug
+        return self._remember(slug, Page(body, etag_for(body)))
+
+    async def landing_page(self, path: str) -> Optional[Page]:
+        """
+        The page for a known landing path (trailing slash ignored), or None for other paths.
+        """
+        path = path.rstrip("/")
+        if path not in LANDING_PAGES:
+            return None
+        shell = await self.shell()
+        page = self._pages.get(path)
+        if page is None:
+            title, description = LANDING_PAGES[path]
+            head = head_tags(title or settings.site_title, description or settings.site_description, absolute_url(path), absolute_url(DEFAULT_IMAGE))
+            body = shell.render(head)
+            page = self._remember(path, Page(body, etag_for(body)))
+        return page
+
+    async def product_response(self, slug: str, request: Request) -> Response:
+        """
+        Respond with the prerendered page for a product, honoring If-None-Match.
+
+        :param slug: The product slug from the URL.
+        :type slug: str
+        :return: 200 (or 304) with the page; 404 with a noindex page for an unknown slug.
+        :rtype: Response
+        """
+        return self._respond(request, await self.product_page(slug))
+
+    async def page_response(self, request: Request) -> Response:
+        """
+        Respond to an SPA path: a landing page with its own tags, else the plain shell.
+        """
+        page = await self.landing_page(request.url.path)
+        if page is None:
+            return await self.dist.index_response(request.scope)
+        return self._respond(request, page)
@@ -0,0 +1,110 @@
+"""
+util/responses.py - Pre-serialized JSON responses with strong ETags
+
+Repository results are shared, read-only objects (see db/cachingmanager.py), so the
+JSON for a result only has to be produced once. The bytes are remembered per result
+object, or for a list per sequence of item objects (a page or search result is a new
+list of the same cached items each time), and served with an ETag; a matching
+If-None-Match gets a 304.
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Any, Optional
+
+import orjson
+from pydantic import BaseModel
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import Response
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialize content (models, lists of models, dicts) to JSON bytes with orjson.
+
+    Models are dumped without re-validation; UTC datetimes are written with a "Z" suffix
+    like pydantic does.
+    """
+    return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z)
+
+
+def etag_for(content: bytes) -> str:
+    """Strong ETag for a response body."""
+    return '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(request_headers: Headers, etag: str) -> bool:
+    """True if the request's If-None-Match header lists etag, weakly or strongly (or is "*")."""
+    if_none_match = request_headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def conditional_response(request: Request, content: bytes, etag: str, headers: Optional[dict[str, str]] = None, media_type: str = JSON_MEDIA_TYPE) -> Response:
+    """
+    Respond with content, or with 304 Not Modified if the client already has etag.
+    """
+    response_headers = {**(headers or {}), "ETag": etag}
+    if etag_matches(request.headers, etag):
+        return Response(status_code=304, headers=response_headers)
+    return Response(content=content, media_type=media_type, headers=response_headers)
+
+
+class JSONBytesCache:
+    """
+    LRU of serialized JSON keyed by the identity of the object that was serialized or, for
+    a list, by the identities of its items.
+
+    The objects themselves are kept alongside the bytes so their ids cannot be reused while cached.
+    """
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[tuple, bytes, str]] = OrderedDict()
+
+    def render(self, content: Any) -> tuple[bytes, str]:
+        """
+        Return (json bytes, etag) for content, serializing it only the first time.
+        """
+        objects = tuple(content) if isinstance(content, list) else (content,)
+        key = (isinstance(content, list),) + tuple(map(id, objects))
+        entry = self._entries.get(key)
+        if entry is not None and all(cached is current for cached, current in zip(entry[0], objects)):
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+        data = dumps(content)
+        etag = etag_for(data)
+        self._entries[key] = (objects, data, etag)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return data, etag
+
+
+JSON_CACHE = JSONBytesCache()
+
+
+def json_response(request: Request, content: Any, headers: Optional[dict[str, str]] = None) -> Response:
+    """
+    Serve content as JSON through the shared JSONBytesCache, honoring If-None-Match.
+
+    :param request: The incoming request.
+    :type request: Request
+    :param content: A model, or a list of models, returned by a repository. Must not be mutated afterwards.
+    :type content: Any
+    :param headers: Extra response headers.
+    :type headers: Optional[dict[str, str]]
+    :return: 200 with the JSON body, or 304 Not Modified.
+    :rtype: Response
+    """
+    data, etag = JSON_CACHE.render(content)
+    return conditional_response(request, data, etag, headers)
@@ -0,0 +1,337 @@
+"""
+util/search.py - In-memory full-text product search (BM25 with prefix and typo matching)
+
+SearchIndex is an inverted index over a few text fields per document. A query matches the
+documents containing every query word, where a word also matches the index words it is a
+prefix of (from ``search_prefix_min_length`` letters, for search-as-you-type) and the words
+within one edit (from 4 letters) or two edits (from 8 letters) of it. Documents are ranked
+by BM25 summed over the fields with ``search_field_weights``; prefix and typo matches
+count for less than exact ones.
+
+ProductSearch keeps an index of the products' title, slug and markdown description in step
+with the product slug index, which already follows every product change incrementally.
+
+Rf: https://en.wikipedia.org/wiki/Okapi_BM25
+"""
+import bisect
+import heapq
+import html
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Optional
+
+from db.models.product import ProductInDB, ProductSummary
+from db.repositories.product import AsyncProductRepository
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+PREFIX_WEIGHT = 0.7  # Score multiplier for an index word the query word is a prefix of
+TYPO_WEIGHT = 0.5  # Score multiplier per edit between the query word and the index word
+EXPANSION_CACHE_SIZE = 10_000  # Query words whose matches are remembered until the index changes
+WORD = re.compile(r"[a-z0-9]+")
+APOSTROPHES = re.compile(r"['’]")
+MARKDOWN_PATTERNS = [
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r" \1 "),  # Images: keep the alt text
+    (re.compile(r"\[([^\]]*)\]\([^)]*\)"), r" \1 "),  # Links: keep the link text
+    (re.compile(r"\[([^\]]*)\]\[[^\]]*\]"), r" \1 "),  # Reference links
+    (re.compile(r"^\s*\[[^\]]+\]:\s*\S+.*$", re.MULTILINE), " "),  # Link definitions
+    (re.compile(r"<[^>]+>"), " "),  # HTML tags and autolinks
+    (re.compile(r"https?://\S+"), " "),  # Bare URLs
+    (re.compile(r"^\s*`{3,}.*$", re.MULTILINE), " "),  # Code fence lines (the code is kept)
+]
+
+
+def strip_markdown(text: str) -> str:
+    """
+    The readable text of a markdown document: link and image targets, HTML tags and code
+    fences are removed; emphasis, heading and list markers are left to the tokenizer.
+    """
+    for pattern, replacement in MARKDOWN_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return html.unescape(text)
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lowercase, accent-free alphanumeric words of text ("Client's Rights" -> ["clients", "rights"]).
+    """
+    text = unicodedata.normalize("NFKD", APOSTROPHES.sub("", text.lower()))
+    return WORD.findall("".join(char for char in text if not unicodedata.combining(char)))
+
+
+def deletions(word: str, depth: int) -> set[str]:
+    """
+    word and every string obtained by deleting up to depth of its characters.
+    """
+    found = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {item[:i] + item[i + 1:] for item in frontier for i in range(len(item))} - found
+        found |= frontier
+    return found
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Optimal string alignment distance (insertions, deletions, substitutions and adjacent
+    transpositions) between a and b, or limit + 1 once it is known to exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before: Optional[list[int]] = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if before is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+def typo_budget(word: str) -> int:
+    """Edits tolerated in a query word: none below 4 letters, one below 8, else two."""
+    budget = 0 if len(word) < 4 else 1 if len(word) < 8 else 2
+    return min(budget, settings.search_max_typos)
+
+
+class SearchIndex:
+    """
+    Inverted index of documents identified by int ids, each with named text fields.
+
+    Documents can be added, replaced and removed one at a time; the word lists used for
+    prefix and typo matching are maintained along with the postings.
+
+    :param field_weights: BM25 weight of each field; fields not listed are not indexed.
+    :type field_weights: dict[str, float]
+    """
+    def __init__(self, field_weights: Optional[dict[str, float]] = None, k1: float = settings.search_bm25_k1, b: float = settings.search_bm25_b):
+        self.field_weights = field_weights or settings.search_field_weights
+        self.k1 = k1
+        self.b = b
+        # word -> document id -> field -> occurrences
+        self._postings: dict[str, dict[int, dict[str, int]]] = {}
+        self._lengths: dict[str, dict[int, int]] = {name: {} for name in self.field_weights}
+        self._total_lengths: dict[str, int] = {name: 0 for name in self.field_weights}
+        self._document_words: dict[int, set[str]] = {}
+        self._words: list[str] = []  # Sorted, for prefix matching
+        self._deletions: dict[str, set[str]] = defaultdict(set)  # Deletion variant -> words, for typo matching
+        # Derived from the whole index (document count, average lengths); cleared by every change
+        self._scores: dict[str, dict[int, float]] = {}
+        self._expansions: dict[str, dict[str, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._document_words)
+
+    def __contains__(self, doc_id: int) -> bool:
+        return doc_id in self._document_words
+
+    def _add_word(self, word: str) -> None:
+        bisect.insort(self._words, word)
+        for variant in deletions(word, settings.search_max_typos):
+            self._deletions[variant].add(word)
+
+    def _remove_word(self, word: str) -> None:
+        del self._words[bisect.bisect_left(self._words, word)]
+        for variant in deletions(word, settings.search_max_typos):
+            words = self._deletions.get(variant)
+            if words is not None:
+                words.discard(word)
+                if not words:
+                    del self._deletions[variant]
+
+    def add(self, doc_id: int, fields: dict[str, str]) -> None:
+        """
+        Index a document, replacing any earlier version with the same id.
+
+        :param doc_id: The document id returned by search.
+        :type doc_id: int
+        :param fields: Text of each field.
+        :type fields: dict[str, str]
+        """
+        self.remove(doc_id)
+        self._scores.clear()
+        self._expansions.clear()
+        document_words: set[str] = set()
+        self._document_words[doc_id] = document_words
+        for name in self.field_weights:
+            words = tokenize(fields.get(name) or "")
+            document_words.update(words)
+            self._lengths[name][doc_id] = len(words)
+            self._total_lengths[name] += len(words)
+            for word in words:
+                postings = self._postings.get(word)
+                if postings is None:
+                    postings = self._postings[word] = {}
+                    self._add_word(word)
+                counts = postings.setdefault(doc_id, {})
+                counts[name] = counts.get(name, 0) + 1
+
+    def remove(self, doc_id: int) -> None:
+        """Remove a document; unknown ids are ignored."""
+        words = self._document_words.pop(doc_id, None)
+        if words is None:
+            return
+        self._scores.clear()
+        self._expansions.clear()
+        for name, lengths in self._lengths.items():
+            self._total_lengths[name] -= lengths.pop(doc_id, 0)
+        for word in words:
+            postings = self._postings[word]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[word]
+                self._remove_word(word)
+
+    def expand(self, word: str) -> dict[str, float]:
+        """
+        The index words a query word matches, with their score multipliers: 1 for the word
+        itself, PREFIX_WEIGHT for longer words it starts, TYPO_WEIGHT per edit for near misses.
+        At most search_max_expansions words besides the word itself, the closest first.
+        """
+        matches = self._expansions.get(word)
+        if matches is not None:
+            return matches
+        matches = {}
+        if word in self._postings:
+            matches[word] = 1.0
+        candidates: dict[str, float] = {}
+        if len(word) >= settings.search_prefix_min_length:
+            start = bisect.bisect_left(self._words, word)
+            for indexed in self._words[start:]:
+                if not indexed.startswith(word):
+                    break
+                if indexed != word:
+                    candidates[indexed] = PREFIX_WEIGHT
+        budget = typo_budget(word)
+        if budget:
+            nearby = set()
+            for variant in deletions(word, budget):
+                nearby |= self._deletions.get(variant, set())
+            for indexed in nearby:
+                if indexed == word:
+                    continue
+                distance = edit_distance(word, indexed, budget)
+                if distance <= budget:
+                    candidates[indexed] = max(candidates.get(indexed, 0.0), TYPO_WEIGHT ** distance)
+        closest = heapq.nlargest(settings.search_max_expansions, candidates.items(), key=lambda item: (item[1], -len(item[0])))
+        matches.update(closest)
+        if len(self._expansions) >= EXPANSION_CACHE_SIZE:
+            self._expansions.clear()
+        self._expansions[word] = matches
+        return matches
+
+    def scores(self, word: str) -> dict[int, float]:
+        """
+        BM25 score of each document containing the index word word, computed once per index version.
+        """
+        scores = self._scores.get(word)
+        if scores is not None:
+            return scores
+        documents = len(self)
+        postings = self._postings[word]
+        idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+        averages = {name: (total / documents if documents else 0.0) for name, total in self._total_lengths.items()}
+        scores = {}
+        for doc_id, counts in postings.items():
+            score = 0.0
+            for name, occurrences in counts.items():
+                norm = 1 - self.b + self.b * self._lengths[name][doc_id] / (averages[name] or 1.0)
+                score += self.field_weights[name] * occurrences * (self.k1 + 1) / (occurrences + self.k1 * norm)
+            scores[doc_id] = idf * score
+        self._scores[word] = scores
+        return scores
+
+    def _word_scores(self, matches: dict[str, float]) -> dict[int, float]:
+        """Score of each document for one query word: the best over the index words it matches."""
+        if len(matches) == 1:
+            (indexed, multiplier), = matches.items()
+            if multiplier == 1.0:
+                return self.scores(indexed)
+        best: dict[int, float] = {}
+        for indexed, multiplier in matches.items():
+            for doc_id, score in self.scores(indexed).items():
+                score *= multiplier
+                if score > best.get(doc_id, 0.0):
+                    best[doc_id] = score
+        return best
+
+    def search(self, query: str, limit: int = settings.search_default_limit) -> list[tuple[int, float]]:
+        """
+        Find the documents matching every word of query, best first.
+
+        :param query: Words to look for.
+        :type query: str
+        :param limit: Most results to return.
+        :type limit: int
+        :return: (document id, score) pairs, highest score first (ties by id).
+        :rtype: list[tuple[int, float]]
+        """
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return []
+        totals: Optional[dict[int, float]] = None
+        for scores in sorted((self._word_scores(self.expand(word)) for word in words), key=len):
+            if totals is None:
+                totals = scores
+            else:
+                totals = {doc_id: total + scores[doc_id] for doc_id, total in totals.items() if doc_id in scores}
+            if not totals:
+                return []
+        return heapq.nsmallest(limit, totals.items(), key=lambda item: (-item[1], item[0]))
+
+
+def product_fields(product: ProductInDB) -> dict[str, str]:
+    return {"title": product.title, "slug": product.slug.replace("-", " "), "description": strip_markdown(product.description)}
+
+
+class ProductSearch:
+    """
+    Product search over an index kept in step with the repository's slug index.
+
+    The index is filled when the slug index loads (the "products" warm-up step) and updated
+    with each product the slug index refreshes; a full slug index reload, which is how
+    deletes are picked up, rebuilds it.
+    """
+    def __init__(self, products: AsyncProductRepository):
+        self.products = products
+        self.index = SearchIndex()
+        self._summaries: dict[int, ProductSummary] = {}
+        products.add_index_listener(self.update)
+
+    def update(self, products: list[ProductInDB], reloaded: bool) -> None:
+        """
+        Product index listener: (re)index changed products, or rebuild after a reload.
+        """
+        if reloaded:
+            index, summaries = SearchIndex(self.index.field_weights, self.index.k1, self.index.b), {}
+        else:
+            index, summaries = self.index, self._summaries
+        for product in products:
+            index.add(product.id, product_fields(product))
+            summaries[product.id] = ProductSummary.model_validate(product, from_attributes=True)
+        self.index, self._summaries = index, summaries
+        LOGGER.debug("Search index updated with %d products (%d indexed).", len(products), len(index))
+
+    async def search(self, query: str, limit: int = settings.search_default_limit) -> list[ProductSummary]:
+        """
+        Products matching every word of query, most relevant first.
+
+        :param query: The search box text.
+        :type query: str
+        :param limit: Most products to return.
+        :type limit: int
+        :return: The matching products without their descriptions.
+        :rtype: list[ProductSummary]
+        """
+        # Loads the slug index (and so this index) on first use and schedules its periodic refresh
+        await self.products.warm_slug_index()
+        return [self._summaries[doc_id] for doc_id, _ in self.index.search(query, limit)]
@@ -10,17 +10,137 @@ class Settings(BaseSettings):
     version: str = "1.0.0"
     host: str = "0.0.0.0"
     host_url: str = "http://localhost:8092"
+    site_name: str = "K-Paralegal, LLC"
+    site_title: str = "K-Paralegal, LLC | Texas Family Law Paralegal"  # Title of pages without one of their own
+    site_description: str = "Expert Texas Family Law paralegal services. Professional, reliable support for family law attorneys across Texas. Case management, legal research, and court filing."
     port: int = 8093
     is_development: bool = False
 
      # Logging settings
-    log_format: str = "%(asctime)s - %(name)-15s - %(levelname)-8s - %(message)s"
+    log_format: str = "{asctime} - {name:15} - {levelname:8} - {message}"  # str.format style, as the formatters use style='{'
     log_level: str = "WARNING"  # Default log level for API
+    log_pipeline: str = "queue"  # "queue": a background thread formats and writes records; "sync": write in the caller
+    log_formatter: str = "ansi"  # "ansi" (colored), "plain" or "json" (one object per line)
+    log_queue_size: int = 10000  # Records buffered in queue mode; further records are dropped, never waited on
+    log_library_level: str = "WARNING"  # Level for httpx, httpcore, postgrest and supabase loggers
+    log_sample_rates: dict[str, float] = {}  # Logger name prefix to fraction of DEBUG/INFO records kept, e.g. {"httpx": 0.01}
 
     # Database Settings
     supabase_url: str = ""
     supabase_service_role_key: str = ""
     supabase_password: str = ""
+
+    # Database backend: "supabase", or "local" for an offline store with the same semantics (db/localmanager.py)
+    db_backend: str = "supabase"
+    db_local_path: str = ""  # SQLite file for the local backend; empty keeps rows in memory (per worker process)
+    db_local_seed_path: str = ""  # JSON file of {"table": [rows]} loaded when the local store starts empty
+    db_local_unique_columns: dict[str, list[str]] = {"products": ["slug"], "parameters": ["environment,key"]}
+
+    # Async PostgREST connection pool (AsyncSupabaseManager)
+    db_pool_max_connections: int = 20
+    db_pool_max_keepalive_connections: int = 10
+    db_pool_keepalive_expiry: float = 30.0  # Seconds an idle connection is kept open
+    db_timeout: float = 10.0  # Seconds per HTTP request to Supabase
+    db_http2: bool = False
+    db_single_flight: bool = True  # Share one round trip among concurrent identical reads
+    db_bulk_chunk_size: int = 500  # Rows per request for insert_many/upsert_many/delete_in
+    db_exists_chunk_size: int = 100  # Values per exists_many request; they travel in the URL
+    db_max_rows: int = 1000  # The PostgREST max-rows limit; exists_many asks for no more rows than this at once
+
+    # Resilience (db/resilience.py, db/circuitbreaker.py)
+    request_deadline: float = 8.0  # Seconds an HTTP request may spend waiting on the database; 0 disables
+    db_bulk_write_deadline: float = 300.0  # Seconds insert_many/upsert_many/delete_in may run, in place of the request deadline; 0 disables
+    db_retry_attempts: int = 3  # Attempts per query, including the first
+    db_retry_backoff: float = 0.25  # Base of the jittered exponential backoff between attempts, in seconds
+    db_retry_max_wait: float = 4.0  # Longest single backoff
+    db_retry_budget_ratio: float = 0.2  # Retries allowed per first attempt, averaged over time
+    db_retry_budget_min_per_second: float = 1.0  # Retries allowed per second regardless of traffic
+    db_retry_budget_max_tokens: float = 20.0  # Retries that may be spent in a burst
+    db_breaker_enabled: bool = True
+    db_breaker_failure_threshold: int = 5  # Consecutive failures on a table that open its breaker
+    db_breaker_reset_timeout: float = 15.0  # Seconds an open breaker fails fast before a trial call
+
+    # Start-up warm-up and readiness (util/startup.py, served on /api/readiness)
+    startup_warmup: bool = True  # Fill the product, parameter and sitemap caches in the background after start-up
+    startup_warmup_timeout: float = 30.0  # Seconds before an unfinished warm-up is abandoned
+    startup_warmup_retry_interval: float = 10.0  # Seconds between retries of warm-up steps that failed or timed out
+    readiness_require_warmup: bool = True  # Report not ready until every warm-up step has succeeded
+    readiness_backend_ttl: float = 5.0  # Seconds a backend probe result is reused by /api/readiness
+    readiness_probe_table: str = "parameters"  # Table queried (one row) to check the backend
+
+    # Change tracking (db/changefeed.py): pushes row changes to the query cache, slug index and sitemap
+    changefeed_mode: str = "auto"  # "auto", "poll" (created_at/updated_at high-water marks), "feed" (the local backend's change log) or "off"
+    changefeed_interval: float = 2.0  # Seconds between polls in each worker
+    changefeed_count_interval: float = 30.0  # Seconds between the exact row counts that reveal deletes to "poll" mode; 0 counts on every poll
+    changefeed_overlap: float = 5.0  # Seconds each "poll" query re-reads behind the high-water marks, for rows committed after later-stamped ones
+    changefeed_max_rows: int = 1000  # Changed rows handled per poll; more is treated as a bulk change and reloads the table
+
+    # Metrics (util/metrics.py, served on /api/metrics)
+    metrics_enabled: bool = True
+    metrics_multiprocess: bool = True  # Merge the metrics of every uvicorn worker through snapshot files
+    metrics_dir: str = ""  # Directory for worker snapshots; defaults to /dev/shm/kparalegal-metrics
+    metrics_flush_interval: float = 5.0  # Seconds between snapshot writes by a worker's flusher thread
+    slow_query_threshold: float = 0.0  # Log database requests slower than this many seconds; 0 disables
+
+    # Read cache (CachingDatabaseManager)
+    cache_enabled: bool = True
+    cache_default_ttl: float = 60.0  # Seconds a cached read is fresh
+    cache_table_ttls: dict[str, float] = {"products": 300.0, "parameters": 300.0}
+    cache_stale_ttl: float = 600.0  # Seconds an expired read may still be served while it refreshes
+    cache_last_good_ttl: float = 3600.0  # Further seconds a read is kept to serve when the database is unavailable
+    cache_max_entries: int = 1024
+    cache_shared_backend: str = "none"  # "none", "memory" (in-process stand-in) or "sqlite" (shared by all workers on the host)
+    cache_shared_path: str = ""  # SQLite file for the "sqlite" backend; defaults to /dev/shm
+    cache_shared_poll_interval: float = 1.0  # Seconds between checks for invalidations made by other workers
+    cache_shared_local_min_bytes: int = 16384  # Shared results smaller than this are read from the store on each use, not also kept in every worker's LRU; 0 keeps all
+
+    # Product slug index (AsyncProductRepository.get_by_slug)
+    slug_index_refresh_interval: float = 60.0  # Seconds between incremental refreshes
+    slug_index_negative_ttl: float = 300.0  # Seconds an unknown slug is remembered as missing
+    slug_index_max_negative: int = 10000
+
+    # Merged per-environment parameter snapshots (AsyncParameterRepository.snapshot)
+    parameter_snapshot_refresh_interval: float = 60.0
+
+    # /api/products pagination
+    products_page_max_limit: int = 500
+
+    # /api/batch (util/batch.py)
+    batch_max_reads: int = 20  # Reads allowed in one batch request
+
+    # sitemap.xml generation
+    sitemap_page_size: int = 1000  # Products fetched per query while streaming
+    sitemap_cache_max_bytes: int = 10_000_000  # Largest sitemap document kept in memory
+
+    # Product search, /api/products/search (util/search.py)
+    search_field_weights: dict[str, float] = {"title": 3.0, "slug": 2.0, "description": 1.0}
+    search_bm25_k1: float = 1.2  # Term frequency saturation
+    search_bm25_b: float = 0.75  # Document length normalization, 0 (none) to 1 (full)
+    search_prefix_min_length: int = 2  # Shorter query words must match whole words
+    search_max_expansions: int = 50  # Index words a query word may expand to by prefix or typo
+    search_max_typos: int = 2  # Edits tolerated in long query words (one from 4 letters, two from 8)
+    search_default_limit: int = 20
+    search_max_limit: int = 100
+
+    # Prerendered product and landing pages (util/prerender.py)
+    prerender_enabled: bool = True
+    prerender_cache_max_entries: int = 2000  # Pages kept in memory
+    prerender_description_length: int = 160  # Characters of the product description in the meta description
+
+    # Static files (util/staticassets.py)
+    static_max_age: int = 3600  # Cache-Control max-age for files that are neither content-hashed bundles nor HTML
+    static_memory_max_bytes: int = 262_144  # Files (and compressed variants) up to this size are served from memory
+    static_compress_max_bytes: int = 8_000_000  # Largest file compressed by a worker when no .br/.gz sibling was built
+
+    # Image variants, /images/{name}?w=&fmt= (util/images.py)
+    image_widths: list[int] = [160, 320, 480, 640, 960, 1280, 1920]  # Requested widths are rounded up to one of these
+    image_quality: dict[str, int] = {"webp": 80, "avif": 60, "jpeg": 82}
+    image_cache_dir: str = ""  # Directory for generated variants; defaults to <temp dir>/kparalegal-images
+    image_cache_max_bytes: int = 500_000_000  # Oldest variants are deleted beyond this size
+    image_workers: int = 2  # Encoder processes per worker
+    image_pregenerate: bool = False  # Generate variants of every product image in the background after start-up
+    image_pregenerate_widths: list[int] = [480, 960]
+    image_pregenerate_formats: list[str] = ["webp"]
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,239 @@
+"""
+util/sitemap.py - Streaming sitemap.xml generation with conditional GET support
+
+Rf: https://www.sitemaps.org/protocol.html
+"""
+import datetime
+import hashlib
+from dataclasses import dataclass, field
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterator, Optional
+from xml.sax.saxutils import escape
+
+from starlette.datastructures import Headers
+from starlette.responses import Response, StreamingResponse
+
+from db.conditions import gt
+from db.repositories.product import AsyncProductRepository
+from util.responses import etag_matches
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+SITEMAP_URL_LIMIT = 50_000  # Protocol limit on <url> entries per sitemap file
+STATIC_PAGES = ['about', 'contact', 'privacy', 'blog', 'services', 'terms']
+STATIC_LASTMOD = datetime.datetime(2026, 2, 7, tzinfo=datetime.timezone.utc)
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+URLSET_OPEN = '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+URLSET_CLOSE = '</urlset>'
+INDEX_OPEN = '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+INDEX_CLOSE = '</sitemapindex>'
+
+
+def is_not_modified(request_headers: Headers, etag: Optional[str], lastmod: datetime.datetime) -> bool:
+    """
+    Whether the client's copy is current: If-None-Match against etag when sent, else If-Modified-Since.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag is None:
+            return if_none_match.strip() == "*"
+        return etag_matches(request_headers, etag)
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return lastmod.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def url_entry(loc: str, lastmod: datetime.datetime) -> str:
+    return f"""   <url>
+        <loc>{escape(loc)}</loc>
+        <lastmod>{lastmod.strftime("%Y-%m-%d")}</lastmod>
+        <changefreq>monthly</changefreq>
+    </url>
+"""
+
+
+@dataclass
+class SitemapVersion:
+    """What is known about the sitemap between two product changes."""
+    lastmod: datetime.datetime
+    parts: int
+    etags: dict[int, str] = field(default_factory=dict)  # Content hash of each document generated
+    documents: dict[int, bytes] = field(default_factory=dict)  # Documents up to sitemap_cache_max_bytes
+
+
+def content_etag(digest: "hashlib._Hash") -> str:
+    return f'"{digest.hexdigest()}"'
+
+
+class SitemapService:
+    """
+    Builds /sitemap.xml from the products table without loading it all at once.
+
+    Products are streamed in pages of ``sitemap_page_size``. When the URLs do not fit in
+    one file, /sitemap.xml becomes a sitemap index pointing at /sitemap-1.xml, /sitemap-2.xml, ...
+    The static pages are listed in the first file.
+
+    The newest change and the number of files are queried once per version, i.e. until
+    the next invalidation (a product write or a change found by the change tracker,
+    including deletes). Each document's ETag is the hash of its content, so conditional
+    requests are answered from the version without touching the database.
+    """
+    def __init__(self, products: AsyncProductRepository, page_size: int = settings.sitemap_page_size, url_limit: int = SITEMAP_URL_LIMIT):
+        self.products = products
+        self.page_size = page_size
+        self.products_per_part = url_limit - len(STATIC_PAGES)
+        self._version: Optional[SitemapVersion] = None
+        self._generation = 0
+        self._changed_at: Optional[datetime.datetime] = None
+
+    def invalidate(self, table: Optional[str] = None) -> None:
+        """
+        Cache invalidation listener: drop the version and its documents when products change.
+        """
+        if table is None or table == self.products.table_name:
+            self._version = None
+            self._generation += 1
+            self._changed_at = datetime.datetime.now(datetime.timezone.utc)
+
+    async def version(self) -> SitemapVersion:
+        """
+        The current version, loaded (newest change and file count) if there is none.
+        """
+        if self._version is not None:
+            return self._version
+        generation = self._generation
+        lastmod = await self.last_modified()
+        version = SitemapVersion(lastmod, await self.part_count())
+        if self._generation == generation:
+            self._version = version
+        return version
+
+    async def last_modified(self) -> datetime.datetime:
+        """
+        Newest change across products (updated_at or created_at) and the static pages.
+        """
+        newest = [STATIC_LASTMOD]
+        for column in ("updated_at", "created_at"):
+            # gt(EPOCH) skips NULLs, which Postgres would otherwise sort first in descending order
+            products = await self.products.select_summaries({column: gt(EPOCH)}, sort_by=column, sort_direction="desc", start=0, end=0)
+            if products:
+                newest.append(getattr(products[0], column))
+        return max(newest)
+
+    async def part_count(self) -> int:
+        """
+        Number of urlset files needed, found by probing for a product at each file boundary.
+        """
+        parts = 1
+        while True:
+            offset = parts * self.products_per_part
+            products = await self.products.select_summaries({}, start=offset, end=offset)
+            if not products:
+                return parts
+            parts += 1
+
+    async def _urlset(self, part: int) -> AsyncIterator[str]:
+        yield URLSET_OPEN
+        if part == 0:
+            yield "".join(url_entry(f"{settings.host_url}/{page}", STATIC_LASTMOD) for page in STATIC_PAGES)
+        offset = part * self.products_per_part
+        end = offset + self.products_per_part
+        while offset < end:
+            page_end = min(offset + self.page_size, end) - 1
+            products = await self.products.select_summaries({}, start=offset, end=page_end)
+            yield "".join(
+                url_entry(f"{settings.host_url}/products/{product.slug}", product.updated_at or product.created_at)
+                for product in products
+            )
+            if len(products) < page_end - offset + 1:
+                break
+            offset = page_end + 1
+        yield URLSET_CLOSE
+
+    async def _index(self, parts: int, lastmod: datetime.datetime) -> AsyncIterator[str]:
+        yield INDEX_OPEN
+        for part in range(parts):
+            yield f"""   <sitemap>
+        <loc>{escape(settings.host_url)}/sitemap-{part + 1}.xml</loc>
+        <lastmod>{lastmod.strftime("%Y-%m-%d")}</lastmod>
+    </sitemap>
+"""
+        yield INDEX_CLOSE
+
+    async def _stream_rest(self, key: int, version: SitemapVersion, buffered: list[bytes], chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+        digest = hashlib.sha1()
+        for data in buffered:
+            digest.update(data)
+            yield data
+        async for chunk in chunks:
+            data = chunk.encode("utf-8")
+            digest.update(data)
+            yield data
+        version.etags[key] = content_etag(digest)
+
+    async def warm(self) -> None:
+        """
+        Generate and cache /sitemap.xml ahead of the first crawler (start-up warm-up).
+        """
+        response = await self.response(Headers())
+        if isinstance(response, StreamingResponse):
+            async for _ in response.body_iterator:
+                pass
+
+    async def response(self, request_headers: Headers, part: Optional[int] = None) -> Response:
+        """
+        Respond with /sitemap.xml (part None) or /sitemap-{part}.xml, honoring
+        If-None-Match and If-Modified-Since.
+
+        :param request_headers: Headers of the incoming request.
+        :type request_headers: Headers
+        :param part: 1-based urlset file number, or None for the top-level sitemap.
+        :type part: Optional[int]
+        :return: A 304, a 404 for a part that does not exist, or the (possibly streamed) XML.
+        :rtype: Response
+        """
+        version = await self.version()
+        key = 0 if part is None else part
+        if part is not None and not 1 <= part <= version.parts:
+            return Response(status_code=404, content="Sitemap not found", media_type="text/plain")
+        # A delete can leave the newest product unchanged, so Last-Modified also covers the last invalidation
+        lastmod = max(version.lastmod, self._changed_at) if self._changed_at is not None else version.lastmod
+        headers = {"Last-Modified": format_datetime(lastmod.astimezone(datetime.timezone.utc), usegmt=True)}
+        etag = version.etags.get(key)
+        if etag is not None:
+            headers["ETag"] = etag
+            if is_not_modified(request_headers, etag, lastmod):
+                return Response(status_code=304, headers=headers)
+            cached = version.documents.get(key)
+            if cached is not None:
+                return Response(content=cached, media_type="application/xml", headers=headers)
+        elif is_not_modified(request_headers, None, lastmod):
+            return Response(status_code=304, headers=headers)
+
+        if part is None:
+            chunks = self._urlset(0) if version.parts == 1 else self._index(version.parts, version.lastmod)
+        else:
+            chunks = self._urlset(part - 1)
+        # Generate up to sitemap_cache_max_bytes before answering: a document that fits is
+        # cached and sent with its ETag, a larger one is streamed and gets its ETag next time.
+        buffered: list[bytes] = []
+        size = 0
+        async for chunk in chunks:
+            data = chunk.encode("utf-8")
+            buffered.append(data)
+            size += len(data)
+            if size > settings.sitemap_cache_max_bytes:
+                return StreamingResponse(self._stream_rest(key, version, buffered, chunks), media_type="application/xml", headers=headers)
+        body = b"".join(buffered)
+        headers["ETag"] = version.etags[key] = content_etag(hashlib.sha1(body))
+        version.documents[key] = body
+        if is_not_modified(request_headers, headers["ETag"], lastmod):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/xml", headers=headers)
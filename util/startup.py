@@ -0,0 +1,165 @@
+"""
+util/startup.py - Background cache warm-up and the readiness verdict served on /api/readiness
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from db.asyncsupabasemanager import AsyncDatabaseManager
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+WarmUpStep = Callable[[], Awaitable[Any]]
+
+
+@dataclass
+class StepStatus:
+    state: str = "pending"  # pending, running, ok, failed or timeout
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+
+
+class StartupState:
+    """
+    Tracks the warm-up of one worker and decides whether it is ready for traffic.
+
+    Liveness (/api/healthcheck) never touches the database; readiness additionally requires
+    every warm-up step to have succeeded (when readiness_require_warmup is set) and a trivial
+    query against the backend to succeed. Failed or timed-out steps are retried in the
+    background every startup_warmup_retry_interval seconds, so a worker whose warm-up hit a
+    transient error becomes ready once a retry succeeds. Backend probes are cached for readiness_backend_ttl
+    seconds and shared by concurrent callers, so frequent probes cost at most one query.
+    """
+    def __init__(self, manager: AsyncDatabaseManager):
+        self.manager = manager
+        self.steps: dict[str, StepStatus] = {}
+        self.warmup_started = False
+        self.warmup_done = False
+        self._backend_ok = False
+        self._backend_error: Optional[str] = "not checked"
+        self._backend_checked: Optional[float] = None
+        self._probe_lock = asyncio.Lock()
+
+    def start_warm_up(self, steps: dict[str, WarmUpStep], timeout: Optional[float] = None) -> "asyncio.Task[None]":
+        """
+        Start warm_up as a background task; the worker reports not ready until it finishes.
+
+        :param steps: Step name to coroutine function.
+        :type steps: dict[str, WarmUpStep]
+        :param timeout: Seconds allowed for the whole warm-up; defaults to startup_warmup_timeout.
+        :type timeout: Optional[float]
+        :return: The warm-up task, to be cancelled on shutdown.
+        :rtype: asyncio.Task
+        """
+        self.warmup_started = True
+        self.steps = {name: StepStatus() for name in steps}
+        return asyncio.create_task(self.warm_up(steps, timeout))
+
+    async def warm_up(self, steps: dict[str, WarmUpStep], timeout: Optional[float] = None) -> None:
+        """
+        Run the warm-up steps concurrently. A failing step is logged and recorded but does not
+        stop the others; steps still running after timeout seconds are cancelled. Steps that did
+        not succeed are then retried every startup_warmup_retry_interval seconds until they do.
+
+        :param steps: Step name to coroutine function.
+        :type steps: dict[str, WarmUpStep]
+        :param timeout: Seconds allowed for the whole warm-up; defaults to startup_warmup_timeout.
+        :type timeout: Optional[float]
+        """
+        timeout = settings.startup_warmup_timeout if timeout is None else timeout
+        self.warmup_started = True
+        self.steps = {name: StepStatus() for name in steps}
+        started = time.monotonic()
+        if await self._run_steps(steps, timeout):
+            LOGGER.info("Warm-up finished in %.2fs.", time.monotonic() - started)
+        self.warmup_done = True
+        while not self.warmup_ok:
+            await asyncio.sleep(settings.startup_warmup_retry_interval)
+            retry = {name: step for name, step in steps.items() if self.steps[name].state != "ok"}
+            LOGGER.info("Retrying warm-up steps: %s", ", ".join(retry))
+            await self._run_steps(retry, timeout)
+
+    async def _run_steps(self, steps: dict[str, WarmUpStep], timeout: float) -> bool:
+        """
+        Run steps concurrently, marking those still unfinished after timeout seconds as timed out.
+
+        :return: True when every step finished within timeout (successfully or not).
+        :rtype: bool
+        """
+        for name in steps:
+            self.steps[name].error = None
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(self._run_step(name, step) for name, step in steps.items())),
+                timeout,
+            )
+            return True
+        except asyncio.TimeoutError:
+            for name in steps:
+                if self.steps[name].state in ("pending", "running"):
+                    self.steps[name].state = "timeout"
+            LOGGER.warning("Warm-up abandoned after %.1fs: %s", timeout, self.steps)
+            return False
+
+    @property
+    def warmup_ok(self) -> bool:
+        """True once the warm-up has finished and every step succeeded."""
+        return self.warmup_done and all(status.state == "ok" for status in self.steps.values())
+
+    async def _run_step(self, name: str, step: WarmUpStep) -> None:
+        status = self.steps[name]
+        status.state = "running"
+        started = time.monotonic()
+        try:
+            await step()
+            status.state = "ok"
+        except Exception as e:
+            status.state = "failed"
+            status.error = str(e) or type(e).__name__
+            LOGGER.warning("Warm-up step '%s' failed: %s", name, status.error)
+        finally:
+            status.seconds = round(time.monotonic() - started, 4)
+
+    async def check_backend(self) -> bool:
+        """
+        Probe the backend with a one-row query, reusing a result younger than readiness_backend_ttl.
+
+        :return: True when the backend answered.
+        :rtype: bool
+        """
+        async with self._probe_lock:
+            now = time.monotonic()
+            if self._backend_checked is not None and now - self._backend_checked < settings.readiness_backend_ttl:
+                return self._backend_ok
+            try:
+                await asyncio.wait_for(self.manager.ping(settings.readiness_probe_table), settings.db_timeout)
+                self._backend_ok, self._backend_error = True, None
+            except Exception as e:
+                self._backend_ok, self._backend_error = False, str(e) or type(e).__name__
+                LOGGER.warning("Readiness probe failed: %s", self._backend_error)
+            self._backend_checked = time.monotonic()
+            return self._backend_ok
+
+    async def readiness(self) -> tuple[bool, dict[str, Any]]:
+        """
+        Decide whether this worker should receive traffic.
+
+        :return: The verdict and a report of the warm-up steps and backend status.
+        :rtype: tuple[bool, dict[str, Any]]
+        """
+        backend_ok = await self.check_backend()
+        warmed = self.warmup_ok or not self.warmup_started or not settings.readiness_require_warmup
+        ready = backend_ok and warmed
+        return ready, {
+            "status": "ready" if ready else "not_ready",
+            "warmup": {
+                "started": self.warmup_started,
+                "done": self.warmup_done,
+                "ok": self.warmup_ok,
+                "steps": {name: vars(status) for name, status in self.steps.items()},
+            },
+            "backend": {"ok": backend_ok, "error": self._backend_error},
+        }
@@ -0,0 +1,329 @@
+"""
+util/staticassets.py - Static files with precompressed variants, long-lived caching and in-memory small files
+
+AssetFiles is a drop-in StaticFiles (same path checks, html mode, Range and If-Range
+handling) that also:
+
+* serves a brotli or gzip variant chosen by Accept-Encoding, taken from a ``.br``/``.gz``
+  sibling written at build time (``python -m util.staticassets dist``) or compressed once
+  per worker, in the lookup thread or during the start-up warm-up;
+* marks content-hashed Vite bundles (``assets/index-B3xQ1abc.js``, only under the build's
+  assets directory) ``immutable`` for a year,
+  makes HTML revalidate on every use, and gives everything else ``static_max_age``;
+* keeps files up to ``static_memory_max_bytes`` (index.html, icons, small bundles) in
+  memory with a content-hash ETag instead of reading them for every request.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+import sys
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from typing import Optional
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from util.settings import settings
+from util.loggerfactory import LoggerFactory
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are produced
+    brotli = None
+
+LOGGER = LoggerFactory.create_logger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+HTML_CACHE_CONTROL = "no-cache"
+# Vite names emitted files <name>-<8 character base64url hash>.<ext> in build.assetsDir
+HASHED_NAME = re.compile(r"-[A-Za-z0-9_-]{8}\.(?:m?js|css|map|wasm|woff2?|ttf|otf|png|jpe?g|gif|svg|webp|avif|ico)$")
+COMPRESSIBLE_TYPES = {
+    "application/javascript", "application/json", "application/manifest+json", "application/wasm",
+    "application/xml", "image/svg+xml", "image/x-icon", "image/vnd.microsoft.icon", "font/ttf", "font/otf",
+}
+MIN_COMPRESS_BYTES = 1024  # Smaller files gain less than the Content-Encoding header costs
+ENCODINGS = {"br": ".br", "gzip": ".gz"}  # In order of preference
+GZIP_LEVEL = 9
+BROTLI_BUILD_QUALITY = 11
+BROTLI_RUNTIME_QUALITY = 5  # Compressing in a worker should take milliseconds, not seconds
+
+
+def is_compressible(media_type: str) -> bool:
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+
+
+def compress(data: bytes, encoding: str, build: bool = False) -> Optional[bytes]:
+    """
+    Compress data with encoding ("br" or "gzip"), or return None if the encoder is not installed.
+    """
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(data, quality=BROTLI_BUILD_QUALITY if build else BROTLI_RUNTIME_QUALITY)
+    return None
+
+
+def choose_encoding(accept_encoding: str, available: list[str]) -> Optional[str]:
+    """
+    Pick the most preferred of available (in ENCODINGS order) that accept_encoding allows.
+
+    :param accept_encoding: The Accept-Encoding request header.
+    :type accept_encoding: str
+    :param available: Encodings the asset has a variant for.
+    :type available: list[str]
+    :return: The encoding to serve, or None for the identity encoding.
+    :rtype: Optional[str]
+    """
+    weights: dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip()] = weight
+    for encoding in ENCODINGS:
+        if encoding in available and weights.get(encoding, weights.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+@dataclass
+class Variant:
+    body: Optional[bytes]  # None when it is served from path
+    path: str
+    size: int
+
+
+@dataclass
+class StaticAsset:
+    """What is known about one file, valid while its size and mtime do not change."""
+    mtime_ns: int
+    size: int
+    media_type: str
+    cache_control: str
+    compressible: bool
+    etag: Optional[str] = None  # Content hash when the file was read; else FileResponse's stat-based ETag
+    last_modified: str = ""
+    body: Optional[bytes] = None
+    variants: dict[str, Variant] = field(default_factory=dict)
+
+
+class AssetFiles(StaticFiles):
+    """
+    StaticFiles serving precompressed variants and cache headers; see the module docstring.
+
+    :param directory: Directory to serve.
+    :type directory: str
+    :param html: Serve index.html for directories (and 404.html for misses), as StaticFiles.
+    :type html: bool
+    :param max_age: Cache-Control max-age for files that are neither hashed nor HTML.
+    :type max_age: int
+    :param hashed_dir: Subdirectory holding content-hashed build output (Vite's "assets"),
+        whose hash-named files are served immutable; None for none.
+    :type hashed_dir: Optional[str]
+    """
+    def __init__(self, directory: str, html: bool = False, max_age: int = settings.static_max_age, hashed_dir: Optional[str] = None):
+        super().__init__(directory=directory, html=html)
+        self.root = str(directory)
+        self.max_age = max_age
+        self.hashed_root = os.path.join(os.path.realpath(self.root), hashed_dir, "") if hashed_dir else None
+        self._assets: dict[str, StaticAsset] = {}
+
+    def is_hashed(self, full_path: str) -> bool:
+        """
+        Whether full_path is a content-hashed build file, which never changes under its name.
+        """
+        if self.hashed_root is None or not os.path.realpath(full_path).startswith(self.hashed_root):
+            return False
+        return HASHED_NAME.search(os.path.basename(full_path)) is not None
+
+    def cache_control(self, full_path: str, media_type: str) -> str:
+        if self.is_hashed(full_path):
+            return IMMUTABLE_CACHE_CONTROL
+        if media_type == "text/html":
+            return HTML_CACHE_CONTROL
+        return f"public, max-age={self.max_age}"
+
+    def _load_variant(self, full_path: str, stat_result: os.stat_result, encoding: str, data: Optional[bytes]) -> Optional[Variant]:
+        sibling = full_path + ENCODINGS[encoding]
+        try:
+            sibling_stat = os.stat(sibling)
+        except OSError:
+            sibling_stat = None
+        if sibling_stat is not None and sibling_stat.st_mtime_ns >= stat_result.st_mtime_ns:
+            if sibling_stat.st_size > settings.static_memory_max_bytes:
+                return Variant(None, sibling, sibling_stat.st_size)
+            with open(sibling, "rb") as f:
+                body = f.read()
+            return Variant(body, sibling, len(body))
+        if data is None:
+            return None
+        body = compress(data, encoding)
+        if body is None or len(body) >= len(data) * 0.9:
+            return None
+        return Variant(body, sibling, len(body))
+
+    def _load_asset(self, full_path: str, stat_result: os.stat_result) -> StaticAsset:
+        media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        asset = StaticAsset(
+            mtime_ns=stat_result.st_mtime_ns,
+            size=stat_result.st_size,
+            media_type=media_type,
+            cache_control=self.cache_control(full_path, media_type),
+            compressible=is_compressible(media_type) and stat_result.st_size >= MIN_COMPRESS_BYTES,
+            last_modified=formatdate(stat_result.st_mtime, usegmt=True),
+        )
+        data: Optional[bytes] = None
+        if stat_result.st_size <= max(settings.static_memory_max_bytes, settings.static_compress_max_bytes if asset.compressible else 0):
+            with open(full_path, "rb") as f:
+                data = f.read()
+            asset.etag = '"' + hashlib.blake2b(data, digest_size=16).hexdigest() + '"'
+            if len(data) <= settings.static_memory_max_bytes:
+                asset.body = data
+        if asset.compressible:
+            for encoding in ENCODINGS:
+                variant = self._load_variant(full_path, stat_result, encoding, data)
+                if variant is not None:
+                    asset.variants[encoding] = variant
+        return asset
+
+    def asset(self, full_path: str, stat_result: os.stat_result) -> StaticAsset:
+        """
+        The StaticAsset for a file, built on first use (blocking: call from a thread).
+        """
+        asset = self._assets.get(full_path)
+        if asset is None or asset.mtime_ns != stat_result.st_mtime_ns or asset.size != stat_result.st_size:
+            asset = self._load_asset(full_path, stat_result)
+            self._assets[full_path] = asset
+        return asset
+
+    def lookup_path(self, path: str) -> tuple[str, Optional[os.stat_result]]:
+        # Runs in a worker thread, so reading and compressing a file on first use never blocks the event loop
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            self.asset(full_path, stat_result)
+        return full_path, stat_result
+
+    def file_response(self, full_path: "os.PathLike[str] | str", stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        asset = self._assets.get(str(full_path))
+        if asset is None or asset.mtime_ns != stat_result.st_mtime_ns:
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        headers = {"cache-control": asset.cache_control, "last-modified": asset.last_modified}
+        if asset.etag:
+            headers["etag"] = asset.etag
+        if asset.compressible:
+            headers["vary"] = "Accept-Encoding"
+        # Ranges address the identity encoding, which FileResponse serves from disk
+        ranged = "range" in request_headers and status_code == 200
+        encoding = None if ranged else choose_encoding(request_headers.get("accept-encoding", ""), list(asset.variants))
+
+        response: Response
+        if encoding is not None:
+            variant = asset.variants[encoding]
+            headers["content-encoding"] = encoding
+            if asset.etag:
+                headers["etag"] = f'{asset.etag[:-1]}-{encoding}"'
+            if variant.body is not None:
+                response = Response(variant.body, status_code, headers, asset.media_type)
+            else:
+                response = FileResponse(variant.path, status_code, headers, asset.media_type, stat_result=os.stat(variant.path))
+        elif asset.body is not None and not ranged:
+            response = Response(asset.body, status_code, {**headers, "accept-ranges": "bytes"}, asset.media_type)
+        else:
+            response = FileResponse(full_path, status_code, headers, asset.media_type, stat_result=stat_result)
+
+        if status_code == 200 and self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    async def index_response(self, scope: Scope) -> Response:
+        """
+        Respond with the directory's index.html (from memory), e.g. for SPA deep links.
+
+        :raises HTTPException: 404 if there is no index.html.
+        """
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, "index.html")
+        if stat_result is None:
+            raise HTTPException(status_code=404)
+        return self.file_response(full_path, stat_result, scope)
+
+    def precompress(self) -> int:
+        """
+        Load every file under the directory (blocking: run it in a thread at start-up),
+        so the first requests find their variants ready.
+
+        :return: Number of files loaded.
+        :rtype: int
+        """
+        loaded = 0
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(tuple(ENCODINGS.values())):
+                    continue
+                full_path = os.path.join(folder, name)
+                self.asset(full_path, os.stat(full_path))
+                loaded += 1
+        LOGGER.debug("Loaded %d static files from %s.", loaded, self.root)
+        return loaded
+
+    async def warm(self) -> None:
+        """Start-up warm-up step running precompress in a thread."""
+        await anyio.to_thread.run_sync(self.precompress)
+
+
+def write_variants(directory: str) -> int:
+    """
+    Write .br and .gz siblings, at the highest compression levels, for every compressible
+    file under directory that lacks an up-to-date one. Meant for build time, e.g. after
+    ``npm run build``.
+
+    :return: Number of files written.
+    :rtype: int
+    """
+    written = 0
+    for folder, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith(tuple(ENCODINGS.values())):
+                continue
+            full_path = os.path.join(folder, name)
+            media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+            stat_result = os.stat(full_path)
+            if not is_compressible(media_type) or stat_result.st_size < MIN_COMPRESS_BYTES:
+                continue
+            data: Optional[bytes] = None
+            for encoding, suffix in ENCODINGS.items():
+                target = full_path + suffix
+                if os.path.exists(target) and os.stat(target).st_mtime_ns >= stat_result.st_mtime_ns:
+                    continue
+                if data is None:
+                    with open(full_path, "rb") as f:
+                        data = f.read()
+                body = compress(data, encoding, build=True)
+                if body is None or len(body) >= len(data) * 0.9:
+                    continue
+                with open(target, "wb") as f:
+                    f.write(body)
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    if brotli is None:
+        LOGGER.warning("brotli is not installed; writing gzip variants only.")
+    for directory in sys.argv[1:] or ["dist"]:
+        LOGGER.info("Wrote %d compressed variants under %s.", write_variants(directory), directory)